@@ -150,6 +150,9 @@ def generate_safe_exception_message(operation_name, excep):
         reason = cio.reason
         status = 400
 
+    except exception.InvalidMarker:
+        reason = u._("Paging marker supplied was not valid")
+        status = 400
     except exception.NoDataToProcess:
         reason = u._("No information provided to process")
         status = 400
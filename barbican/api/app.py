@@ -57,6 +57,50 @@ class JSONErrorHook(pecan.hooks.PecanHook):
             return exc.body
 
 
+class SQLStatsHook(pecan.hooks.PecanHook):
+    """Collects statistics on the SQL statements each request executes.
+
+    The statistics are attached to the request context and logged. In debug
+    mode they are also returned as response headers.
+    """
+
+    def on_route(self, state):
+        repositories.reset_query_stats()
+
+    def after(self, state):
+        # Pecan also runs after() for requests that failed, so the stats are
+        # always cleared here, before this thread serves anything else.
+        stats = repositories.get_query_stats()
+        repositories.clear_query_stats()
+        if stats is None:
+            return
+        ctx = state.request.environ.get('barbican.context')
+        if ctx:
+            ctx.sql_stats = stats
+        repositories.log_query_stats('{0} {1}'.format(state.request.method,
+                                                      state.request.path),
+                                     stats)
+        if cfg.CONF.debug:
+            state.response.headers['X-Barbican-SQL-Queries'] = str(
+                stats.count)
+            state.response.headers['X-Barbican-SQL-Time'] = '{0:.6f}'.format(
+                stats.total_seconds)
+
+
+def _request_keystone_id():
+    """Returns the project of the current request, if known."""
+    ctx = pecan.request.environ.get('barbican.context')
+    return ctx.tenant if ctx else None
+
+
+def _start():
+    repositories.start(keystone_id=_request_keystone_id())
+
+
+def _start_read_only():
+    repositories.start_read_only(keystone_id=_request_keystone_id())
+
+
 class PecanAPI(pecan.Pecan):
 
     # For performance testing only
@@ -64,11 +108,13 @@ class PecanAPI(pecan.Pecan):
     performance_controller = performance.PerformanceController()
 
     def __init__(self, *args, **kwargs):
-        hooks = [JSONErrorHook()]
+        # SQLStatsHook comes first so that its after() runs last, once the
+        # transaction has been committed.
+        hooks = [SQLStatsHook(), JSONErrorHook()]
         if kwargs.pop('is_transactional', None):
             transaction_hook = pecan.hooks.TransactionHook(
-                repositories.start,
-                repositories.start_read_only,
+                _start,
+                _start_read_only,
                 repositories.commit,
                 repositories.rollback,
                 repositories.clear
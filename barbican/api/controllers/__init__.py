@@ -59,6 +59,16 @@ def _do_enforce_rbac(req, action_name, ctx):
                                         do_raise=True)
 
 
+def check_rbac(action_name):
+    """Enforces RBAC for an action on the current request.
+
+    For REST verb methods whose required access depends on the request's
+    content, in addition to what the enforce_rbac() decorator checks.
+    """
+    _do_enforce_rbac(pecan.request, action_name,
+                     _get_barbican_context(pecan.request))
+
+
 def enforce_rbac(action_name='default'):
     """Decorator handling RBAC enforcement on behalf of REST verb methods."""
 
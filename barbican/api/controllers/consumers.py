@@ -86,29 +86,36 @@ class ContainerConsumersController(object):
         except exception.NotFound:
             controllers.containers.container_not_found()
 
+        marker = kw.get('marker')
         result = self.consumer_repo.get_by_container_id(
             self.container_id,
             offset_arg=kw.get('offset', 0),
             limit_arg=kw.get('limit', None),
-            suppress_exception=True
+            suppress_exception=True,
+            marker_arg=marker
         )
 
         consumers, offset, limit, total = result
 
         if not consumers:
-            resp_ctrs_overall = {'consumers': [], 'total': total}
+            resp_ctrs_overall = {'consumers': []}
         else:
             resp_ctrs = [
                 hrefs.convert_to_hrefs(c.to_dict_fields())
                 for c in consumers
             ]
+            markers = None
+            if marker is not None:
+                markers = repo.get_paging_markers(consumers, marker, limit)
             resp_ctrs_overall = hrefs.add_nav_hrefs(
                 'consumers',
                 offset,
                 limit,
                 total,
-                {'consumers': resp_ctrs}
+                {'consumers': resp_ctrs},
+                markers=markers
             )
+        if total is not None:
             resp_ctrs_overall.update({'total': total})
 
         return resp_ctrs_overall
@@ -33,6 +33,11 @@ def container_not_found():
                          'another castle.'))
 
 
+def _include_consumers(kwargs):
+    """Returns False if the request asks to leave out container consumers."""
+    return kwargs.get('include_consumers', 'true').lower() != 'false'
+
+
 class ContainerController(object):
     """Handles Container entity retrieval and deletion requests."""
 
@@ -51,14 +56,15 @@ class ContainerController(object):
     @pecan.expose(generic=True, template='json')
     @controllers.handle_exceptions(u._('Container retrieval'))
     @controllers.enforce_rbac('container:get')
-    def index(self, keystone_id):
+    def index(self, keystone_id, **kwargs):
         container = self.container_repo.get(entity_id=self.container_id,
                                             keystone_id=keystone_id,
                                             suppress_exception=True)
         if not container:
             container_not_found()
 
-        dict_fields = container.to_dict_fields()
+        dict_fields = container.to_dict_fields(
+            include_consumers=_include_consumers(kwargs))
 
         for secret_ref in dict_fields['secret_refs']:
             hrefs.convert_to_hrefs(secret_ref)
@@ -106,20 +112,25 @@ class ContainersController(object):
         LOG.debug('Start containers on_get '
                   'for tenant-ID %s:', keystone_id)
 
+        marker = kw.get('marker')
+        include_consumers = _include_consumers(kw)
         result = self.container_repo.get_by_create_date(
             keystone_id,
             offset_arg=kw.get('offset', 0),
             limit_arg=kw.get('limit', None),
-            suppress_exception=True
+            suppress_exception=True,
+            marker_arg=marker,
+            include_consumers=include_consumers
         )
 
         containers, offset, limit, total = result
 
         if not containers:
-            resp_ctrs_overall = {'containers': [], 'total': total}
+            resp_ctrs_overall = {'containers': []}
         else:
             resp_ctrs = [
-                hrefs.convert_to_hrefs(c.to_dict_fields())
+                hrefs.convert_to_hrefs(c.to_dict_fields(
+                    include_consumers=include_consumers))
                 for c in containers
             ]
 
@@ -127,13 +138,18 @@ class ContainersController(object):
                 for secret_ref in ctr.get('secret_refs', []):
                     hrefs.convert_to_hrefs(secret_ref)
 
+            markers = None
+            if marker is not None:
+                markers = repo.get_paging_markers(containers, marker, limit)
             resp_ctrs_overall = hrefs.add_nav_hrefs(
                 'containers',
                 offset,
                 limit,
                 total,
-                {'containers': resp_ctrs}
+                {'containers': resp_ctrs},
+                markers=markers
             )
+        if total is not None:
             resp_ctrs_overall.update({'total': total})
 
         return resp_ctrs_overall
@@ -152,16 +168,19 @@ class ContainersController(object):
         new_container = models.Container(data)
         new_container.tenant_id = tenant.id
 
-        # TODO(hgedikli): performance optimizations
-        for secret_ref in new_container.container_secrets:
-            secret = self.secret_repo.get(entity_id=secret_ref.secret_id,
-                                          keystone_id=keystone_id,
-                                          suppress_exception=True)
-            if not secret:
-                # This only partially localizes the error message and
-                # doesn't localize secret_ref.name.
-                pecan.abort(404, u._("Secret provided for '{0}' doesn't"
-                                     " exist.").format(secret_ref.name))
+        missing_ids = self.secret_repo.get_missing_ids(
+            keystone_id,
+            [secret_ref.secret_id
+             for secret_ref in new_container.container_secrets])
+        if missing_ids:
+            # This only partially localizes the error message and
+            # doesn't localize secret_ref.name.
+            missing_names = ', '.join(
+                "'{0}'".format(secret_ref.name)
+                for secret_ref in new_container.container_secrets
+                if secret_ref.secret_id in missing_ids)
+            pecan.abort(404, u._("Secret provided for {0} doesn't"
+                                 " exist.").format(missing_names))
 
         self.container_repo.create_from(new_container)
 
@@ -173,22 +173,28 @@ class OrdersController(object):
         LOG.debug('Start orders on_get '
                   'for tenant-ID %s:', keystone_id)
 
+        marker = kw.get('marker')
         result = self.order_repo.get_by_create_date(
             keystone_id, offset_arg=kw.get('offset', 0),
-            limit_arg=kw.get('limit', None), suppress_exception=True)
+            limit_arg=kw.get('limit', None), suppress_exception=True,
+            marker_arg=marker)
         orders, offset, limit, total = result
 
         if not orders:
-            orders_resp_overall = {'orders': [],
-                                   'total': total}
+            orders_resp_overall = {'orders': []}
         else:
             orders_resp = [
                 hrefs.convert_to_hrefs(o.to_dict_fields())
                 for o in orders
             ]
+            markers = None
+            if marker is not None:
+                markers = repo.get_paging_markers(orders, marker, limit)
             orders_resp_overall = hrefs.add_nav_hrefs('orders',
                                                       offset, limit, total,
-                                                      {'orders': orders_resp})
+                                                      {'orders': orders_resp},
+                                                      markers=markers)
+        if total is not None:
             orders_resp_overall.update({'total': total})
 
         return orders_resp_overall
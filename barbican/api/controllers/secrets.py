@@ -10,6 +10,7 @@
 #  License for the specific language governing permissions and limitations
 #  under the License.
 
+import base64
 import mimetypes
 import urllib
 
@@ -26,6 +27,7 @@ from barbican.model import repositories as repo
 from barbican.openstack.common import gettextutils as u
 from barbican.plugin import resources as plugin
 from barbican.plugin import util as putil
+from barbican.plugin.util import translations as tr
 
 
 LOG = utils.getLogger(__name__)
@@ -186,6 +188,144 @@ class SecretController(object):
         plugin.delete_secret(secret_model, keystone_id, self.repos)
 
 
+def _get_secret_id_from_ref(secret_ref):
+    """Returns the secret id at the end of a secret reference."""
+    return secret_ref.rstrip('/').rsplit('/', 1)[-1]
+
+
+def _batch_item_error(secret_ref, status, message):
+    return {'secret_ref': secret_ref,
+            'error': {'code': status, 'message': message}}
+
+
+class SecretsBatchGetController(object):
+    """Handles batch Secret retrieval requests.
+
+    The secrets referenced by a request are loaded with a single query, and
+    errors retrieving any one secret are reported in its entry of the
+    response rather than failing the whole request.
+    """
+
+    def __init__(self, repos):
+        LOG.debug('=== Creating SecretsBatchGetController ===')
+        self.validator = validators.SecretBatchGetValidator()
+        self.repos = repos
+
+    @pecan.expose(generic=True)
+    def index(self, **kwargs):
+        pecan.abort(405, u._("Batch secret retrieval only supports POST."))
+
+    @index.when(method='POST', template='json')
+    @controllers.handle_exceptions(u._('Secret(s) batch retrieval'))
+    @controllers.enforce_rbac('secret:get')
+    @controllers.enforce_content_types(['application/json'])
+    def on_post(self, keystone_id, **kwargs):
+        data = api.load_body(pecan.request, validator=self.validator)
+        secret_refs = data['secret_refs']
+        include_payload = data.get('include_payload', False)
+        if include_payload:
+            controllers.check_rbac('secret:decrypt')
+
+        LOG.debug('Start batch retrieval of %s secrets for tenant-ID %s:',
+                  len(secret_refs), keystone_id)
+
+        secrets = self.repos.secret_repo.get_by_ids(
+            keystone_id,
+            [_get_secret_id_from_ref(ref) for ref in secret_refs],
+            load_payloads=include_payload)
+
+        retrieved = dict((secret.id, (secret, None, None, None))
+                         for secret in secrets)
+        if include_payload and secrets:
+            tenant = res.get_or_create_tenant(keystone_id,
+                                              self.repos.tenant_repo)
+            retrieved.update((result[0].id, result)
+                             for result in plugin.get_secrets(secrets, tenant))
+
+        return {'secrets': [
+            self._get_item(ref, retrieved.get(_get_secret_id_from_ref(ref)))
+            for ref in secret_refs]}
+
+    def _get_item(self, secret_ref, result):
+        if result is None:
+            return _batch_item_error(secret_ref, 404,
+                                     u._('Not Found. Sorry but your secret '
+                                         'is in another castle.'))
+
+        secret, secret_dto, secret_metadata, error = result
+        if error is None:
+            try:
+                item = hrefs.convert_to_hrefs(
+                    putil.mime_types.augment_fields_with_content_types(secret))
+                if secret_dto is not None:
+                    item.update(self._get_payload_fields(secret_dto,
+                                                         secret_metadata))
+                return item
+            except Exception as e:
+                error = e
+
+        status, message = api.generate_safe_exception_message(
+            u._('Secret retrieval'), error)
+        LOG.error(message)
+        return _batch_item_error(secret_ref, status, message)
+
+    def _get_payload_fields(self, secret_dto, secret_metadata):
+        content_type = (secret_dto.content_type or
+                        secret_metadata.get('content_type'))
+        if content_type in putil.mime_types.PLAIN_TEXT:
+            return {
+                'payload': tr.denormalize_after_decryption(secret_dto.secret,
+                                                           content_type),
+                'payload_content_type': content_type
+            }
+        return {
+            'payload': base64.b64encode(secret_dto.secret),
+            'payload_content_type': content_type,
+            'payload_content_encoding': 'base64'
+        }
+
+
+class SecretsBatchCreateController(object):
+    """Handles bulk Secret creation requests.
+
+    All secrets of a request are created in a single transaction, so that
+    either all or none of them are created.
+    """
+
+    def __init__(self, repos):
+        LOG.debug('=== Creating SecretsBatchCreateController ===')
+        self.validator = validators.SecretBatchCreateValidator()
+        self.repos = repos
+
+    @pecan.expose(generic=True)
+    def index(self, **kwargs):
+        pecan.abort(405, u._("Bulk secret creation only supports POST."))
+
+    @index.when(method='POST', template='json')
+    @controllers.handle_exceptions(u._('Secret(s) bulk creation'))
+    @controllers.enforce_rbac('secrets:post')
+    @controllers.enforce_content_types(['application/json'])
+    def on_post(self, keystone_id, **kwargs):
+        data = api.load_body(pecan.request, validator=self.validator)
+        LOG.debug('Start bulk creation of %s secrets for tenant-ID %s:',
+                  len(data['secrets']), keystone_id)
+
+        tenant = res.get_or_create_tenant(keystone_id, self.repos.tenant_repo)
+        results = plugin.store_secrets(data['secrets'], tenant, self.repos)
+
+        pecan.response.status = 201
+        return {'secrets': [
+            self._get_item(secret, transport_key_model)
+            for secret, transport_key_model in results]}
+
+    def _get_item(self, secret, transport_key_model):
+        item = {'secret_ref': hrefs.convert_secret_to_href(secret.id)}
+        if transport_key_model is not None:
+            item['transport_key_ref'] = hrefs.convert_transport_key_to_href(
+                transport_key_model.id)
+        return item
+
+
 class SecretsController(object):
     """Handles Secret creation requests."""
 
@@ -205,6 +345,10 @@ class SecretsController(object):
 
     @pecan.expose()
     def _lookup(self, secret_id, *remainder):
+        if secret_id == 'batch-get':
+            return SecretsBatchGetController(self.repos), remainder
+        if secret_id == 'batch-create':
+            return SecretsBatchCreateController(self.repos), remainder
         return SecretController(secret_id,
                                 self.repos.tenant_repo,
                                 self.repos.secret_repo,
@@ -235,6 +379,7 @@ class SecretsController(object):
             # the default should be used.
             bits = 0
 
+        marker = kw.get('marker')
         result = self.repos.secret_repo.get_by_create_date(
             keystone_id,
             offset_arg=kw.get('offset', 0),
@@ -243,23 +388,28 @@ class SecretsController(object):
             alg=kw.get('alg'),
             mode=kw.get('mode'),
             bits=bits,
-            suppress_exception=True
+            suppress_exception=True,
+            marker_arg=marker
         )
 
         secrets, offset, limit, total = result
 
         if not secrets:
-            secrets_resp_overall = {'secrets': [],
-                                    'total': total}
+            secrets_resp_overall = {'secrets': []}
         else:
             secrets_resp = [
                 hrefs.convert_to_hrefs(secret_fields(s))
                 for s in secrets
             ]
+            markers = None
+            if marker is not None:
+                markers = repo.get_paging_markers(secrets, marker, limit)
             secrets_resp_overall = hrefs.add_nav_hrefs(
                 'secrets', offset, limit, total,
-                {'secrets': secrets_resp}
+                {'secrets': secrets_resp},
+                markers=markers
             )
+        if total is not None:
             secrets_resp_overall.update({'total': total})
 
         return secrets_resp_overall
@@ -142,6 +142,10 @@ class InvalidFilterRangeValue(Invalid):
     message = u._("Unable to filter using the specified range.")
 
 
+class InvalidMarker(Invalid):
+    message = u._("Paging marker supplied was not valid.")
+
+
 class ReadonlyProperty(Forbidden):
     message = u._("Attribute '%(property)s' is read-only.")
 
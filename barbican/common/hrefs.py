@@ -73,54 +73,88 @@ def convert_to_hrefs(fields):
     return fields
 
 
-def convert_list_to_href(resources_name, offset, limit):
+def convert_list_to_href(resources_name, offset, limit, marker=None):
     """Supports pretty output of paged-list hrefs.
 
-    Convert the offset/limit info to a HATEOS-style href
-    suitable for use in a list navigation paging interface.
+    Convert the offset/limit info, or the limit/marker info if a marker is
+    given, to a HATEOS-style href suitable for use in a list navigation
+    paging interface.
     """
-    resource = '{0}?limit={1}&offset={2}'.format(resources_name, limit,
-                                                 offset)
+    if marker is not None:
+        resource = '{0}?limit={1}&marker={2}'.format(resources_name, limit,
+                                                     marker)
+    else:
+        resource = '{0}?limit={1}&offset={2}'.format(resources_name, limit,
+                                                     offset)
     return utils.hostname_for_refs(resource=resource)
 
 
-def previous_href(resources_name, offset, limit):
+def previous_href(resources_name, offset, limit, marker=None):
     """Supports pretty output of previous-page hrefs.
 
     Create a HATEOS-style 'previous' href suitable for use in a list
     navigation paging interface, assuming the provided values are the
-    currently viewed page.
+    currently viewed page. If a marker is given it must already identify
+    the previous page.
     """
+    if marker is not None:
+        return convert_list_to_href(resources_name, None, limit, marker)
     offset = max(0, offset - limit)
     return convert_list_to_href(resources_name, offset, limit)
 
 
-def next_href(resources_name, offset, limit):
+def next_href(resources_name, offset, limit, marker=None):
     """Supports pretty output of next-page hrefs.
 
     Create a HATEOS-style 'next' href suitable for use in a list
     navigation paging interface, assuming the provided values are the
-    currently viewed page.
+    currently viewed page. If a marker is given it must already identify
+    the next page.
     """
+    if marker is not None:
+        return convert_list_to_href(resources_name, None, limit, marker)
     offset = offset + limit
     return convert_list_to_href(resources_name, offset, limit)
 
 
 def add_nav_hrefs(resources_name, offset, limit,
-                  total_elements, data):
+                  total_elements, data, markers=None):
     """Adds next and/or previous hrefs to paged list responses.
 
     :param resources_name: Name of api resource
     :param offset: Element number (ie. index) where current page starts
     :param limit: Max amount of elements listed on current page
-    :param num_elements: Total number of elements
+    :param num_elements: Total number of elements, or None if unknown, in
+                         which case a full page is taken to mean there may
+                         be a next page
+    :param markers: For pages requested by marker, a (previous, next) tuple
+                    of the markers of the adjacent pages (None where there
+                    is no such page), used instead of the offset and total
     :returns: augmented dictionary with next and/or previous hrefs
     """
+    if markers is not None:
+        previous_marker, next_marker = markers
+        if previous_marker:
+            data.update({'previous': previous_href(resources_name,
+                                                   offset,
+                                                   limit,
+                                                   previous_marker)})
+        if next_marker:
+            data.update({'next': next_href(resources_name,
+                                           offset,
+                                           limit,
+                                           next_marker)})
+        return data
+
     if offset > 0:
         data.update({'previous': previous_href(resources_name,
                                                offset,
                                                limit)})
-    if total_elements > (offset + limit):
+    if total_elements is None:
+        has_next = len(data.get(resources_name, [])) >= limit
+    else:
+        has_next = total_elements > (offset + limit)
+    if has_next:
         data.update({'next': next_href(resources_name,
                                        offset,
                                        limit)})
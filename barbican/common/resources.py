@@ -16,24 +16,96 @@
 """
 Shared business logic.
 """
+import collections
+
+from oslo.config import cfg
+
 from barbican.common import utils
 from barbican.model import models
+from barbican.openstack.common import gettextutils as u
 
 
 LOG = utils.getLogger(__name__)
 
+tenant_cache_opts = [
+    cfg.IntOpt('tenant_cache_size', default=1000,
+               help=u._('Maximum number of keystone_id to tenant mappings '
+                        'cached by each process. 0 disables the cache.')),
+    cfg.IntOpt('tenant_cache_ttl_seconds', default=300,
+               help=u._('Seconds a cached tenant mapping is trusted before '
+                        'it is looked up again. Bounds how long another '
+                        'process may see a deleted project.')),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(tenant_cache_opts)
+
+# Lightweight stand-in for a Tenant row served from the cache. It cannot be
+# added to a session by accident, unlike a detached Tenant model.
+CachedTenant = collections.namedtuple('CachedTenant', ['id', 'keystone_id'])
+
+
+class TenantCache(object):
+    """Bounded LRU cache of keystone_id to tenant, with expiring entries.
+
+    The size and expiry are read from configuration on each call.
+    """
+
+    def __init__(self):
+        self._cache = utils.ExpiringLRUCache(
+            lambda: CONF.tenant_cache_size,
+            lambda: CONF.tenant_cache_ttl_seconds)
+
+    def get(self, keystone_id):
+        """Returns the cached tenant for keystone_id, or None."""
+        return self._cache.get(keystone_id)
+
+    def put(self, tenant):
+        """Caches the id and keystone_id of a tenant."""
+        cached = CachedTenant(id=tenant.id, keystone_id=tenant.keystone_id)
+        self._cache.put(cached.keystone_id, cached)
+
+    def invalidate(self, keystone_id):
+        """Drops the cached tenant for keystone_id, if any."""
+        self._cache.invalidate(keystone_id)
+
+    def clear(self):
+        """Drops all cached tenants and resets the statistics."""
+        self._cache.clear()
+
+    def get_stats(self):
+        """Returns the statistics of the cache, see ExpiringLRUCache."""
+        return self._cache.get_stats()
+
+
+_TENANT_CACHE = TenantCache()
+
+
+def get_tenant_cache():
+    """Returns the process wide keystone_id to tenant cache."""
+    return _TENANT_CACHE
+
 
 def get_or_create_tenant(keystone_id, tenant_repo):
     """Returns tenant with matching keystone_id.
 
-    Creates it if it does not exist.
+    Creates it if it does not exist. Tenants already in the database are
+    cached, in which case a CachedTenant carrying only the id and
+    keystone_id is returned. Newly created tenants are not cached until
+    they are found by a later call, as their transaction may yet roll back.
     :param keystone_id: The external-to-Barbican ID for this tenant.
     :param tenant_repo: Tenant repository.
-    :return: Tenant model instance
+    :return: Tenant model or CachedTenant instance
     """
+    tenant = _TENANT_CACHE.get(keystone_id)
+    if tenant:
+        return tenant
+
     tenant = tenant_repo.find_by_keystone_id(keystone_id,
                                              suppress_exception=True)
-    if not tenant:
+    if tenant:
+        _TENANT_CACHE.put(tenant)
+    else:
         LOG.debug('Creating tenant for %s', keystone_id)
         tenant = models.Tenant()
         tenant.keystone_id = keystone_id
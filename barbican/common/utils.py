@@ -17,6 +17,8 @@
 Common utilities for Barbican.
 """
 
+import collections
+import threading
 import time
 import uuid
 
@@ -158,5 +160,100 @@ class TimeKeeper(object):
                                                    total_elapsed * 1000.))
 
 
+class ExpiringLRUCache(object):
+    """Thread safe, bounded LRU cache whose entries expire.
+
+    The size and time to live are given as callables, so that they can be
+    read from configuration on each call. A size of 0 or less disables the
+    cache.
+
+    :param get_size: Returns the maximum number of entries.
+    :param get_ttl: Returns the seconds an entry is kept.
+    :param on_evict: Optional callable, called with the cache's lock held
+                     with each value dropped from the cache for any reason.
+    """
+
+    def __init__(self, get_size, get_ttl, on_evict=None):
+        self._get_size = get_size
+        self._get_ttl = get_ttl
+        self._on_evict = on_evict
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = collections.defaultdict(int)
+
+    def get(self, key):
+        """Returns the value cached for key, or None."""
+        if self._get_size() <= 0:
+            return None
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            value, expires_at = entry
+            if time.time() >= expires_at:
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                self._dropped(value)
+                return None
+            # Re-inserting marks the entry as the most recently used.
+            self._entries[key] = entry
+            self._stats['hits'] += 1
+            return value
+
+    def put(self, key, value):
+        """Caches value for key, evicting the least recently used entries.
+
+        With the cache disabled, value is dropped right away.
+        """
+        size = self._get_size()
+        expires_at = time.time() + self._get_ttl()
+        with self._lock:
+            if size <= 0:
+                self._dropped(value)
+                return
+            replaced = self._entries.pop(key, None)
+            if replaced is not None and replaced[0] is not value:
+                self._dropped(replaced[0])
+            self._entries[key] = (value, expires_at)
+            while len(self._entries) > size:
+                self._dropped(self._entries.popitem(last=False)[1][0])
+                self._stats['evictions'] += 1
+
+    def invalidate(self, key):
+        """Drops the value cached for key, if any."""
+        self.invalidate_matching(lambda entry_key, value: entry_key == key)
+
+    def invalidate_matching(self, predicate):
+        """Drops the values for which predicate(key, value) is true."""
+        with self._lock:
+            keys = [key for key, (value, _) in self._entries.items()
+                    if predicate(key, value)]
+            for key in keys:
+                self._dropped(self._entries.pop(key)[0])
+                self._stats['invalidations'] += 1
+
+    def clear(self):
+        """Drops all cached values and resets the statistics."""
+        with self._lock:
+            while self._entries:
+                self._dropped(self._entries.popitem()[1][0])
+            self._stats.clear()
+
+    def get_stats(self):
+        """Returns hits, misses, expirations, evictions, invalidations and
+        the current size of the cache.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        return stats
+
+    def _dropped(self, value):
+        if self._on_evict:
+            self._on_evict(value)
+
+
 def generate_uuid():
     return str(uuid.uuid4())
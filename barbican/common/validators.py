@@ -29,9 +29,14 @@ from barbican.plugin.util import mime_types
 
 LOG = utils.getLogger(__name__)
 DEFAULT_MAX_SECRET_BYTES = 10000
+DEFAULT_MAX_SECRETS_PER_BATCH = 100
 common_opts = [
     cfg.IntOpt('max_allowed_secret_in_bytes',
                default=DEFAULT_MAX_SECRET_BYTES),
+    cfg.IntOpt('max_allowed_secrets_per_batch',
+               default=DEFAULT_MAX_SECRETS_PER_BATCH,
+               help='Maximum number of secrets accepted by a single batch '
+                    'secret creation or retrieval request.'),
 ]
 
 CONF = cfg.CONF
@@ -103,6 +108,19 @@ class ValidatorBase(object):
             raise exception.InvalidObject(schema=schema_name, reason=message,
                                           property=property)
 
+    def _assert_batch_size_is_valid(self, batch, schema_name, property):
+        """Assert that a batch request has no more items than allowed.
+
+        :raises: InvalidObject exception if the batch is too large.
+        """
+        max_items = CONF.max_allowed_secrets_per_batch
+        self._assert_validity(
+            len(batch) <= max_items,
+            schema_name,
+            u._("No more than {0} secrets are allowed per batch").format(
+                max_items),
+            property)
+
 
 class NewSecretValidator(ValidatorBase):
     """Validate a new secret."""
@@ -254,6 +272,65 @@ class NewSecretValidator(ValidatorBase):
 
 # TODO(atiwari) - Split this validator module and unit tests
 # into smaller modules
+class SecretBatchGetValidator(ValidatorBase):
+    """Validate a batch secret retrieval request."""
+
+    def __init__(self):
+        self.name = 'Secret Batch'
+        self.schema = {
+            "type": "object",
+            "properties": {
+                "secret_refs": {
+                    "type": "array",
+                    "minItems": 1,
+                    "items": {"type": "string", "minLength": 1}
+                },
+                "include_payload": {"type": "boolean"}
+            },
+            "required": ["secret_refs"]
+        }
+
+    def validate(self, json_data, parent_schema=None):
+        schema_name = self._full_name(parent_schema)
+
+        self._assert_schema_is_valid(json_data, schema_name)
+
+        self._assert_batch_size_is_valid(json_data['secret_refs'],
+                                         schema_name, "secret_refs")
+
+        return json_data
+
+
+class SecretBatchCreateValidator(ValidatorBase):
+    """Validate a bulk secret creation request."""
+
+    def __init__(self):
+        self.name = 'Secret Batch'
+        self.secret_validator = NewSecretValidator()
+        self.schema = {
+            "type": "object",
+            "properties": {
+                "secrets": {
+                    "type": "array",
+                    "minItems": 1,
+                    "items": {"type": "object"}
+                }
+            },
+            "required": ["secrets"]
+        }
+
+    def validate(self, json_data, parent_schema=None):
+        schema_name = self._full_name(parent_schema)
+
+        self._assert_schema_is_valid(json_data, schema_name)
+        self._assert_batch_size_is_valid(json_data['secrets'], schema_name,
+                                         "secrets")
+
+        json_data['secrets'] = [self.secret_validator.validate(secret)
+                                for secret in json_data['secrets']]
+        return json_data
+
+
 class TypeOrderValidator(ValidatorBase):
     """Validate a new typed order."""
 
@@ -42,6 +42,8 @@ class RequestContext(object):
         self.service_catalog = service_catalog
         self.policy_enforcer = policy_enforcer or policy.Enforcer()
         self.is_admin = is_admin
+        # Set to the request's repositories.QueryStats once it is processed.
+        self.sql_stats = None
         # TODO(jwood): Is this needed?
         #        if not self.is_admin:
         #            self.is_admin = self.policy_enforcer.check_is_admin(self)
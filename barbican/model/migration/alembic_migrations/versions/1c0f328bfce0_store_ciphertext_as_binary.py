@@ -0,0 +1,42 @@
+"""Store ciphertext as binary
+
+Revision ID: 1c0f328bfce0
+Revises: 35f9221bb2fb
+Create Date: 2014-10-10 09:12:51.218306
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1c0f328bfce0'
+down_revision = '35f9221bb2fb'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.sql import expression
+
+from barbican.common import exception
+
+
+def upgrade():
+    op.add_column('encrypted_data', sa.Column('cypher_data', sa.LargeBinary(),
+                                              nullable=True))
+
+    # Existing ciphertext is moved from cypher_text to cypher_data
+    # afterwards, online, by 'barbican-db-manage.py migrate_data' (see
+    # barbican.model.repositories.convert_ciphertext()). It commits each
+    # batch, which the single transaction of a migration does not allow.
+    # Both columns are read meanwhile.
+
+
+def downgrade():
+    encrypted_data = expression.table('encrypted_data',
+                                      expression.column('id'),
+                                      expression.column('cypher_data'))
+    con = op.get_bind()
+    if con.execute(sa.select([encrypted_data.c.id]).where(
+            encrypted_data.c.cypher_data != None).limit(1)).first():  # noqa
+        raise exception.BarbicanException(
+            "Ciphertext is still stored in encrypted_data.cypher_data. Run "
+            "'barbican-db-manage.py migrate_data --ciphertext-as-text' "
+            "first.")
+    op.drop_column('encrypted_data', 'cypher_data')
@@ -0,0 +1,107 @@
+"""Add resource counters table
+
+Revision ID: 25d3b86169c6
+Revises: 254495565185
+Create Date: 2014-10-02 10:21:43.512337
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '25d3b86169c6'
+down_revision = '254495565185'
+
+import datetime
+import uuid
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.sql import expression
+
+
+def _count_by(bind, scope_column, table, *where):
+    query = sa.select([scope_column, sa.func.count()]).select_from(table)
+    for clause in where:
+        query = query.where(clause)
+    return dict(bind.execute(query.group_by(scope_column)).fetchall())
+
+
+def upgrade():
+    ctx = op.get_context()
+    con = op.get_bind()
+    table_exists = ctx.dialect.has_table(con.engine, 'resource_counters')
+    if table_exists:
+        return
+
+    resource_counters = op.create_table(
+        'resource_counters',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(), nullable=True),
+        sa.Column('deleted', sa.Boolean(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('scope_id', sa.String(length=36), nullable=False),
+        sa.Column('resource_type', sa.String(length=36), nullable=False),
+        sa.Column('total', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('scope_id', 'resource_type',
+                            name='_resource_counter_scope_type_uc'),
+    )
+
+    # Backfill the counters from the existing, undeleted entities.
+    tenants = expression.table('tenants', expression.column('id'))
+    secrets = expression.table('secrets',
+                               expression.column('id'),
+                               expression.column('deleted'))
+    tenant_secret = expression.table('tenant_secret',
+                                     expression.column('tenant_id'),
+                                     expression.column('secret_id'),
+                                     expression.column('deleted'))
+    orders = expression.table('orders',
+                              expression.column('tenant_id'),
+                              expression.column('deleted'))
+    containers = expression.table('containers',
+                                  expression.column('id'),
+                                  expression.column('tenant_id'),
+                                  expression.column('deleted'))
+    consumers = expression.table('container_consumer_metadata',
+                                 expression.column('container_id'),
+                                 expression.column('deleted'))
+
+    secret_totals = _count_by(
+        con, tenant_secret.c.tenant_id,
+        tenant_secret.join(secrets,
+                           secrets.c.id == tenant_secret.c.secret_id),
+        tenant_secret.c.deleted == sa.false(),
+        secrets.c.deleted == sa.false())
+    order_totals = _count_by(con, orders.c.tenant_id, orders,
+                             orders.c.deleted == sa.false())
+    container_totals = _count_by(con, containers.c.tenant_id, containers,
+                                 containers.c.deleted == sa.false())
+    consumer_totals = _count_by(con, consumers.c.container_id, consumers,
+                                consumers.c.deleted == sa.false())
+
+    scopes = []
+    for (tenant_id,) in con.execute(sa.select([tenants.c.id])):
+        scopes.append((tenant_id, 'secrets', secret_totals))
+        scopes.append((tenant_id, 'orders', order_totals))
+        scopes.append((tenant_id, 'containers', container_totals))
+    for (container_id,) in con.execute(sa.select([containers.c.id])):
+        scopes.append((container_id, 'consumers', consumer_totals))
+
+    now = datetime.datetime.utcnow()
+    rows = [{'id': str(uuid.uuid4()),
+             'created_at': now,
+             'updated_at': now,
+             'deleted': False,
+             'status': 'ACTIVE',
+             'scope_id': scope_id,
+             'resource_type': resource_type,
+             'total': totals.get(scope_id, 0)}
+            for scope_id, resource_type, totals in scopes]
+    if rows:
+        op.bulk_insert(resource_counters, rows)
+
+
+def downgrade():
+    op.drop_table('resource_counters')
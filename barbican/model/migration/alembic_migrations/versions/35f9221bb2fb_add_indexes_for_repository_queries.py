@@ -0,0 +1,42 @@
+"""Add indexes for repository queries
+
+Revision ID: 35f9221bb2fb
+Revises: 74fdbb742748
+Create Date: 2014-10-08 11:05:37.640918
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '35f9221bb2fb'
+down_revision = '74fdbb742748'
+
+from alembic import op
+
+
+# Keep synchronized with the indexes declared by the models.
+INDEXES = [
+    ('orders_tenant_deleted_created_idx', 'orders',
+     ['tenant_id', 'deleted', 'created_at']),
+    ('order_plugin_metadata_order_deleted_idx', 'order_plugin_metadata',
+     ['order_id', 'deleted']),
+    ('containers_tenant_deleted_created_idx', 'containers',
+     ['tenant_id', 'deleted', 'created_at']),
+    ('container_secret_secret_idx', 'container_secret', ['secret_id']),
+    ('secret_store_metadata_secret_deleted_idx', 'secret_store_metadata',
+     ['secret_id', 'deleted']),
+    ('encrypted_data_secret_idx', 'encrypted_data', ['secret_id']),
+    ('kek_data_tenant_plugin_active_idx', 'kek_data',
+     ['tenant_id', 'plugin_name', 'active']),
+    ('transport_keys_plugin_deleted_created_idx', 'transport_keys',
+     ['plugin_name', 'deleted', 'created_at']),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns)
+
+
+def downgrade():
+    for name, table, columns in reversed(INDEXES):
+        op.drop_index(name, table)
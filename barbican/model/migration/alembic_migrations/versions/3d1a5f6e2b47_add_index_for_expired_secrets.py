@@ -0,0 +1,22 @@
+"""Add index for expired secrets
+
+Revision ID: 3d1a5f6e2b47
+Revises: 1c0f328bfce0
+Create Date: 2014-10-14 10:21:04.518733
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3d1a5f6e2b47'
+down_revision = '1c0f328bfce0'
+
+from alembic import op
+
+
+def upgrade():
+    op.create_index('secrets_tenant_deleted_expiration_idx', 'secrets',
+                    ['tenant_id', 'deleted', 'expiration'])
+
+
+def downgrade():
+    op.drop_index('secrets_tenant_deleted_expiration_idx', 'secrets')
@@ -0,0 +1,34 @@
+"""Add tenant_id to secrets
+
+Revision ID: 74fdbb742748
+Revises: 25d3b86169c6
+Create Date: 2014-10-06 15:42:18.067452
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '74fdbb742748'
+down_revision = '25d3b86169c6'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('secrets', sa.Column('tenant_id', sa.String(length=36),
+                                       nullable=True))
+    op.create_foreign_key('secrets_tenant_fk', 'secrets', 'tenants',
+                          ['tenant_id'], ['id'])
+    op.create_index('secrets_tenant_created_idx', 'secrets',
+                    ['tenant_id', 'created_at', 'id'])
+
+    # Existing secrets are backfilled afterwards, online, by
+    # 'barbican-db-manage.py migrate_data' (see
+    # barbican.model.repositories.backfill_secret_tenants()). It commits
+    # each batch, which the single transaction of a migration does not allow.
+
+
+def downgrade():
+    op.drop_index('secrets_tenant_created_idx', 'secrets')
+    op.drop_constraint('secrets_tenant_fk', 'secrets', type_='foreignkey')
+    op.drop_column('secrets', 'tenant_id')
@@ -109,7 +109,12 @@ class ModelBase(object):
         import barbican.model.repositories
         session = session or barbican.model.repositories.get_session()
         session.add(self)
-        session.flush()
+        if barbican.model.repositories.defer_flush(session):
+            # Flushed later, but other entities may need its id now.
+            if not self.id:
+                self.id = utils.generate_uuid()
+        else:
+            session.flush()
 
     def delete(self, session=None):
         """Delete this object."""
@@ -229,7 +234,8 @@ class ContainerSecret(BASE, ModelBase):
         'Secret', backref=orm.backref('container_secrets'))
 
     __table_args__ = (sa.UniqueConstraint('container_id', 'secret_id', 'name',
-                                          name='_container_secret_name_uc'),)
+                                          name='_container_secret_name_uc'),
+                      sa.Index('container_secret_secret_idx', 'secret_id'))
 
 
 class Tenant(BASE, ModelBase):
@@ -270,12 +276,20 @@ class Secret(BASE, ModelBase):
     bit_length = sa.Column(sa.Integer)
     mode = sa.Column(sa.String(255))
 
-    # TODO(jwood): Performance - Consider avoiding full load of all
-    #   datum attributes here. This is only being done to support the
-    #   building of the list of supported content types when secret
-    #   metadata is retrieved.
-    #   See barbican.api.resources.py::SecretsResource.on_get()
-    # Eager load this relationship via 'lazy=False'.
+    # Denormalized from the owning TenantSecret association, so that a
+    # Tenant's secrets can be found without joining through tenant_secret.
+    tenant_id = sa.Column(sa.String(36), sa.ForeignKey('tenants.id'),
+                          nullable=True)
+
+    __table_args__ = (sa.Index('secrets_tenant_created_idx',
+                               'tenant_id', 'created_at', 'id'),
+                      sa.Index('secrets_tenant_deleted_expiration_idx',
+                               'tenant_id', 'deleted', 'expiration'))
+
+    # Eager load this relationship via 'lazy=False', to build the list of
+    # supported content types when secret metadata is retrieved. The datum
+    # ciphertext columns are deferred, so this does not load them.
+    #   See barbican.plugin.util.mime_types.augment_fields_with_content_types()
     encrypted_data = orm.relationship("EncryptedDatum", lazy=False)
 
     secret_store_metadata = orm.relationship(
@@ -310,6 +324,9 @@ class Secret(BASE, ModelBase):
         for secret_ref in self.container_secrets:
             session.delete(secret_ref)
 
+        for tenant_assoc in self.tenant_assocs:
+            tenant_assoc.delete(session)
+
     def _do_extra_dict_fields(self):
         """Sub-class hook method: return dict of fields."""
         if self.expiration:
@@ -337,6 +354,9 @@ class SecretStoreMetadatum(BASE, ModelBase):
     secret_id = sa.Column(
         sa.String(36), sa.ForeignKey('secrets.id'), nullable=False)
 
+    __table_args__ = (sa.Index('secret_store_metadata_secret_deleted_idx',
+                               'secret_id', 'deleted'),)
+
     def __init__(self, key, value):
         super(SecretStoreMetadatum, self).__init__()
 
@@ -370,12 +390,18 @@ class EncryptedDatum(BASE, ModelBase):
     kek_id = sa.Column(
         sa.String(36), sa.ForeignKey('kek_data.id'), nullable=False)
 
-    # TODO(jwood) Why LargeBinary on Postgres (BYTEA) not work correctly?
-    cypher_text = sa.Column(sa.Text)
-    kek_meta_extended = sa.Column(sa.Text)
+    # Deferred, so that only the decrypt path loads the ciphertext. These
+    # columns are loaded together on first access to any of them.
+    # The ciphertext is stored as is in cypher_data. Rows written by older
+    # releases hold it base64 encoded in cypher_text instead.
+    cypher_data = orm.deferred(sa.Column(sa.LargeBinary), group='ciphertext')
+    cypher_text = orm.deferred(sa.Column(sa.Text), group='ciphertext')
+    kek_meta_extended = orm.deferred(sa.Column(sa.Text), group='ciphertext')
 
-    # Eager load this relationship via 'lazy=False'.
-    kek_meta_tenant = orm.relationship("KEKDatum", lazy=False)
+    __table_args__ = (sa.Index('encrypted_data_secret_idx', 'secret_id'),)
+
+    # Only needed to decrypt, so loaded on first access.
+    kek_meta_tenant = orm.relationship("KEKDatum")
 
     def __init__(self, secret=None, kek_datum=None):
         """Creates encrypted datum from a secret and KEK metadata."""
@@ -434,6 +460,9 @@ class KEKDatum(BASE, ModelBase):
     mode = sa.Column(sa.String(255))
     plugin_meta = sa.Column(sa.Text)
 
+    __table_args__ = (sa.Index('kek_data_tenant_plugin_active_idx',
+                               'tenant_id', 'plugin_name', 'active'),)
+
     def _do_extra_dict_fields(self):
         """Sub-class hook method: return dict of fields."""
         return {'algorithm': self.algorithm}
@@ -472,6 +501,9 @@ class Order(BASE, ModelBase):
         backref="order",
         cascade="all, delete-orphan")
 
+    __table_args__ = (sa.Index('orders_tenant_deleted_created_idx',
+                               'tenant_id', 'deleted', 'created_at'),)
+
     def __init__(self, parsed_request=None):
             """Creates a Order entity from a dict."""
             super(Order, self).__init__()
@@ -524,6 +556,9 @@ class OrderPluginMetadatum(BASE, ModelBase):
     key = sa.Column(sa.String(255), nullable=False)
     value = sa.Column(sa.String(255), nullable=False)
 
+    __table_args__ = (sa.Index('order_plugin_metadata_order_deleted_idx',
+                               'order_id', 'deleted'),)
+
     def __init__(self, key, value):
         super(OrderPluginMetadatum, self).__init__()
 
@@ -562,6 +597,19 @@ class Container(BASE, ModelBase):
                           nullable=False)
     consumers = sa.orm.relationship("ContainerConsumerMetadatum")
 
+    # Read-only view of the consumers that are not deleted, as listed by
+    # to_dict_fields(). Container list queries load it for all containers
+    # of a page at once.
+    active_consumers = orm.relationship(
+        "ContainerConsumerMetadatum",
+        primaryjoin="and_(Container.id == "
+                    "ContainerConsumerMetadatum.container_id, "
+                    "ContainerConsumerMetadatum.deleted == False)",
+        viewonly=True)
+
+    __table_args__ = (sa.Index('containers_tenant_deleted_created_idx',
+                               'tenant_id', 'deleted', 'created_at'),)
+
     def __init__(self, parsed_request=None):
         """Creates a Container entity from a dict."""
         super(Container, self).__init__()
@@ -594,6 +642,21 @@ class Container(BASE, ModelBase):
         for container_secret in self.container_secrets:
             session.delete(container_secret)
 
+    def to_dict_fields(self, include_consumers=True):
+        """Returns a dictionary of just the db fields of this entity.
+
+        The consumers are left out if include_consumers is False, in which
+        case they are not loaded either.
+        """
+        dict_fields = super(Container, self).to_dict_fields()
+        if include_consumers:
+            dict_fields['consumers'] = [
+                {
+                    'name': consumer.name,
+                    'URL': consumer.URL
+                } for consumer in self.active_consumers]
+        return dict_fields
+
     def _do_extra_dict_fields(self):
         """Sub-class hook method: return dict of fields."""
         return {'container_id': self.id,
@@ -604,13 +667,7 @@ class Container(BASE, ModelBase):
                         'secret_id': container_secret.secret_id,
                         'name': container_secret.name
                         if hasattr(container_secret, 'name') else None
-                    } for container_secret in self.container_secrets],
-                'consumers': [
-                    {
-                        'name': consumer.name,
-                        'URL': consumer.URL
-                    } for consumer in self.consumers if not consumer.deleted
-                ]}
+                    } for container_secret in self.container_secrets]}
 
 
 class ContainerConsumerMetadatum(BASE, ModelBase):
@@ -664,6 +721,9 @@ class TransportKey(BASE, ModelBase):
     plugin_name = sa.Column(sa.String(255), nullable=False)
     transport_key = sa.Column(sa.Text, nullable=False)
 
+    __table_args__ = (sa.Index('transport_keys_plugin_deleted_created_idx',
+                               'plugin_name', 'deleted', 'created_at'),)
+
     def __init__(self, plugin_name, transport_key):
         """Creates transport key entity ."""
         super(TransportKey, self).__init__()
@@ -686,10 +746,49 @@ class TransportKey(BASE, ModelBase):
         return {'transport_key_id': self.id,
                 'plugin_name': self.plugin_name}
 
+
+class ResourceCounter(BASE, ModelBase):
+    """Number of undeleted entities of one type owned by a Tenant or Container.
+
+    Secrets, orders and containers are counted per Tenant, and consumers per
+    Container. The repositories update these counters in the same
+    transaction as the entities they count, so that listings can report
+    their totals without counting the entities themselves.
+    """
+
+    __tablename__ = 'resource_counters'
+
+    SECRETS = 'secrets'
+    ORDERS = 'orders'
+    CONTAINERS = 'containers'
+    CONSUMERS = 'consumers'
+
+    scope_id = sa.Column(sa.String(36), nullable=False)
+    resource_type = sa.Column(sa.String(36), nullable=False)
+    total = sa.Column(sa.Integer, nullable=False, default=0)
+
+    __table_args__ = (sa.UniqueConstraint(
+        'scope_id', 'resource_type', name='_resource_counter_scope_type_uc'),)
+
+    def __init__(self, scope_id=None, resource_type=None, total=0):
+        """Creates a counter for a resource type within a scope."""
+        super(ResourceCounter, self).__init__()
+        self.scope_id = scope_id
+        self.resource_type = resource_type
+        self.total = total
+        self.status = States.ACTIVE
+
+    def _do_extra_dict_fields(self):
+        """Sub-class hook method: return dict of fields."""
+        return {'scope_id': self.scope_id,
+                'resource_type': self.resource_type,
+                'total': self.total}
+
 # Keep this tuple synchronized with the models in the file
 MODELS = [TenantSecret, Tenant, Secret, EncryptedDatum, Order, Container,
           ContainerConsumerMetadatum, ContainerSecret, TransportKey,
-          SecretStoreMetadatum, OrderPluginMetadatum, KEKDatum]
+          SecretStoreMetadatum, OrderPluginMetadatum, KEKDatum,
+          ResourceCounter]
 
 
 def register_models(engine):
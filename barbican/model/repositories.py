@@ -20,12 +20,21 @@ TODO: The top part of this file was 'borrowed' from Glance, but seems
 quite intense for sqlalchemy, and maybe could be simplified.
 """
 
+import base64
+import collections
+import contextlib
+import datetime
+import functools
 import logging
+import os
+import threading
 import time
+import traceback
 import uuid
 
 from oslo.config import cfg
 import sqlalchemy
+from sqlalchemy import and_
 from sqlalchemy import or_
 import sqlalchemy.orm as sa_orm
 
@@ -41,8 +50,16 @@ LOG = utils.getLogger(__name__)
 
 _ENGINE = None
 _MAKER = None
+_READ_ENGINE = None
+_READ_MAKER = None
 _MAX_RETRIES = None
 _RETRY_INTERVAL = None
+_MARKER_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+_MARKER_FORWARD = '>'
+_MARKER_REVERSE = '<'
+# Prefixes turning an INSERT conflicting with a unique constraint into a
+# no-op, by database dialect.
+_INSERT_IGNORE_PREFIXES = {'mysql': 'IGNORE', 'sqlite': 'OR IGNORE'}
 BASE = models.BASE
 sa_logger = None
 
@@ -52,6 +69,7 @@ _SECRET_REPOSITORY = None
 _TENANT_SECRET_REPOSITORY = None
 _ENCRYPTED_DATUM_REPOSITORY = None
 _KEK_DATUM_REPOSITORY = None
+_RESOURCE_COUNTER_REPOSITORY = None
 
 
 db_opts = [
@@ -60,8 +78,62 @@ db_opts = [
     cfg.IntOpt('sql_retry_interval', default=1),
     cfg.BoolOpt('db_auto_create', default=True),
     cfg.StrOpt('sql_connection'),
+    cfg.StrOpt('sql_connection_read',
+               help=u._('Optional SQLAlchemy connection string for a read '
+                        'replica. If set, GET and HEAD requests are served '
+                        'from it using read-only sessions.')),
+    cfg.IntOpt('sql_read_your_writes_seconds', default=0,
+               help=u._('Number of seconds after a project commits a write '
+                        'during which its reads are still served from the '
+                        'primary database rather than the read replica, '
+                        'tracked per API process. 0 disables this.')),
+    cfg.IntOpt('sql_pool_size',
+               help=u._('Number of connections kept open in each database '
+                        'connection pool. Not used for SQLite.')),
+    cfg.IntOpt('sql_max_overflow',
+               help=u._('Number of connections allowed beyond '
+                        'sql_pool_size when the pool is exhausted. Not used '
+                        'for SQLite.')),
+    cfg.IntOpt('sql_pool_timeout',
+               help=u._('Seconds to wait for a pooled connection before '
+                        'giving up. Not used for SQLite.')),
+    cfg.BoolOpt('sql_pool_pre_ping', default=False,
+                help=u._('Test pooled connections with a lightweight query '
+                         'on checkout, replacing those the database has '
+                         'dropped.')),
     cfg.IntOpt('max_limit_paging', default=100),
     cfg.IntOpt('default_limit_paging', default=10),
+    cfg.BoolOpt('list_totals', default=True,
+                help=u._('Include the total number of entities in list '
+                         'responses. Turning this off saves a query per '
+                         'listing.')),
+    cfg.IntOpt('project_cleanup_batch_size', default=500,
+               help=u._('Number of entities soft deleted per statement when '
+                        'cleaning up the resources of a deleted project.')),
+    cfg.IntOpt('purge_deleted_age_days', default=90,
+               help=u._('Number of days after which soft deleted entities '
+                        'are purged from the database.')),
+    cfg.IntOpt('purge_batch_size', default=500,
+               help=u._('Number of rows hard deleted per statement when '
+                        'purging soft deleted entities.')),
+    cfg.FloatOpt('purge_batch_interval', default=0.0,
+                 help=u._('Seconds to pause after each batch when purging '
+                          'soft deleted entities, to limit the load the '
+                          'purge puts on the database.')),
+    cfg.FloatOpt('sql_slow_query_seconds', default=0.0,
+                 help=u._('Log SQL statements taking at least this many '
+                          'seconds, along with the code that executed '
+                          'them. 0 disables the slow query log.')),
+    cfg.BoolOpt('sql_log_request_stats', default=False,
+                help=u._('Log the number of SQL statements each API '
+                         'request or worker task executed, the time they '
+                         'took and the slowest of them.')),
+    cfg.BoolOpt('project_cleanup_commit_batches', default=False,
+                help=u._('Commit after each batch of a project cleanup, so '
+                         'that cleaning up a large project does not hold '
+                         'its locks until the end. A failed cleanup then '
+                         'leaves the project partly deleted, to be finished '
+                         'when the event is processed again.')),
 ]
 
 CONF = cfg.CONF
@@ -69,35 +141,74 @@ CONF.register_opts(db_opts)
 CONF.import_opt('debug', 'barbican.openstack.common.log')
 
 _CONNECTION = None
+_READ_CONNECTION = None
 _IDLE_TIMEOUT = None
 
+# Per-thread request state, matching the thread scoping of the sessions.
+_REQUEST_STATE = threading.local()
 
-def start():
+# Connection pool counters, see get_pool_stats().
+_POOL_STATS = collections.defaultdict(int)
+_POOL_STATS_LOCK = threading.Lock()
+
+# Maps keystone_id to the time of its last committed write in this process.
+_RECENT_WRITES = {}
+_RECENT_WRITES_LOCK = threading.Lock()
+
+# The barbican package directory, to locate the code executing SQL.
+_SOURCE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start(keystone_id=None):
     """Start database and establish a read/write connection to it.
 
     Typically performed at the start of a request cycle, say for POST or PUT
     requests.
+
+    :param keystone_id: Optional project the request acts on, used to route
+                        this project's subsequent reads to the primary
+                        database once the request commits.
     """
     configure_db()
+    _REQUEST_STATE.read_only = False
+    _REQUEST_STATE.keystone_id = keystone_id
     get_session()
 
 
-def start_read_only():
+def start_read_only(keystone_id=None):
     """Start database and establish a read-only connection to it.
 
     Typically performed at the start of a request cycle, say for GET or HEAD
-    requests.
+    requests. If a read replica is configured via 'sql_connection_read' the
+    session is bound to it, unless the project has written recently (see
+    'sql_read_your_writes_seconds'), otherwise the primary database is used.
+
+    :param keystone_id: Optional project the request acts on.
     """
-    # TODO(john-wood-w) Add optional, separate engine/connection for reads.
-    start()
+    configure_db()
+    _REQUEST_STATE.read_only = bool(
+        _READ_CONNECTION and not _has_recent_write(keystone_id))
+    _REQUEST_STATE.keystone_id = keystone_id
+    get_session()
+
+
+def is_read_only():
+    """Returns True if the current request uses the read replica."""
+    return getattr(_REQUEST_STATE, 'read_only', False)
 
 
 def commit():
     """Commit session state so far to the database.
 
-    Typically performed at the end of a request cycle.
+    Typically performed at the end of a request cycle. Read-only sessions
+    are never committed, just rolled back.
     """
+    if is_read_only():
+        get_session().rollback()
+        return
+
     get_session().commit()
+    _record_write(getattr(_REQUEST_STATE, 'keystone_id', None))
 
 
 def rollback():
@@ -114,18 +225,200 @@ def clear():
     Typically performed at the end of a request cycle, after a
     commit() or rollback().
     """
-    _MAKER.remove()
+    if _MAKER:
+        _MAKER.remove()
+    if _READ_MAKER:
+        _READ_MAKER.remove()
+    _REQUEST_STATE.read_only = False
+    _REQUEST_STATE.keystone_id = None
+    _REQUEST_STATE.deferred_sessions = None
+
+
+class QueryStats(object):
+    """Statistics on the SQL statements executed for a request or task."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_statement = None
+
+    def add(self, statement, seconds):
+        self.count += 1
+        self.total_seconds += seconds
+        if self.slowest_statement is None or seconds > self.slowest_seconds:
+            self.slowest_seconds = seconds
+            self.slowest_statement = statement
+
+
+def reset_query_stats():
+    """Starts collecting SQL statistics for a new request or task.
+
+    :returns: The QueryStats instance updated by the statements this thread
+              executes from now on, see get_query_stats().
+    """
+    _REQUEST_STATE.query_stats = QueryStats()
+    return _REQUEST_STATE.query_stats
+
+
+def get_query_stats():
+    """Returns the current request or task's QueryStats, or None."""
+    return getattr(_REQUEST_STATE, 'query_stats', None)
+
+
+def clear_query_stats():
+    """Stops collecting SQL statistics once a request or task is done.
+
+    Statements this thread executes afterwards are not counted, until the
+    next reset_query_stats().
+    """
+    _REQUEST_STATE.query_stats = None
+
+
+def log_query_stats(description, stats=None):
+    """Logs the current request or task's SQL statistics, if enabled.
+
+    :param description: What executed the statements, such as the method
+                        and path of a request.
+    :param stats: The QueryStats to log, instead of the current ones.
+    """
+    if stats is None:
+        stats = get_query_stats()
+    if stats is None or not CONF.sql_log_request_stats:
+        return
+    LOG.info(u._('SQL stats for %(description)s: queries=%(count)d '
+                 'db_ms=%(db_ms).1f slowest_ms=%(slowest_ms).1f '
+                 'slowest_statement="%(slowest_statement)s"'),
+             {'description': description,
+              'count': stats.count,
+              'db_ms': stats.total_seconds * 1000,
+              'slowest_ms': stats.slowest_seconds * 1000,
+              'slowest_statement': ' '.join(
+                  (stats.slowest_statement or '').split())})
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if context is not None:
+        context._barbican_start_time = time.time()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    start_time = getattr(context, '_barbican_start_time', None)
+    if start_time is None:
+        return
+    seconds = time.time() - start_time
+
+    stats = get_query_stats()
+    if stats is not None:
+        stats.add(statement, seconds)
+
+    threshold = CONF.sql_slow_query_seconds
+    if threshold > 0 and seconds >= threshold:
+        LOG.warning(u._('Slow SQL statement took %(seconds).3f seconds, '
+                        'executed at %(call_site)s: %(statement)s'),
+                    {'seconds': seconds,
+                     'call_site': _get_call_site(),
+                     'statement': ' '.join(statement.split())})
+
+
+def _get_call_site():
+    """Returns where Barbican code executed the current SQL statement."""
+    for filename, line, function, _ in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(filename)
+        if (filename.startswith(_SOURCE_DIR) and
+                function not in ('_after_cursor_execute', '_get_call_site')):
+            return '{0}:{1} in {2}'.format(
+                os.path.relpath(filename, os.path.dirname(_SOURCE_DIR)),
+                line, function)
+    return 'unknown'
+
+
+@contextlib.contextmanager
+def unit_of_work():
+    """Writes the entities saved within the block with a single flush.
+
+    ModelBase.save() normally flushes each entity as it is saved. Within
+    this block it only adds the entity to its session, giving it an id if
+    it has none so that entities can reference one another, and the
+    sessions used are flushed once at the end of the block. As the ids are
+    known up front, that flush batches the INSERTs into each table. Blocks
+    may be nested, the outermost one flushes.
+
+    :raises Duplicate: if the flush violates a uniqueness constraint
+    """
+    if getattr(_REQUEST_STATE, 'deferred_sessions', None) is not None:
+        yield
+        return
+
+    _REQUEST_STATE.deferred_sessions = []
+    try:
+        yield
+        sessions = _REQUEST_STATE.deferred_sessions
+    finally:
+        _REQUEST_STATE.deferred_sessions = None
+
+    for session in sessions:
+        try:
+            session.flush()
+        except sqlalchemy.exc.IntegrityError:
+            LOG.exception('Problem saving entities for unit of work')
+            raise exception.Duplicate()
+
+
+def defer_flush(session):
+    """Returns True if session must not be flushed yet, see unit_of_work().
+
+    The session is then flushed at the end of the enclosing unit of work.
+    """
+    sessions = getattr(_REQUEST_STATE, 'deferred_sessions', None)
+    if sessions is None:
+        return False
+    if session not in sessions:
+        sessions.append(session)
+    return True
+
+
+def _record_write(keystone_id):
+    """Notes that a project committed a write, for read-your-writes."""
+    if keystone_id and CONF.sql_read_your_writes_seconds > 0:
+        with _RECENT_WRITES_LOCK:
+            _RECENT_WRITES[keystone_id] = time.time()
+
+
+def _has_recent_write(keystone_id):
+    """Returns True if the project wrote within the read-your-writes window.
+
+    Expired entries are pruned as they are found.
+    """
+    window = CONF.sql_read_your_writes_seconds
+    if not keystone_id or window <= 0:
+        return False
+
+    with _RECENT_WRITES_LOCK:
+        written_at = _RECENT_WRITES.get(keystone_id)
+        if written_at is None:
+            return False
+        if time.time() - written_at < window:
+            return True
+        del _RECENT_WRITES[keystone_id]
+    return False
 
 
 def setup_db_env():
     """Setup configuration for database."""
     global sa_logger, _IDLE_TIMEOUT, _MAX_RETRIES, _RETRY_INTERVAL, _CONNECTION
+    global _READ_CONNECTION
 
     _IDLE_TIMEOUT = CONF.sql_idle_timeout
     _MAX_RETRIES = CONF.sql_max_retries
     _RETRY_INTERVAL = CONF.sql_retry_interval
     _CONNECTION = CONF.sql_connection
+    _READ_CONNECTION = CONF.sql_connection_read
     LOG.debug("Sql connection = %s", _CONNECTION)
+    if _READ_CONNECTION:
+        LOG.debug("Sql read connection = %s", _READ_CONNECTION)
     sa_logger = logging.getLogger('sqlalchemy.engine')
     if CONF.debug:
         sa_logger.setLevel(logging.DEBUG)
@@ -142,8 +435,18 @@ def configure_db():
 
 
 def get_session():
-    """Helper method to grab session."""
+    """Helper method to grab session.
+
+    Returns a read replica session if the current request was started via
+    start_read_only() with a read replica configured.
+    """
     global _MAKER
+    if is_read_only():
+        if not _READ_MAKER:
+            get_read_engine()
+            get_read_maker()
+        return _READ_MAKER()
+
     if not _MAKER:
         get_engine()
         get_maker()
@@ -162,24 +465,8 @@ def get_engine():
         if not _CONNECTION:
             raise exception.BarbicanException('No _CONNECTION configured')
 
-    # TODO(jfwood):
-    # connection_dict = sqlalchemy.engine.url.make_url(_CONNECTION)
-
-        engine_args = {
-            'pool_recycle': _IDLE_TIMEOUT,
-            'echo': False,
-            'convert_unicode': True}
-
         try:
-            LOG.debug("Sql connection: %s; Args: %s", _CONNECTION, engine_args)
-            _ENGINE = sqlalchemy.create_engine(_CONNECTION, **engine_args)
-
-        # TODO(jfwood): if 'mysql' in connection_dict.drivername:
-        # TODO(jfwood): sqlalchemy.event.listen(_ENGINE, 'checkout',
-        # TODO(jfwood):                         ping_listener)
-
-            _ENGINE.connect = wrap_db_error(_ENGINE.connect)
-            _ENGINE.connect()
+            _ENGINE = _create_engine(_CONNECTION)
         except Exception as err:
             msg = u._("Error configuring registry database with supplied "
                       "sql_connection. Got error: %s") % err
@@ -198,6 +485,7 @@ def get_engine():
                 # Upgrade the database to the latest version.
                 LOG.info(u._('Updating schema to latest version'))
                 commands.upgrade()
+                migrate_data()
             else:
                 # Create database tables from our models.
                 LOG.info(u._('Auto-creating barbican registry DB'))
@@ -212,6 +500,130 @@ def get_engine():
     return _ENGINE
 
 
+def _create_engine(connection):
+    """Creates and connects an engine, configuring its connection pool."""
+    engine_args = {
+        'pool_recycle': _IDLE_TIMEOUT,
+        'echo': False,
+        'convert_unicode': True}
+
+    url = sqlalchemy.engine.url.make_url(connection)
+    # The dialect name, unlike the driver name, is also 'sqlite' for URLs
+    # naming the driver such as sqlite+pysqlite://.
+    is_sqlite = url.get_dialect().name == 'sqlite'
+    if not is_sqlite:
+        engine_args['poolclass'] = _MonitoredQueuePool
+        if CONF.sql_pool_size is not None:
+            engine_args['pool_size'] = CONF.sql_pool_size
+        if CONF.sql_max_overflow is not None:
+            engine_args['max_overflow'] = CONF.sql_max_overflow
+        if CONF.sql_pool_timeout is not None:
+            engine_args['pool_timeout'] = CONF.sql_pool_timeout
+
+    LOG.debug("Sql connection: %s; Args: %s", connection, engine_args)
+    engine = sqlalchemy.create_engine(connection, **engine_args)
+
+    sqlalchemy.event.listen(engine.pool, 'connect', _on_pool_connect)
+    sqlalchemy.event.listen(engine.pool, 'checkout',
+                            _make_checkout_listener(engine.pool))
+    sqlalchemy.event.listen(engine.pool, 'checkin', _on_pool_checkin)
+    if CONF.sql_pool_pre_ping:
+        sqlalchemy.event.listen(engine.pool, 'checkout',
+                                _make_ping_listener(engine))
+    sqlalchemy.event.listen(engine, 'before_cursor_execute',
+                            _before_cursor_execute)
+    sqlalchemy.event.listen(engine, 'after_cursor_execute',
+                            _after_cursor_execute)
+
+    engine.connect = wrap_db_error(engine.connect)
+    engine.connect()
+    return engine
+
+
+class _MonitoredQueuePool(sqlalchemy.pool.QueuePool):
+    """QueuePool recording time spent waiting for connections."""
+
+    def _do_get(self):
+        start = time.time()
+        try:
+            return super(_MonitoredQueuePool, self)._do_get()
+        except sqlalchemy.exc.TimeoutError:
+            _incr_pool_stat('checkout_timeouts')
+            raise
+        finally:
+            _incr_pool_stat('checkout_wait_seconds', time.time() - start)
+
+
+def _incr_pool_stat(name, amount=1):
+    with _POOL_STATS_LOCK:
+        _POOL_STATS[name] += amount
+
+
+def _on_pool_connect(dbapi_conn, connection_rec):
+    _incr_pool_stat('connects')
+
+
+def _make_checkout_listener(pool):
+    counts_overflow = isinstance(pool, sqlalchemy.pool.QueuePool)
+
+    def _on_pool_checkout(dbapi_conn, connection_rec, connection_proxy):
+        _incr_pool_stat('checkouts')
+        if counts_overflow and pool.overflow() > 0:
+            _incr_pool_stat('overflow_checkouts')
+
+    return _on_pool_checkout
+
+
+def _on_pool_checkin(dbapi_conn, connection_rec):
+    _incr_pool_stat('checkins')
+
+
+def _make_ping_listener(engine):
+    """Returns a pool checkout listener that pings the connection.
+
+    Connections the database has dropped are reported to the pool as
+    disconnected, so that it discards them and checks out another. This
+    relies only on the dialect's is_disconnect(), so works for any backend.
+    """
+    def _ping_listener(dbapi_conn, connection_rec, connection_proxy):
+        cursor = dbapi_conn.cursor()
+        try:
+            cursor.execute('SELECT 1')
+        except Exception as err:
+            if engine.dialect.is_disconnect(err, dbapi_conn, cursor):
+                _incr_pool_stat('invalidations')
+                raise sqlalchemy.exc.DisconnectionError(
+                    'Database connection dropped: {0}'.format(err))
+            raise
+        finally:
+            cursor.close()
+
+    return _ping_listener
+
+
+def get_pool_stats():
+    """Returns connection pool statistics for monitoring.
+
+    Counters are cumulative over the life of the process and cover all
+    engines: connects, checkouts, checkins, overflow_checkouts (checkouts
+    made while the pool was over sql_pool_size), invalidations (dropped
+    connections found by the pre-ping), checkout_timeouts and
+    checkout_wait_seconds. For a pooled primary engine, the current size,
+    checked_in, checked_out and overflow are included as well.
+    """
+    with _POOL_STATS_LOCK:
+        stats = dict(_POOL_STATS)
+
+    if _ENGINE and isinstance(_ENGINE.pool, sqlalchemy.pool.QueuePool):
+        stats.update({
+            'size': _ENGINE.pool.size(),
+            'checked_in': _ENGINE.pool.checkedin(),
+            'checked_out': _ENGINE.pool.checkedout(),
+            'overflow': _ENGINE.pool.overflow()
+        })
+    return stats
+
+
 def get_maker():
     """Return a SQLAlchemy sessionmaker."""
     """May assign __MAKER if not already assigned"""
@@ -225,6 +637,51 @@ def get_maker():
     return _MAKER
 
 
+def get_read_engine():
+    """Return a SQLAlchemy engine bound to the read replica.
+
+    May assign _READ_ENGINE if not already assigned. Unlike get_engine(),
+    this never creates or upgrades the schema, which is the primary's job.
+    """
+    global _READ_ENGINE
+
+    if not _READ_ENGINE:
+        if not _READ_CONNECTION:
+            raise exception.BarbicanException(
+                'No _READ_CONNECTION configured')
+
+        try:
+            _READ_ENGINE = _create_engine(_READ_CONNECTION)
+        except Exception as err:
+            msg = u._("Error configuring registry database with supplied "
+                      "sql_connection_read. Got error: %s") % err
+            LOG.exception(msg)
+            raise
+
+    return _READ_ENGINE
+
+
+def get_read_maker():
+    """Return a SQLAlchemy sessionmaker for the read replica.
+
+    May assign _READ_MAKER if not already assigned. Sessions from this maker
+    refuse to flush, so that no writes can be issued against the replica.
+    """
+    global _READ_MAKER
+    assert _READ_ENGINE
+    if not _READ_MAKER:
+        maker = sa_orm.sessionmaker(bind=_READ_ENGINE, autoflush=False)
+        sqlalchemy.event.listen(maker, 'before_flush', _refuse_flush)
+        _READ_MAKER = sqlalchemy.orm.scoped_session(maker)
+    return _READ_MAKER
+
+
+def _refuse_flush(session, flush_context, instances):
+    raise exception.BarbicanException(
+        u._('Attempted to write to the database within a read-only '
+            'request.'))
+
+
 def is_db_connection_error(args):
     """Return True if error in connecting to db."""
     # NOTE(adam_g): This is currently MySQL specific and needs to be extended
@@ -293,6 +750,135 @@ def clean_paging_values(offset_arg=0, limit_arg=CONF.default_limit_paging):
     return offset, limit
 
 
+def encode_marker(created_at, entity_id, reverse=False):
+    """Builds an opaque keyset paging marker.
+
+    The marker identifies a position in a listing ordered by
+    (created_at, id). A forward marker selects the entities after that
+    position, a reverse marker the entities before it.
+    """
+    raw = '|'.join((created_at.strftime(_MARKER_TIME_FORMAT),
+                    entity_id,
+                    _MARKER_REVERSE if reverse else _MARKER_FORWARD))
+    return base64.urlsafe_b64encode(raw)
+
+
+def decode_marker(marker):
+    """Decodes a marker from encode_marker().
+
+    :returns: Tuple consisting of (created_at, entity_id, reverse).
+    :raises InvalidMarker: if the marker was not built by encode_marker().
+    """
+    try:
+        raw = base64.urlsafe_b64decode(str(marker))
+        created_at, entity_id, direction = raw.split('|')
+        created_at = datetime.datetime.strptime(created_at,
+                                                _MARKER_TIME_FORMAT)
+    except (TypeError, ValueError, UnicodeError):
+        raise exception.InvalidMarker()
+
+    if direction not in (_MARKER_FORWARD, _MARKER_REVERSE):
+        raise exception.InvalidMarker()
+
+    return created_at, entity_id, direction == _MARKER_REVERSE
+
+
+def get_paging_markers(entities, marker_arg, limit):
+    """Returns the markers for the pages around a marker-paged listing.
+
+    As with other keyset paging APIs, a full page is taken to mean there
+    may be more entities beyond it, so the last page of a listing can be
+    followed by an empty one.
+
+    :param entities: The non-empty page returned for marker_arg.
+    :param marker_arg: The marker the page was requested with, or an empty
+                       string for the first page.
+    :param limit: The page size the page was requested with.
+    :returns: Tuple consisting of (previous_marker, next_marker), either of
+              which is None if there is no such page.
+    """
+    full_page = len(entities) >= limit
+    if marker_arg and decode_marker(marker_arg)[2]:
+        has_previous, has_next = full_page, True
+    else:
+        has_previous, has_next = bool(marker_arg), full_page
+
+    previous_marker = None
+    if has_previous:
+        previous_marker = encode_marker(entities[0].created_at,
+                                        entities[0].id, reverse=True)
+
+    next_marker = None
+    if has_next:
+        next_marker = encode_marker(entities[-1].created_at, entities[-1].id)
+
+    return previous_marker, next_marker
+
+
+def _get_page(query, model_class, offset, limit, marker_arg=None):
+    """Returns a page of the query's entities.
+
+    Without a marker the page is located by offset, which means having the
+    database skip over all earlier pages. With a marker (an empty one
+    selects the first page) the query is ordered by (created_at, id) and
+    seeks straight to the marker's position instead.
+    """
+    if marker_arg is None:
+        return query[offset:offset + limit]
+
+    query = query.order_by(None)
+    if not marker_arg:
+        query = query.order_by(model_class.created_at, model_class.id)
+        return query[:limit]
+
+    created_at, entity_id, reverse = decode_marker(marker_arg)
+    if reverse:
+        query = query.filter(or_(
+            model_class.created_at < created_at,
+            and_(model_class.created_at == created_at,
+                 model_class.id < entity_id)))
+        query = query.order_by(model_class.created_at.desc(),
+                               model_class.id.desc())
+        entities = query[:limit]
+        entities.reverse()
+    else:
+        query = query.filter(or_(
+            model_class.created_at > created_at,
+            and_(model_class.created_at == created_at,
+                 model_class.id > entity_id)))
+        query = query.order_by(model_class.created_at, model_class.id)
+        entities = query[:limit]
+
+    return entities
+
+
+def _get_total(query, marker_arg=None, get_counter_total=None):
+    """Returns the total number of entities for a listing.
+
+    :param query: The listing's query, counted if there is no counter.
+    :param marker_arg: The marker the listing is paged by, if any.
+    :param get_counter_total: Callable returning the total from the
+                              listing's resource counter, or None if it has
+                              none (e.g. because it is filtered).
+    :returns: The total, or None if totals are turned off or if the listing
+              is paged by marker and has no counter, as counting it would
+              defeat the point of paging by marker.
+    """
+    if not CONF.list_totals:
+        return None
+    if get_counter_total:
+        return get_counter_total()
+    if marker_arg is not None:
+        return None
+    return query.count()
+
+
+def _soft_delete_values():
+    """Returns the column values that mark an entity as soft deleted."""
+    now = timeutils.utcnow()
+    return {'deleted': True, 'deleted_at': now, 'updated_at': now}
+
+
 def delete_all_project_resources(tenant_id, repos):
     """Logic to cleanup all project resources.
 
@@ -312,10 +898,194 @@ def delete_all_project_resources(tenant_id, repos):
         tenant_id, suppress_exception=False, session=session)
     repos.tenant_secret_repo.delete_project_entities(
         tenant_id, suppress_exception=False, session=session)
+    get_resource_counter_repository().reset(
+        tenant_id,
+        (models.ResourceCounter.SECRETS, models.ResourceCounter.CONTAINERS),
+        session=session)
+    # The tenant goes last, as a cleanup left incomplete is only finished
+    # when the event is processed again while the tenant still exists.
     repos.tenant_repo.delete_project_entities(
         tenant_id, suppress_exception=False, session=session)
 
 
+def purge_deleted_entities(age_in_days=None, batch_size=None,
+                           batch_interval=None):
+    """Hard deletes entities soft deleted more than age_in_days ago.
+
+    Tables are purged in dependency order, children before their parents,
+    and a row is only purged once no other row references it. Rows are
+    deleted batch_size at a time, committing and then pausing for
+    batch_interval seconds after each batch. Arguments left as None are
+    taken from configuration.
+
+    :returns: dict of table name to the number of rows purged from it
+    """
+    if age_in_days is None:
+        age_in_days = CONF.purge_deleted_age_days
+    if batch_size is None:
+        batch_size = CONF.purge_batch_size
+    if batch_interval is None:
+        batch_interval = CONF.purge_batch_interval
+    batch_size = max(batch_size, 1)
+    deleted_before = timeutils.utcnow() - datetime.timedelta(
+        days=age_in_days)
+
+    session = get_session()
+    purged = {}
+    for table in reversed(models.BASE.metadata.sorted_tables):
+        if 'deleted' not in table.c:
+            continue
+
+        query = _build_purge_query(table, deleted_before).limit(batch_size)
+        count = 0
+        while True:
+            entity_ids = [row[0] for row in session.execute(query)]
+            if not entity_ids:
+                break
+            session.execute(table.delete().where(
+                table.c.id.in_(entity_ids)))
+            session.commit()
+            count += len(entity_ids)
+            if batch_interval > 0:
+                time.sleep(batch_interval)
+
+        if count:
+            LOG.info(u._('Purged %(count)s deleted rows from %(table)s'),
+                     {'count': count, 'table': table.name})
+        purged[table.name] = count
+    return purged
+
+
+def _build_purge_query(table, deleted_before):
+    """Selects the ids of rows of table that may be purged.
+
+    These are rows soft deleted before deleted_before that no row of any
+    table still references by foreign key.
+    """
+    query = sqlalchemy.select([table.c.id]).where(and_(
+        table.c.deleted == sqlalchemy.true(),
+        table.c.deleted_at < deleted_before))
+    for child in models.BASE.metadata.sorted_tables:
+        for foreign_key in child.foreign_keys:
+            if foreign_key.column.table is table:
+                query = query.where(~sqlalchemy.exists().where(
+                    foreign_key.parent == foreign_key.column))
+    return query
+
+
+def migrate_data(batch_size=1000, batch_interval=0,
+                 ciphertext_as_text=False):
+    """Migrates existing rows to the latest schema, online.
+
+    Completes the schema migrations that leave rows to convert, as these
+    are converted in batches committed one at a time, which a migration's
+    single transaction does not allow. The service keeps working meanwhile.
+    Each step updates rows batch_size at a time, committing and then
+    pausing for batch_interval seconds after each batch, and may be run
+    again if interrupted. If ciphertext_as_text is set, ciphertext is moved
+    back to the column older releases read instead, which must be done
+    before downgrading below the revision adding cypher_data.
+
+    :returns: dict of step name to the number of rows it updated
+    """
+    batch_size = max(batch_size, 1)
+    return {
+        'secret_tenants': backfill_secret_tenants(batch_size,
+                                                  batch_interval),
+        'ciphertext': convert_ciphertext(batch_size, batch_interval,
+                                         to_text=ciphertext_as_text)
+    }
+
+
+def backfill_secret_tenants(batch_size, batch_interval):
+    """Sets tenant_id on the secrets created before it was added.
+
+    Until then, these secrets are not found when looked up by tenant. Each
+    takes the tenant of its tenant_secret association. Secrets are
+    selected by id order, so a secret with no association is skipped.
+
+    :returns: the number of secrets updated
+    """
+    secrets = models.Secret.__table__
+    tenant_secret = models.TenantSecret.__table__
+    owner = sqlalchemy.select(
+        [sqlalchemy.func.min(tenant_secret.c.tenant_id)]
+    ).where(tenant_secret.c.secret_id == secrets.c.id).as_scalar()
+
+    session = get_session()
+    count = 0
+    last_id = ''
+    while True:
+        secret_ids = [row[0] for row in session.execute(
+            sqlalchemy.select([secrets.c.id])
+            .where(and_(secrets.c.tenant_id == None,  # noqa
+                        secrets.c.id > last_id))
+            .order_by(secrets.c.id)
+            .limit(batch_size))]
+        if not secret_ids:
+            break
+        session.execute(secrets.update().where(
+            secrets.c.id.in_(secret_ids)).values(tenant_id=owner))
+        session.commit()
+        count += len(secret_ids)
+        last_id = secret_ids[-1]
+        if batch_interval > 0:
+            time.sleep(batch_interval)
+
+    if count:
+        LOG.info(u._('Set the tenant of %s secrets'), count)
+    return count
+
+
+def convert_ciphertext(batch_size, batch_interval, to_text=False):
+    """Moves ciphertext from cypher_text to the cypher_data binary column.
+
+    Older releases stored it base64 encoded in cypher_text. Rows are
+    converted in id order, decoding and clearing cypher_text. If to_text
+    is set, the conversion is reversed instead.
+
+    :returns: the number of encrypted data rows converted
+    """
+    encrypted_data = models.EncryptedDatum.__table__
+    if to_text:
+        source, target = (encrypted_data.c.cypher_data,
+                          encrypted_data.c.cypher_text)
+        convert = lambda value: base64.b64encode(bytes(value))
+    else:
+        source, target = (encrypted_data.c.cypher_text,
+                          encrypted_data.c.cypher_data)
+        convert = base64.b64decode
+    update = encrypted_data.update().where(
+        encrypted_data.c.id == sqlalchemy.bindparam('datum_id')
+    ).values({target: sqlalchemy.bindparam('value'), source: None})
+
+    session = get_session()
+    count = 0
+    last_id = ''
+    while True:
+        batch = session.execute(
+            sqlalchemy.select([encrypted_data.c.id, source])
+            .where(and_(source != None,  # noqa
+                        encrypted_data.c.id > last_id))
+            .order_by(encrypted_data.c.id)
+            .limit(batch_size)).fetchall()
+        if not batch:
+            break
+        session.execute(update, [{'datum_id': datum_id,
+                                  'value': convert(value)}
+                                 for datum_id, value in batch])
+        session.commit()
+        count += len(batch)
+        last_id = batch[-1][0]
+        if batch_interval > 0:
+            time.sleep(batch_interval)
+
+    if count:
+        LOG.info(u._('Converted the ciphertext of %s encrypted data rows'),
+                 count)
+    return count
+
+
 class Repositories(object):
     """Convenient way to pass repositories around.
 
@@ -394,7 +1164,6 @@ class BaseRepo(object):
 
     def create_from(self, entity, session=None):
         """Sub-class hook: create from entity."""
-        start = time.time()  # DEBUG
         if not entity:
             msg = "Must supply non-None {0}.".format(self._do_entity_name)
             raise exception.Invalid(msg)
@@ -425,8 +1194,7 @@ class BaseRepo(object):
             raise exception.Duplicate("Entity ID {0} already exists!"
                                       .format(values_id))
 
-        LOG.debug('Elapsed repo '
-                  'create secret:%s', (time.time() - start))  # DEBUG
+        self._do_update_counters(entity, 1, self.get_session(session))
 
         return entity
 
@@ -473,6 +1241,8 @@ class BaseRepo(object):
             raise exception.NotFound("Entity ID %s not found"
                                      % entity_id)
 
+        self._do_update_counters(entity, -1, session)
+
     def _do_entity_name(self):
         """Sub-class hook: return entity name, such as for debugging."""
         return "Entity"
@@ -485,6 +1255,15 @@ class BaseRepo(object):
         """Sub-class hook: build a retrieve query."""
         return None
 
+    def _do_update_counters(self, entity, delta, session):
+        """Sub-class hook: update resource counters for an entity.
+
+        :param entity: The entity that was created or deleted
+        :param delta: 1 if the entity was created, -1 if it was deleted
+        :param session: The session the entity was changed in
+        """
+        pass
+
     def _do_convert_values(self, values):
         """Sub-class hook: convert text-based values to target types
 
@@ -607,16 +1386,40 @@ class BaseRepo(object):
         Sub-class should implement `_build_get_project_entities_query` function
         to delete related entities otherwise it would raise NotImplementedError
         on its usage.
+
+        Entities are soft deleted in batches of project_cleanup_batch_size,
+        with one UPDATE statement per batch rather than one per entity.
+        Children are deleted the same way via
+        `_do_delete_project_children`. If project_cleanup_commit_batches is
+        set, the session is committed after each batch.
         """
         session = self.get_session(session)
         query = self._build_get_project_entities_query(tenant_id,
                                                        session=session)
+        model_class = query.column_descriptions[0]['entity']
+        batch_size = max(CONF.project_cleanup_batch_size, 1)
+        total = 0
         try:
             # query cannot be None as related repo class is expected to
             # implement it otherwise error is raised in build query call
-            for entity in query:
+            while True:
+                entity_ids = [entity_id for (entity_id,) in
+                              query.with_entities(model_class.id)
+                              .limit(batch_size)]
+                if not entity_ids:
+                    break
+
+                self._do_delete_project_children(entity_ids, session)
                 # Its a soft delete so its more like entity update
-                entity.delete(session=session)
+                session.query(model_class).filter(
+                    model_class.id.in_(entity_ids)
+                ).update(_soft_delete_values(), synchronize_session=False)
+
+                total += len(entity_ids)
+                if CONF.project_cleanup_commit_batches:
+                    session.commit()
+                LOG.debug('Deleted %s %s entities so far for tenant_id=%s',
+                          total, self._do_entity_name(), tenant_id)
         except sqlalchemy.exc.SQLAlchemyError:
             LOG.exception('Problem finding project related entity to delete')
             if not suppress_exception:
@@ -624,6 +1427,14 @@ class BaseRepo(object):
                                                   'entities for tenant_id=%s',
                                                   tenant_id)
 
+    def _do_delete_project_children(self, entity_ids, session):
+        """Sub-class hook: delete children of a batch of project entities.
+
+        Set-based counterpart of the models' _do_delete_children() hook,
+        used by delete_project_entities().
+        """
+        pass
+
 
 class TenantRepo(BaseRepo):
     """Repository for the Tenant entity."""
@@ -639,6 +1450,16 @@ class TenantRepo(BaseRepo):
         """Sub-class hook: build a retrieve query."""
         return session.query(models.Tenant).filter_by(id=entity_id)
 
+    def _do_update_counters(self, entity, delta, session):
+        """Sub-class hook: update resource counters for an entity."""
+        if delta > 0:
+            get_resource_counter_repository().create_counters(
+                entity.id,
+                (models.ResourceCounter.SECRETS,
+                 models.ResourceCounter.ORDERS,
+                 models.ResourceCounter.CONTAINERS),
+                session=session)
+
     def find_by_keystone_id(self, keystone_id, suppress_exception=False,
                             session=None):
         session = self.get_session(session)
@@ -671,11 +1492,14 @@ class SecretRepo(BaseRepo):
 
     def get_by_create_date(self, keystone_id, offset_arg=None, limit_arg=None,
                            name=None, alg=None, mode=None, bits=0,
-                           suppress_exception=False, session=None):
+                           suppress_exception=False, session=None,
+                           marker_arg=None):
         """Returns a list of secrets
 
         The returned secrets are ordered by the date they were created at
-        and paged based on the offset and limit fields. The keystone_id is
+        and paged based on the offset and limit fields, or on the marker
+        field if one is given (see encode_marker()), in which case the
+        total is not computed and is returned as None. The keystone_id is
         external-to-Barbican value assigned to the tenant by Keystone.
         """
 
@@ -703,16 +1527,19 @@ class SecretRepo(BaseRepo):
             if bits > 0:
                 query = query.filter(models.Secret.bit_length == bits)
 
-            query = query.join(models.TenantSecret,
-                               models.Secret.tenant_assocs)
-            query = query.join(models.Tenant, models.TenantSecret.tenants)
+            query = query.join(models.Tenant,
+                               models.Secret.tenant_id == models.Tenant.id)
             query = query.filter(models.Tenant.keystone_id == keystone_id)
 
-            start = offset
-            end = offset + limit
-            LOG.debug('Retrieving from %s to %s', start, end)
-            total = query.count()
-            entities = query[start:end]
+            LOG.debug('Retrieving %s from offset %s or marker %s',
+                      limit, offset, marker_arg)
+            entities = _get_page(query, models.Secret, offset, limit,
+                                 marker_arg)
+            get_counter_total = None
+            if not (name or alg or mode or bits > 0):
+                get_counter_total = functools.partial(
+                    self._get_unexpired_total, keystone_id, utcnow, session)
+            total = _get_total(query, marker_arg, get_counter_total)
             LOG.debug('Number entities retrieved: %s out of %s',
                       len(entities), total
                       )
@@ -726,6 +1553,79 @@ class SecretRepo(BaseRepo):
 
         return entities, offset, limit, total
 
+    def _get_unexpired_total(self, keystone_id, utcnow, session):
+        """Returns the number of a tenant's undeleted, unexpired secrets.
+
+        The secrets counter still counts the secrets that expired but were
+        not deleted, which the listing leaves out, so these are counted and
+        taken off the counter's total. That count only reads the range of
+        the secrets_tenant_deleted_expiration_idx index holding the
+        tenant's expired secrets.
+        """
+        total = get_resource_counter_repository().get_tenant_total(
+            keystone_id, models.ResourceCounter.SECRETS, session=session)
+
+        query = session.query(models.Secret)
+        query = query.filter_by(deleted=False)
+        query = query.filter(models.Secret.expiration <= utcnow)
+        query = query.join(models.Tenant,
+                           models.Secret.tenant_id == models.Tenant.id)
+        query = query.filter(models.Tenant.keystone_id == keystone_id)
+        return max(total - query.count(), 0)
+
+    def get_by_ids(self, keystone_id, entity_ids, load_payloads=False,
+                   session=None):
+        """Returns the tenant's secrets having the given ids, in one query.
+
+        Ids not matching an active secret of the tenant are left out of the
+        returned list, which is in no particular order. If load_payloads is
+        True, the ciphertext, KEKs and secret store metadata needed to
+        retrieve the secrets' payloads are loaded alongside the secrets,
+        rather than by a query per secret.
+        """
+        if not entity_ids:
+            return []
+
+        session = self.get_session(session)
+        query = self._build_get_by_ids_query(
+            session.query(models.Secret), keystone_id, entity_ids)
+
+        if load_payloads:
+            data = sa_orm.joinedload(models.Secret.encrypted_data)
+            query = query.options(
+                data.undefer_group('ciphertext'),
+                data.joinedload(models.EncryptedDatum.kek_meta_tenant),
+                sa_orm.subqueryload(models.Secret.secret_store_metadata))
+
+        return query.all()
+
+    def get_missing_ids(self, keystone_id, entity_ids, session=None):
+        """Returns the set of given ids not matching a secret of the tenant.
+
+        Only the ids of matching secrets are read, by a single query.
+        """
+        if not entity_ids:
+            return set()
+
+        session = self.get_session(session)
+        query = self._build_get_by_ids_query(
+            session.query(models.Secret.id), keystone_id, entity_ids)
+
+        return set(entity_ids).difference(row.id for row in query)
+
+    def _build_get_by_ids_query(self, query, keystone_id, entity_ids):
+        utcnow = timeutils.utcnow()
+
+        query = query.filter(models.Secret.id.in_(set(entity_ids)))
+        query = query.filter_by(deleted=False)
+        # Note(john-wood-w): SQLAlchemy requires '== None' below,
+        #   not 'is None'.
+        query = query.filter(or_(models.Secret.expiration == None,
+                                 models.Secret.expiration > utcnow))
+        query = query.join(models.Tenant,
+                           models.Secret.tenant_id == models.Tenant.id)
+        return query.filter(models.Tenant.keystone_id == keystone_id)
+
     def _do_entity_name(self):
         """Sub-class hook: return entity name, such as for debugging."""
         return "Secret"
@@ -739,15 +1639,14 @@ class SecretRepo(BaseRepo):
 
         # Note(john-wood-w): SQLAlchemy requires '== None' below,
         #   not 'is None'.
-        # TODO(jfwood): Performance? Is the many-to-many join needed?
         expiration_filter = or_(models.Secret.expiration == None,
                                 models.Secret.expiration > utcnow)
 
         query = session.query(models.Secret)
         query = query.filter_by(id=entity_id, deleted=False)
         query = query.filter(expiration_filter)
-        query = query.join(models.TenantSecret, models.Secret.tenant_assocs)
-        query = query.join(models.Tenant, models.TenantSecret.tenants)
+        query = query.join(models.Tenant,
+                           models.Secret.tenant_id == models.Tenant.id)
         query = query.filter(models.Tenant.keystone_id == keystone_id)
 
         return query
@@ -756,17 +1655,36 @@ class SecretRepo(BaseRepo):
         """Sub-class hook: validate values."""
         pass
 
+    def _do_update_counters(self, entity, delta, session):
+        """Sub-class hook: update resource counters for an entity."""
+        if entity.tenant_id:
+            get_resource_counter_repository().adjust(
+                entity.tenant_id, models.ResourceCounter.SECRETS, delta,
+                session=session)
+
     def _build_get_project_entities_query(self, tenant_id, session):
         """Builds query for retrieving Secrets associated with a given
-        project via TenantSecret association.
+        project.
 
         :param tenant_id: id of barbican tenant (project) entity
         :param session: existing db session reference.
         """
-        query = session.query(models.Secret).filter_by(deleted=False)
-        query = query.join(models.TenantSecret, models.Secret.tenant_assocs)
-        query = query.filter(models.TenantSecret.tenant_id == tenant_id)
-        return query
+        return session.query(models.Secret).filter_by(
+            tenant_id=tenant_id).filter_by(deleted=False)
+
+    def _do_delete_project_children(self, entity_ids, session):
+        """Sub-class hook: delete children of a batch of project entities."""
+        for child_class in (models.SecretStoreMetadatum,
+                            models.EncryptedDatum,
+                            models.TenantSecret):
+            session.query(child_class).filter(
+                child_class.secret_id.in_(entity_ids)
+            ).filter_by(deleted=False).update(_soft_delete_values(),
+                                              synchronize_session=False)
+
+        session.query(models.ContainerSecret).filter(
+            models.ContainerSecret.secret_id.in_(entity_ids)
+        ).delete(synchronize_session=False)
 
 
 class EncryptedDatumRepo(BaseRepo):
@@ -802,13 +1720,19 @@ class SecretStoreMetadatumRepo(BaseRepo):
 
         :raises NotFound if entity does not exist.
         """
+        session = get_session()
         now = timeutils.utcnow()
 
         for k, v in metadata.items():
             meta_model = models.SecretStoreMetadatum(k, v)
+            # Known ids let the flush insert all the metadata at once.
+            meta_model.id = utils.generate_uuid()
             meta_model.updated_at = now
             meta_model.secret = secret_model
-            meta_model.save()
+            session.add(meta_model)
+
+        if not defer_flush(session):
+            session.flush()
 
     def get_metadata_for_secret(self, secret_id):
         """Returns a dict of SecretStoreMetadatum instances."""
@@ -949,11 +1873,13 @@ class OrderRepo(BaseRepo):
     """Repository for the Order entity."""
 
     def get_by_create_date(self, keystone_id, offset_arg=None, limit_arg=None,
-                           suppress_exception=False, session=None):
+                           suppress_exception=False, session=None,
+                           marker_arg=None):
         """Returns a list of orders
 
         The list is ordered by the date they were created at and paged
-        based on the offset and limit fields.
+        based on the offset and limit fields, or on the marker field if one
+        is given.
 
         :param keystone_id: The keystone id for the tenant.
         :param offset_arg: The entity number where the query result should
@@ -962,8 +1888,12 @@ class OrderRepo(BaseRepo):
         :param suppress_exception: Whether NoResultFound exceptions should be
                                    suppressed.
         :param session: SQLAlchemy session object.
+        :param marker_arg: Marker from encode_marker() to seek to instead of
+                           using the offset, or an empty string for the
+                           first page.
 
         :returns: Tuple consisting of (list_of_entities, offset, limit, total).
+                  The total is None when paging by marker.
         """
 
         offset, limit = clean_paging_values(offset_arg, limit_arg)
@@ -977,11 +1907,13 @@ class OrderRepo(BaseRepo):
             query = query.join(models.Tenant, models.Order.tenant)
             query = query.filter(models.Tenant.keystone_id == keystone_id)
 
-            start = offset
-            end = offset + limit
-            LOG.debug('Retrieving from %s to %s', start, end)
-            total = query.count()
-            entities = query[start:end]
+            LOG.debug('Retrieving %s from offset %s or marker %s',
+                      limit, offset, marker_arg)
+            entities = _get_page(query, models.Order, offset, limit,
+                                 marker_arg)
+            total = _get_total(query, marker_arg, functools.partial(
+                get_resource_counter_repository().get_tenant_total,
+                keystone_id, models.ResourceCounter.ORDERS, session=session))
             LOG.debug('Number entities retrieved: %s out of %s',
                       len(entities), total
                       )
@@ -1014,6 +1946,12 @@ class OrderRepo(BaseRepo):
         """Sub-class hook: validate values."""
         pass
 
+    def _do_update_counters(self, entity, delta, session):
+        """Sub-class hook: update resource counters for an entity."""
+        get_resource_counter_repository().adjust(
+            entity.tenant_id, models.ResourceCounter.ORDERS, delta,
+            session=session)
+
     def _build_get_project_entities_query(self, tenant_id, session):
         """Builds query for retrieving orders related to given project.
 
@@ -1023,6 +1961,13 @@ class OrderRepo(BaseRepo):
         return session.query(models.Order).filter_by(
             tenant_id=tenant_id).filter_by(deleted=False)
 
+    def _do_delete_project_children(self, entity_ids, session):
+        """Sub-class hook: delete children of a batch of project entities."""
+        session.query(models.OrderPluginMetadatum).filter(
+            models.OrderPluginMetadatum.order_id.in_(entity_ids)
+        ).filter_by(deleted=False).update(_soft_delete_values(),
+                                          synchronize_session=False)
+
 
 class OrderPluginMetadatumRepo(BaseRepo):
     """Repository for the OrderPluginMetadatum entity
@@ -1084,12 +2029,19 @@ class ContainerRepo(BaseRepo):
     """Repository for the Container entity."""
 
     def get_by_create_date(self, keystone_id, offset_arg=None, limit_arg=None,
-                           suppress_exception=False, session=None):
+                           suppress_exception=False, session=None,
+                           marker_arg=None, include_consumers=True):
         """Returns a list of containers
 
         The list is ordered by the date they were created at and paged
-        based on the offset and limit fields. The keystone_id is
+        based on the offset and limit fields, or on the marker field if one
+        is given (see encode_marker()), in which case the total is not
+        computed and is returned as None. The keystone_id is
         external-to-Barbican value assigned to the tenant by Keystone.
+
+        The secret references of the containers, and their active consumers
+        if include_consumers is True, are loaded by one query each for the
+        whole page rather than per container.
         """
 
         offset, limit = clean_paging_values(offset_arg, limit_arg)
@@ -1103,11 +2055,19 @@ class ContainerRepo(BaseRepo):
             query = query.join(models.Tenant, models.Container.tenant)
             query = query.filter(models.Tenant.keystone_id == keystone_id)
 
-            start = offset
-            end = offset + limit
-            LOG.debug('Retrieving from %s to %s', start, end)
-            total = query.count()
-            entities = query[start:end]
+            LOG.debug('Retrieving %s from offset %s or marker %s',
+                      limit, offset, marker_arg)
+            page_query = query.options(
+                sa_orm.subqueryload(models.Container.container_secrets))
+            if include_consumers:
+                page_query = page_query.options(
+                    sa_orm.subqueryload(models.Container.active_consumers))
+            entities = _get_page(page_query, models.Container, offset, limit,
+                                 marker_arg)
+            total = _get_total(query, marker_arg, functools.partial(
+                get_resource_counter_repository().get_tenant_total,
+                keystone_id, models.ResourceCounter.CONTAINERS,
+                session=session))
             LOG.debug('Number entities retrieved: %s out of %s',
                       len(entities), total
                       )
@@ -1140,6 +2100,17 @@ class ContainerRepo(BaseRepo):
         """Sub-class hook: validate values."""
         pass
 
+    def _do_update_counters(self, entity, delta, session):
+        """Sub-class hook: update resource counters for an entity."""
+        counter_repo = get_resource_counter_repository()
+        counter_repo.adjust(entity.tenant_id,
+                            models.ResourceCounter.CONTAINERS, delta,
+                            session=session)
+        if delta > 0:
+            counter_repo.create_counters(
+                entity.id, (models.ResourceCounter.CONSUMERS,),
+                session=session)
+
     def _build_get_project_entities_query(self, tenant_id, session):
         """Builds query for retrieving container related to given project.
 
@@ -1149,6 +2120,12 @@ class ContainerRepo(BaseRepo):
         return session.query(models.Container).filter_by(
             deleted=False).filter_by(tenant_id=tenant_id)
 
+    def _do_delete_project_children(self, entity_ids, session):
+        """Sub-class hook: delete children of a batch of project entities."""
+        session.query(models.ContainerSecret).filter(
+            models.ContainerSecret.container_id.in_(entity_ids)
+        ).delete(synchronize_session=False)
+
 
 class ContainerSecretRepo(BaseRepo):
         """Repository for the ContainerSecret entity."""
@@ -1174,12 +2151,14 @@ class ContainerConsumerRepo(BaseRepo):
 
     def get_by_container_id(self, container_id,
                             offset_arg=None, limit_arg=None,
-                            suppress_exception=False, session=None):
+                            suppress_exception=False, session=None,
+                            marker_arg=None):
         """Returns a list of Consumers
 
-        The list is ordered by the date they were created at and paged
-        based on the offset and limit fields. The keystone_id is
-        external-to-Barbican value assigned to the tenant by Keystone.
+        The list is ordered by name and paged based on the offset and limit
+        fields. If a marker is given (see encode_marker()) the list is
+        instead ordered by the date they were created at and paged from the
+        marker, and the total is not computed and is returned as None.
         """
 
         offset, limit = clean_paging_values(offset_arg, limit_arg)
@@ -1194,11 +2173,14 @@ class ContainerConsumerRepo(BaseRepo):
                 models.ContainerConsumerMetadatum.container_id == container_id
             )
 
-            start = offset
-            end = offset + limit
-            LOG.debug('Retrieving from %s to %s', start, end)
-            total = query.count()
-            entities = query[start:end]
+            LOG.debug('Retrieving %s from offset %s or marker %s',
+                      limit, offset, marker_arg)
+            entities = _get_page(query, models.ContainerConsumerMetadatum,
+                                 offset, limit, marker_arg)
+            total = _get_total(query, marker_arg, functools.partial(
+                get_resource_counter_repository().get_total,
+                container_id, models.ResourceCounter.CONSUMERS,
+                session=session))
             LOG.debug('Number entities retrieved: %s out of %s',
                       len(entities), total
                       )
@@ -1253,10 +2235,14 @@ class ContainerConsumerRepo(BaseRepo):
             existing_consumer = self.get_by_values(
                 new_consumer.container_id, new_consumer.name, new_consumer.URL,
                 show_deleted=True)
+            if existing_consumer.deleted:
+                self._do_update_counters(existing_consumer, 1, session)
             existing_consumer.deleted = False
             existing_consumer.deleted_at = None
             # We are not concerned about timing here -- set only, no reads
             existing_consumer.save()
+        else:
+            self._do_update_counters(new_consumer, 1, session)
 
     def _do_entity_name(self):
         """Sub-class hook: return entity name, such as for debugging."""
@@ -1274,6 +2260,12 @@ class ContainerConsumerRepo(BaseRepo):
         """Sub-class hook: validate values."""
         pass
 
+    def _do_update_counters(self, entity, delta, session):
+        """Sub-class hook: update resource counters for an entity."""
+        get_resource_counter_repository().adjust(
+            entity.container_id, models.ResourceCounter.CONSUMERS, delta,
+            session=session)
+
 
 class TransportKeyRepo(BaseRepo):
     """Repository for the TransportKey entity
@@ -1345,6 +2337,122 @@ class TransportKeyRepo(BaseRepo):
         pass
 
 
+class ResourceCounterRepo(BaseRepo):
+    """Repository for the ResourceCounter entity.
+
+    Counters are adjusted with single UPDATE statements rather than by
+    loading and saving entities, so concurrent requests cannot lose each
+    other's changes.
+    """
+
+    def create_counters(self, scope_id, resource_types, session=None):
+        """Creates zeroed counters for a new Tenant or Container."""
+        session = self.get_session(session)
+        for resource_type in resource_types:
+            session.add(models.ResourceCounter(scope_id, resource_type))
+        if not defer_flush(session):
+            session.flush()
+
+    def adjust(self, scope_id, resource_type, delta, session=None):
+        """Adds delta to a counter, creating the counter if needed."""
+        session = self.get_session(session)
+        if self._update_total(scope_id, resource_type, delta, session):
+            return
+
+        LOG.debug("Creating missing %s counter for %s",
+                  resource_type, scope_id)
+        if not self._insert_counter(scope_id, resource_type, max(delta, 0),
+                                    session):
+            LOG.debug("%s counter for %s created concurrently",
+                      resource_type, scope_id)
+            self._update_total(scope_id, resource_type, delta, session)
+
+    def _insert_counter(self, scope_id, resource_type, total, session):
+        """Inserts a counter, returns False if it already exists.
+
+        The INSERT is executed right away on the session's connection, so
+        it does not flush the session within a unit of work. A conflict
+        with a counter just created by another writer is ignored by the
+        INSERT itself where the database supports it, else the INSERT is
+        undone by rolling back to a savepoint.
+        """
+        table = models.ResourceCounter.__table__
+        now = timeutils.utcnow()
+        insert = table.insert().values(
+            id=utils.generate_uuid(), created_at=now, updated_at=now,
+            status=models.States.ACTIVE, scope_id=scope_id,
+            resource_type=resource_type, total=total)
+
+        connection = session.connection()
+        prefix = _INSERT_IGNORE_PREFIXES.get(connection.dialect.name)
+        if prefix:
+            return bool(connection.execute(insert.prefix_with(prefix))
+                        .rowcount)
+        try:
+            with connection.begin_nested():
+                connection.execute(insert)
+        except sqlalchemy.exc.IntegrityError:
+            return False
+        return True
+
+    def _update_total(self, scope_id, resource_type, delta, session):
+        """Adds delta to a counter, returns False if there is no counter."""
+        table = models.ResourceCounter.__table__
+        result = session.execute(
+            table.update()
+            .where(table.c.scope_id == scope_id)
+            .where(table.c.resource_type == resource_type)
+            .values(total=table.c.total + delta,
+                    updated_at=timeutils.utcnow()))
+        return bool(result.rowcount)
+
+    def reset(self, scope_id, resource_types, session=None):
+        """Zeroes counters, such as when all their entities are deleted."""
+        session = self.get_session(session)
+        table = models.ResourceCounter.__table__
+        session.execute(
+            table.update()
+            .where(table.c.scope_id == scope_id)
+            .where(table.c.resource_type.in_(resource_types))
+            .values(total=0, updated_at=timeutils.utcnow()))
+
+    def get_total(self, scope_id, resource_type, session=None):
+        """Returns a counter's total, or 0 if there is no such counter."""
+        session = self.get_session(session)
+        query = session.query(models.ResourceCounter.total)
+        query = query.filter_by(scope_id=scope_id,
+                                resource_type=resource_type)
+        row = query.first()
+        return row.total if row else 0
+
+    def get_tenant_total(self, keystone_id, resource_type, session=None):
+        """Returns the total of a Tenant's counter given its keystone_id."""
+        session = self.get_session(session)
+        query = session.query(models.ResourceCounter.total)
+        query = query.join(models.Tenant,
+                           models.Tenant.id == models.ResourceCounter.scope_id)
+        query = query.filter(models.Tenant.keystone_id == keystone_id)
+        query = query.filter(
+            models.ResourceCounter.resource_type == resource_type)
+        row = query.first()
+        return row.total if row else 0
+
+    def _do_entity_name(self):
+        """Sub-class hook: return entity name, such as for debugging."""
+        return "ResourceCounter"
+
+    def _do_create_instance(self):
+        return models.ResourceCounter()
+
+    def _do_build_get_query(self, entity_id, keystone_id, session):
+        """Sub-class hook: build a retrieve query."""
+        return session.query(models.ResourceCounter).filter_by(id=entity_id)
+
+    def _do_validate(self, values):
+        """Sub-class hook: validate values."""
+        pass
+
+
 def get_secret_repository():
     """Returns a singleton Secret repository instance."""
     global _SECRET_REPOSITORY
@@ -1369,6 +2477,12 @@ def get_kek_datum_repository():
     return _get_repository(_KEK_DATUM_REPOSITORY, KEKDatumRepo)
 
 
+def get_resource_counter_repository():
+    """Returns a singleton Resource Counter repository instance."""
+    global _RESOURCE_COUNTER_REPOSITORY
+    return _get_repository(_RESOURCE_COUNTER_REPOSITORY, ResourceCounterRepo)
+
+
 def _get_repository(global_ref, repo_class):
     if not global_ref:
         global_ref = repo_class()
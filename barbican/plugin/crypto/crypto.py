@@ -306,6 +306,46 @@ class CryptoPluginBase(object):
         """
         raise NotImplementedError  # pragma: no cover
 
+    def encrypt_batch(self, encrypt_dtos, kek_meta_dto, keystone_id):
+        """Encrypts several secrets with the same project (tenant) KEK.
+
+        Called by Barbican instead of :meth:`encrypt` when a request stores
+        several secrets of a project at once, so that plugins can prepare
+        the KEK once for all of them. The default implementation calls
+        :meth:`encrypt` for each secret.
+
+        :param encrypt_dtos: List of :class:`EncryptDTO` instances.
+        :param kek_meta_dto: :class:`KEKMetaDTO` instance, as for
+            :meth:`encrypt`.
+        :param keystone_id: Project (tenant) ID associated with the
+            unencrypted data.
+        :return: A list of response DTOs, in the order of encrypt_dtos.
+        :rtype: list of :class:`ResponseDTO`
+        """
+        return [self.encrypt(encrypt_dto, kek_meta_dto, keystone_id)
+                for encrypt_dto in encrypt_dtos]
+
+    def decrypt_batch(self, decrypt_dtos, kek_meta_dto, kek_meta_extendeds,
+                      keystone_id):
+        """Decrypts several secrets encrypted with the same project KEK.
+
+        Called by Barbican instead of :meth:`decrypt` when a request
+        retrieves several secrets of a project at once. The default
+        implementation calls :meth:`decrypt` for each secret.
+
+        :param decrypt_dtos: List of :class:`DecryptDTO` instances.
+        :param kek_meta_dto: Key encryption key metadata to use for decryption
+        :param kek_meta_extendeds: List of the optional per-secret KEK
+            metadata, in the order of decrypt_dtos.
+        :param keystone_id: keystone_id associated with the encrypted data.
+        :returns: list of str -- unencrypted byte data, in the order of
+            decrypt_dtos
+        """
+        return [self.decrypt(decrypt_dto, kek_meta_dto, kek_meta_extended,
+                             keystone_id)
+                for decrypt_dto, kek_meta_extended in zip(decrypt_dtos,
+                                                          kek_meta_extendeds)]
+
     @abc.abstractmethod
     def bind_kek_metadata(self, kek_meta_dto):
         """Key Encryption Key Metadata binding function
@@ -17,8 +17,13 @@ except ImportError:
 
 
 import base64
+import contextlib
+import hashlib
+import threading
+import time
 
 from oslo.config import cfg
+import six
 
 from barbican.common import exception
 from barbican.common import utils
@@ -43,6 +48,36 @@ p11_crypto_plugin_opts = [
                help=u._('Master KEK length in bytes.')),
     cfg.StrOpt('hmac_label',
                help=u._('HMAC label (used in the HSM)')),
+    cfg.IntOpt('slot_id', default=1,
+               help=u._('HSM slot to open sessions on')),
+    cfg.IntOpt('session_pool_size', default=2,
+               help=u._('Maximum number of logged in HSM sessions each '
+                        'process uses concurrently')),
+    cfg.IntOpt('session_pool_timeout', default=30,
+               help=u._('Seconds to wait for a free HSM session before '
+                        'failing the operation')),
+    cfg.IntOpt('session_check_interval', default=60,
+               help=u._('Seconds a session may sit idle in the pool before '
+                        'it is checked with the HSM on its next use. 0 '
+                        'checks sessions on every use.')),
+    cfg.IntOpt('kek_cache_size', default=100,
+               help=u._('Maximum number of unwrapped project KEKs kept in '
+                        'the HSM as session objects. 0 unwraps the KEK on '
+                        'every operation.')),
+    cfg.IntOpt('kek_cache_ttl_seconds', default=300,
+               help=u._('Seconds an unwrapped project KEK is kept in the '
+                        'HSM.')),
+    cfg.BoolOpt('strict_random', default=True,
+                help=u._('Fetch the random bytes for each IV and generated '
+                         'key from the HSM when they are needed. When '
+                         'False, random bytes are fetched ahead in blocks '
+                         'and buffered in memory.')),
+    cfg.IntOpt('random_pool_size', default=4096,
+               help=u._('Number of random bytes buffered when strict_random '
+                        'is False')),
+    cfg.IntOpt('random_pool_low_water', default=1024,
+               help=u._('The random byte buffer is refilled in the '
+                        'background once it holds fewer bytes than this')),
 ]
 CONF.register_group(p11_crypto_plugin_group)
 CONF.register_opts(p11_crypto_plugin_opts, group=p11_crypto_plugin_group)
@@ -56,6 +91,355 @@ class P11CryptoPluginException(exception.BarbicanException):
     message = u._("General exception")
 
 
+class P11SessionPoolTimeout(P11CryptoPluginException):
+    message = u._("Timed out waiting for a free HSM session")
+
+
+class P11CachedKeyLost(P11CryptoPluginException):
+    message = u._("A cached project KEK was destroyed with its HSM session")
+
+
+def _is_session_error(error):
+    """Returns True if error means that the session, not the call, failed."""
+    session_errors = [getattr(PyKCS11, name, None) for name in (
+        'CKR_SESSION_HANDLE_INVALID',
+        'CKR_SESSION_CLOSED',
+        'CKR_USER_NOT_LOGGED_IN',
+        'CKR_DEVICE_REMOVED',
+        'CKR_TOKEN_NOT_PRESENT')]
+    return getattr(error, 'value', None) in session_errors
+
+
+def _is_key_handle_error(error):
+    """Returns True if error means that a key handle is no longer valid."""
+    handle_errors = [getattr(PyKCS11, name, None) for name in (
+        'CKR_KEY_HANDLE_INVALID',
+        'CKR_OBJECT_HANDLE_INVALID',
+        'CKR_WRAPPING_KEY_HANDLE_INVALID',
+        'CKR_UNWRAPPING_KEY_HANDLE_INVALID')]
+    return getattr(error, 'value', None) in handle_errors
+
+
+class P11SessionPool(object):
+    """Pool of logged in read/write PKCS11 sessions.
+
+    Each operation checks a session out for its whole duration, since
+    multi-part PKCS11 operations such as C_SignInit/C_Sign must run on one
+    session. Sessions are opened on demand up to the pool size. A session
+    that failed is closed and replaced by a freshly logged in one; idle
+    sessions are checked with the HSM before reuse once they have been idle
+    for a while, or when another session has failed since they were used.
+    """
+
+    def __init__(self, pkcs11, slot_id, login, size, timeout,
+                 check_interval, on_discard=None):
+        self.pkcs11 = pkcs11
+        self.slot_id = slot_id
+        self.login = login
+        self.size = max(size, 1)
+        self.timeout = timeout
+        self.check_interval = check_interval
+        # Called with each session closed after a failure.
+        self.on_discard = on_discard
+        # Idle sessions, with the time each was returned to the pool. The
+        # most recently returned session is reused first.
+        self._idle = []
+        # Guards the idle sessions and the count of open sessions, and is
+        # notified whenever a session is returned or its slot freed.
+        self._cond = threading.Condition()
+        self._opened = 0
+        self._last_failure = 0
+
+    def run(self, fn, *args):
+        """Returns fn(session, *args), called with a pooled session.
+
+        If the session turns out to be unusable, the call is retried once on
+        another session.
+        """
+        try:
+            return self._run_once(fn, args)
+        except PyKCS11.PyKCS11Error as e:
+            if not _is_session_error(e):
+                raise
+            LOG.warning(u._('Retrying on another HSM session after '
+                            'error: %s'), e)
+            return self._run_once(fn, args)
+
+    def _run_once(self, fn, args):
+        session = self._checkout()
+        session_failed = False
+        try:
+            return fn(session, *args)
+        except PyKCS11.PyKCS11Error as e:
+            session_failed = _is_session_error(e)
+            raise
+        finally:
+            if session_failed:
+                self._discard(session)
+            else:
+                self._return(session)
+
+    def _checkout(self):
+        deadline = time.time() + self.timeout
+        while True:
+            session, returned_at = self._wait_for_session(deadline)
+            if session is None:
+                return self._open_reserved_session()
+            if (returned_at > self._last_failure and
+                    time.time() - returned_at < self.check_interval):
+                return session
+            if self._is_healthy(session):
+                return session
+            self._discard(session)
+
+    def _wait_for_session(self, deadline):
+        """Returns an idle session and the time it was returned.
+
+        Returns (None, None) once a slot for a new session is reserved
+        instead, which the caller must then open.
+        """
+        with self._cond:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._opened < self.size:
+                    self._opened += 1
+                    return None, None
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise P11SessionPoolTimeout()
+                self._cond.wait(remaining)
+
+    def _is_healthy(self, session):
+        try:
+            session.getSessionInfo()
+            return True
+        except PyKCS11.PyKCS11Error as e:
+            LOG.warning(u._('Idle HSM session failed its check: %s'), e)
+            return False
+
+    def _open_reserved_session(self):
+        try:
+            return self._open_session()
+        except Exception:
+            self._release_slot()
+            raise
+
+    def _open_session(self):
+        session = self.pkcs11.openSession(self.slot_id,
+                                          PyKCS11.CKF_RW_SESSION)
+        try:
+            session.login(self.login)
+        except PyKCS11.PyKCS11Error as e:
+            # The login state is shared by all sessions of the process.
+            if e.value != PyKCS11.CKR_USER_ALREADY_LOGGED_IN:
+                raise
+        return session
+
+    def _return(self, session):
+        with self._cond:
+            self._idle.append((session, time.time()))
+            self._cond.notify()
+
+    def _release_slot(self, failed=False):
+        with self._cond:
+            self._opened -= 1
+            if failed:
+                self._last_failure = time.time()
+            self._cond.notify()
+
+    def _discard(self, session):
+        self._release_slot(failed=True)
+        if self.on_discard:
+            self.on_discard(session)
+        try:
+            session.closeSession()
+        except Exception as e:
+            LOG.debug('Failed to close HSM session: %s', e)
+
+
+class _CachedKey(object):
+    def __init__(self, handle, session):
+        self.handle = handle
+        self.session = session
+        self.users = 1
+        self.evicted = False
+        # Set once the session that created the key is closed, which also
+        # destroyed the key.
+        self.lost = False
+
+
+class P11KeyCache(object):
+    """LRU cache of unwrapped project KEK handles, with expiring entries.
+
+    Entries are keyed by a digest of the wrapped KEK. Keys are only
+    destroyed in the HSM once evicted and no longer in use; they are handed
+    back by pop_retired() for the caller to destroy with its session.
+    """
+
+    def __init__(self, size, ttl_seconds):
+        self.size = size
+        self.ttl_seconds = ttl_seconds
+        self._cache = utils.ExpiringLRUCache(
+            lambda: self.size, lambda: self.ttl_seconds,
+            on_evict=self._evict)
+        self._retired = []
+        # Guards the use counts and the retired keys. Held around every call
+        # to the cache, so that _evict() also runs with it held.
+        self._lock = threading.Lock()
+
+    def acquire(self, digest):
+        """Returns the cached key entry for digest, or None.
+
+        The entry must be given back with release() once used.
+        """
+        with self._lock:
+            entry = self._cache.get(digest)
+            if entry is not None:
+                entry.users += 1
+            return entry
+
+    def add(self, digest, handle, session):
+        """Caches a key just unwrapped by session, and returns its entry.
+
+        The entry must be given back with release() once used.
+        """
+        entry = _CachedKey(handle, session)
+        with self._lock:
+            self._cache.put(digest, entry)
+        return entry
+
+    def release(self, entry):
+        """Gives back an entry, returns True if its key was lost meanwhile.
+
+        The HSM may then have reused the key's handle for another key, so
+        whatever was done with the handle must be done again.
+        """
+        with self._lock:
+            entry.users -= 1
+            if entry.evicted and not entry.users and not entry.lost:
+                self._retired.append(entry)
+            return entry.lost
+
+    def pop_retired(self):
+        """Returns the handles of evicted keys no longer in use."""
+        with self._lock:
+            retired, self._retired = self._retired, []
+        return [entry.handle for entry in retired]
+
+    def forget_session(self, session):
+        """Drops the keys that were destroyed with a closed session.
+
+        Keys still in use by other sessions are marked as lost, so that the
+        operations using them can be retried with a freshly unwrapped key.
+        """
+        def created_by_session(digest, entry):
+            if entry.session is not session:
+                return False
+            entry.lost = True
+            return True
+
+        with self._lock:
+            self._cache.invalidate_matching(created_by_session)
+            self._retired = [entry for entry in self._retired
+                             if entry.session is not session]
+
+    def clear(self):
+        """Evicts all keys."""
+        with self._lock:
+            self._cache.clear()
+
+    def _evict(self, entry):
+        entry.evicted = True
+        if not entry.users and not entry.lost:
+            self._retired.append(entry)
+
+
+class P11RandomPool(object):
+    """Buffer of random bytes fetched from the HSM in blocks.
+
+    The buffer is first filled on the first get(), so that the plugin's
+    startup does not compete with a refill for sessions, and then refilled
+    in the background once it runs low. It is allocated once and filled in
+    place, so that no copy of the bytes is left behind, and bytes handed
+    out are wiped from it, as are the blocks fetched once copied into it.
+    """
+
+    def __init__(self, session_pool, size, low_water):
+        self.session_pool = session_pool
+        self.size = size
+        self.low_water = min(low_water, size)
+        self._buffer = bytearray(size)
+        # Number of random bytes held, at the start of the buffer.
+        self._available = 0
+        self._lock = threading.Lock()
+        self._refilling = False
+
+    def get(self, session, length):
+        """Returns length random bytes, as a list of integers.
+
+        Falls back to fetching the bytes with session when the buffer
+        cannot supply them.
+        """
+        with self._lock:
+            if self._available >= length:
+                # Taken from the end, byte by byte, as a slice would be
+                # another copy of the bytes left behind unwiped.
+                start = self._available - length
+                random_bytes = [self._buffer[index]
+                                for index in range(start, self._available)]
+                _wipe(self._buffer, start, self._available)
+                self._available = start
+            else:
+                random_bytes = None
+            running_low = self._available < self.low_water
+        if running_low:
+            self._start_refill()
+        if random_bytes is None:
+            fetched = session.generateRandom(length)
+            random_bytes = list(fetched)
+            _wipe(fetched, 0, len(fetched))
+        return random_bytes
+
+    def _start_refill(self):
+        with self._lock:
+            if self._refilling:
+                return
+            self._refilling = True
+        refill = threading.Thread(target=self._refill)
+        refill.daemon = True
+        refill.start()
+
+    def _refill(self):
+        try:
+            with self._lock:
+                missing = self.size - self._available
+            if missing > 0:
+                fetched = self.session_pool.run(
+                    lambda session: session.generateRandom(missing))
+                try:
+                    with self._lock:
+                        count = min(self.size - self._available,
+                                    len(fetched))
+                        for index in range(count):
+                            self._buffer[self._available + index] = (
+                                fetched[index])
+                        self._available += count
+                finally:
+                    _wipe(fetched, 0, len(fetched))
+        except Exception as e:
+            LOG.warning(u._('Failed to refill the HSM random pool: %s'), e)
+        finally:
+            with self._lock:
+                self._refilling = False
+
+
+def _wipe(values, start, end):
+    """Zeroes values[start:end] in place."""
+    for index in range(start, end):
+        values[index] = 0
+
+
 class P11CryptoPlugin(plugin.CryptoPluginBase):
     """PKCS11 supporting implementation of the crypto plugin.
 
@@ -77,28 +461,106 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
             self.pkcs11.load(conf.p11_crypto_plugin.library_path)
         # initialize the library. PyKCS11 does not supply this for free
         self._check_error(self.pkcs11.lib.C_Initialize())
-        self.session = self.pkcs11.openSession(1)
-        self.session.login(conf.p11_crypto_plugin.login)
-        self.rw_session = self.pkcs11.openSession(1, PyKCS11.CKF_RW_SESSION)
-        self.rw_session.login(conf.p11_crypto_plugin.login)
+        self.key_cache = P11KeyCache(
+            conf.p11_crypto_plugin.kek_cache_size,
+            conf.p11_crypto_plugin.kek_cache_ttl_seconds)
+        self.session_pool = P11SessionPool(
+            self.pkcs11,
+            conf.p11_crypto_plugin.slot_id,
+            conf.p11_crypto_plugin.login,
+            conf.p11_crypto_plugin.session_pool_size,
+            conf.p11_crypto_plugin.session_pool_timeout,
+            conf.p11_crypto_plugin.session_check_interval,
+            on_discard=self.key_cache.forget_session)
         self.current_mkek_label = conf.p11_crypto_plugin.mkek_label
         self.current_hmac_label = conf.p11_crypto_plugin.hmac_label
         LOG.debug("Current mkek label: %s", self.current_mkek_label)
         LOG.debug("Current hmac label: %s", self.current_hmac_label)
+        # Maps key labels to their handles in the HSM, see get_key_handles().
         self.key_handles = {}
+        # Serializes refresh_key_handles(); the generation counts refreshes.
+        self._refresh_lock = threading.Lock()
+        self._handles_generation = 0
         # cache current MKEK handle in the dictionary
-        self._get_or_generate_mkek(
+        self.session_pool.run(
+            self._get_or_generate_mkek,
             self.current_mkek_label,
             conf.p11_crypto_plugin.mkek_length
         )
-        self._get_or_generate_hmac_key(self.current_hmac_label)
+        self.session_pool.run(self._get_or_generate_hmac_key,
+                              self.current_hmac_label)
+        LOG.debug("Key handles: %s", self.get_key_handles())
+        if conf.p11_crypto_plugin.strict_random:
+            self.random_pool = None
+        else:
+            self.random_pool = P11RandomPool(
+                self.session_pool,
+                conf.p11_crypto_plugin.random_pool_size,
+                conf.p11_crypto_plugin.random_pool_low_water)
+
+    def get_key_handles(self):
+        """Returns the key handles resolved so far, by label.
+
+        For debugging; handles are only meaningful to this process.
+        """
+        return dict((label, str(handle))
+                    for label, handle in self.key_handles.items())
+
+    def refresh_key_handles(self, generation=None):
+        """Resolves the handles of the current MKEK and HMAC key again.
+
+        Handles of other labels are resolved again when next used. Called
+        when the HSM reports an invalid key handle, and should be called
+        after rotating the MKEK.
+
+        :param generation: The value of _handles_generation read before the
+                           failure that calls for a refresh. The handles are
+                           not resolved again if another refresh happened
+                           since.
+        """
+        with self._refresh_lock:
+            if (generation is not None and
+                    generation != self._handles_generation):
+                return
+            self.key_cache.clear()
+            self.key_handles = {}
+            for label in (self.current_mkek_label, self.current_hmac_label):
+                if self.session_pool.run(self._get_key_handle,
+                                         label) is None:
+                    raise P11CryptoPluginException(
+                        u._("Key {0} not found in the HSM").format(label))
+            self._handles_generation += 1
+        LOG.info(u._("Resolved key handles again: %s"),
+                 self.get_key_handles())
+
+    def _run(self, fn, *args):
+        """Returns fn(session, *args), called with a pooled session.
+
+        Key handles are resolved again and the call retried once if the HSM
+        rejects one of them, as after the HSM restored its keys. The call is
+        also retried once if a cached project KEK it used was destroyed with
+        the session that unwrapped it.
+        """
+        generation = self._handles_generation
+        try:
+            return self.session_pool.run(fn, *args)
+        except P11CachedKeyLost as e:
+            LOG.warning(u._('Retrying after error: %s'), e)
+            return self.session_pool.run(fn, *args)
+        except PyKCS11.PyKCS11Error as e:
+            if not _is_key_handle_error(e):
+                raise
+            LOG.warning(u._('Resolving key handles again after error: %s'),
+                        e)
+            self.refresh_key_handles(generation)
+            return self.session_pool.run(fn, *args)
 
     def _check_error(self, value):
         if value != PyKCS11.CKR_OK:
             raise PyKCS11.PyKCS11Error(value)
 
-    def _get_or_generate_mkek(self, mkek_label, mkek_key_length):
-        mkek = self._get_key_handle(mkek_label)
+    def _get_or_generate_mkek(self, session, mkek_label, mkek_key_length):
+        mkek = self._get_key_handle(session, mkek_label)
         if not mkek:
             # Generate a key that is persistent and not extractable
             template = (
@@ -116,14 +578,14 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
                 (PyKCS11.CKA_WRAP, True),
                 (PyKCS11.CKA_UNWRAP, True),
                 (PyKCS11.CKA_EXTRACTABLE, False))
-            mkek = self._generate_kek(template)
+            mkek = self._generate_kek(session, template)
 
         self.key_handles[mkek_label] = mkek
 
         return mkek
 
-    def _get_or_generate_hmac_key(self, hmac_label):
-        hmac_key = self._get_key_handle(hmac_label)
+    def _get_or_generate_hmac_key(self, session, hmac_label):
+        hmac_key = self._get_key_handle(session, hmac_label)
         if not hmac_key:
             # Generate a key that is persistent and not extractable
             template = (
@@ -137,13 +599,13 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
                 (PyKCS11.CKA_VERIFY, True),
                 (PyKCS11.CKA_TOKEN, True),
                 (PyKCS11.CKA_EXTRACTABLE, False))
-            hmac_key = self._generate_kek(template)
+            hmac_key = self._generate_kek(session, template)
 
         self.key_handles[hmac_label] = hmac_key
 
         return hmac_key
 
-    def _get_key_handle(self, mkek_label):
+    def _get_key_handle(self, session, mkek_label):
         if mkek_label in self.key_handles:
             return self.key_handles[mkek_label]
 
@@ -151,16 +613,23 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
             (PyKCS11.CKA_CLASS, PyKCS11.CKO_SECRET_KEY),
             (PyKCS11.CKA_KEY_TYPE, PyKCS11.CKK_AES),
             (PyKCS11.CKA_LABEL, mkek_label))
-        keys = self.session.findObjects(template)
+        keys = session.findObjects(template)
         if len(keys) == 1:
+            self.key_handles[mkek_label] = keys[0]
             return keys[0]
         elif len(keys) == 0:
             return None
         else:
             raise P11CryptoPluginKeyException()
 
-    def _generate_iv(self):
-        iv = self.session.generateRandom(self.block_size)
+    def _generate_random(self, session, length):
+        """Returns length random bytes from the HSM, as integers."""
+        if self.random_pool:
+            return self.random_pool.get(session, length)
+        return session.generateRandom(length)
+
+    def _generate_iv(self, session):
+        iv = self._generate_random(session, self.block_size)
         iv = b''.join(chr(i) for i in iv)
         if len(iv) != self.block_size:
             raise P11CryptoPluginException()
@@ -174,12 +643,13 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
         gcm.ulTagBits = 128
         return gcm
 
-    def _generate_kek(self, template):
+    def _generate_kek(self, session, template):
         """Generates both master and project KEKs
 
+        :param session: A session checked out of the session pool
         :param template: A tuple of tuples in (CKA_TYPE, VALUE) form
         """
-        ckattr = self.session._template2ckattrlist(template)
+        ckattr = session._template2ckattrlist(template)
 
         m = PyKCS11.LowLevel.CK_MECHANISM()
         m.mechanism = PyKCS11.LowLevel.CKM_AES_KEY_GEN
@@ -187,7 +657,7 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
         key = PyKCS11.LowLevel.CK_OBJECT_HANDLE()
         self._check_error(
             self.pkcs11.lib.C_GenerateKey(
-                self.rw_session.session,
+                session.session,
                 m,
                 ckattr,
                 key
@@ -195,7 +665,7 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
         )
         return key
 
-    def _generate_wrapped_kek(self, kek_label, key_length):
+    def _generate_wrapped_kek(self, session, kek_label, key_length):
         # generate a non-persistent key that is extractable
         template = (
             (PyKCS11.CKA_CLASS, PyKCS11.CKO_SECRET_KEY),
@@ -210,27 +680,27 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
             (PyKCS11.CKA_WRAP, True),
             (PyKCS11.CKA_UNWRAP, True),
             (PyKCS11.CKA_EXTRACTABLE, True))  # extractable
-        kek = self._generate_kek(template)
+        kek = self._generate_kek(session, template)
         m = PyKCS11.LowLevel.CK_MECHANISM()
         m.mechanism = PyKCS11.LowLevel.CKM_AES_CBC_PAD
-        iv = self._generate_iv()
+        iv = self._generate_iv(session)
         m.pParameter = iv
         encrypted = PyKCS11.ckbytelist()
-        mkek = self.key_handles[self.current_mkek_label]
+        mkek = self._get_key_handle(session, self.current_mkek_label)
         # first call reserves the bytes required in the ckbytelist
         self._check_error(
             self.pkcs11.lib.C_WrapKey(
-                self.rw_session.session, m, mkek, kek, encrypted
+                session.session, m, mkek, kek, encrypted
             )
         )
         # second call wraps and stores to encrypted
         self._check_error(
             self.pkcs11.lib.C_WrapKey(
-                self.rw_session.session, m, mkek, kek, encrypted
+                session.session, m, mkek, kek, encrypted
             )
         )
         wrapped_key = b''.join(chr(i) for i in encrypted)
-        hmac = self._compute_hmac(encrypted)
+        hmac = self._compute_hmac(session, encrypted)
         return {
             'iv': base64.b64encode(iv),
             'wrapped_key': base64.b64encode(wrapped_key),
@@ -239,44 +709,46 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
             'hmac_label': self.current_hmac_label
         }
 
-    def _compute_hmac(self, wrapped_bytelist):
+    def _compute_hmac(self, session, wrapped_bytelist):
         m = PyKCS11.LowLevel.CK_MECHANISM()
         m.mechanism = PyKCS11.LowLevel.CKM_SHA256_HMAC
         hmac_bytelist = PyKCS11.ckbytelist()
-        hmac_key = self.key_handles[self.current_hmac_label]
+        hmac_key = self._get_key_handle(session, self.current_hmac_label)
         self._check_error(
-            self.pkcs11.lib.C_SignInit(self.rw_session.session, m, hmac_key)
+            self.pkcs11.lib.C_SignInit(session.session, m, hmac_key)
         )
 
         # first call reserves the bytes required in the ckbytelist
         self._check_error(
             self.pkcs11.lib.C_Sign(
-                self.rw_session.session, wrapped_bytelist, hmac_bytelist
+                session.session, wrapped_bytelist, hmac_bytelist
             )
         )
         # second call computes HMAC
         self._check_error(
             self.pkcs11.lib.C_Sign(
-                self.rw_session.session, wrapped_bytelist, hmac_bytelist
+                session.session, wrapped_bytelist, hmac_bytelist
             )
         )
         return b''.join(chr(i) for i in hmac_bytelist)
 
-    def _verify_hmac(self, hmac_key, hmac_bytelist, wrapped_bytelist):
+    def _verify_hmac(self, session, hmac_key, hmac_bytelist,
+                     wrapped_bytelist):
         m = PyKCS11.LowLevel.CK_MECHANISM()
         m.mechanism = PyKCS11.LowLevel.CKM_SHA256_HMAC
         self._check_error(
-            self.pkcs11.lib.C_VerifyInit(self.rw_session.session, m, hmac_key)
+            self.pkcs11.lib.C_VerifyInit(session.session, m, hmac_key)
         )
         self._check_error(
             self.pkcs11.lib.C_Verify(
-                self.rw_session.session, wrapped_bytelist, hmac_bytelist
+                session.session, wrapped_bytelist, hmac_bytelist
             )
         )
 
-    def _unwrap_key(self, plugin_meta):
+    def _unwrap_key(self, session, plugin_meta):
         """Unwraps byte string to key handle in HSM.
 
+        :param session: A session checked out of the session pool
         :param plugin_meta: kek_meta_dto plugin meta (json string)
         :returns: Key handle from HSM. No unencrypted bytes.
         """
@@ -284,8 +756,8 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
         iv = base64.b64decode(meta['iv'])
         hmac = base64.b64decode(meta['hmac'])
         wrapped_key = base64.b64decode(meta['wrapped_key'])
-        mkek = self._get_key_handle(meta['mkek_label'])
-        hmac_key = self._get_key_handle(meta['hmac_label'])
+        mkek = self._get_key_handle(session, meta['mkek_label'])
+        hmac_key = self._get_key_handle(session, meta['hmac_label'])
         LOG.debug("Unwrapping key with %s mkek label", meta['mkek_label'])
 
         hmac_bytelist = PyKCS11.ckbytelist()
@@ -298,7 +770,7 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
             wrapped_bytelist.append(ord(x))
 
         LOG.debug("Verifying key with %s hmac label", meta['hmac_label'])
-        self._verify_hmac(hmac_key, hmac_bytelist, wrapped_bytelist)
+        self._verify_hmac(session, hmac_key, hmac_bytelist, wrapped_bytelist)
 
         unwrapped = PyKCS11.LowLevel.CK_OBJECT_HANDLE()
         m = PyKCS11.LowLevel.CK_MECHANISM()
@@ -315,11 +787,11 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
             (PyKCS11.CKA_UNWRAP, True),
             (PyKCS11.CKA_EXTRACTABLE, True)
         )
-        ckattr = self.session._template2ckattrlist(template)
+        ckattr = session._template2ckattrlist(template)
 
         self._check_error(
             self.pkcs11.lib.C_UnwrapKey(
-                self.rw_session.session,
+                session.session,
                 m,
                 mkek,
                 wrapped_bytelist,
@@ -330,36 +802,100 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
 
         return unwrapped
 
+    @contextlib.contextmanager
+    def _project_kek(self, session, plugin_meta):
+        """Provides the handle of the unwrapped project KEK.
+
+        Unwrapping takes several HSM calls, including the HMAC check of the
+        wrapped key, so unwrapped keys are cached by a digest of plugin_meta.
+        A cached key may have been unwrapped by another session, closed
+        while the key is in use. P11CachedKeyLost is then raised once done
+        with the key, whether or not the HSM rejected its handle, as the
+        handle may have been reused for another key.
+        """
+        if isinstance(plugin_meta, six.text_type):
+            plugin_meta = plugin_meta.encode('utf-8')
+        digest = hashlib.sha256(plugin_meta).digest()
+        entry = self.key_cache.acquire(digest)
+        if entry is None:
+            entry = self.key_cache.add(
+                digest, self._unwrap_key(session, plugin_meta), session)
+        try:
+            yield entry.handle
+        finally:
+            lost = self.key_cache.release(entry)
+            self._destroy_keys(session, self.key_cache.pop_retired())
+            if lost:
+                raise P11CachedKeyLost()
+
+    def _destroy_keys(self, session, handles):
+        for handle in handles:
+            try:
+                session.destroyObject(handle)
+            except PyKCS11.PyKCS11Error as e:
+                LOG.warning(u._('Failed to destroy unwrapped KEK: %s'), e)
+
     def encrypt(self, encrypt_dto, kek_meta_dto, keystone_id):
-        key = self._unwrap_key(kek_meta_dto.plugin_meta)
-        iv = self._generate_iv()
-        gcm = self._build_gcm_params(iv)
-        mech = PyKCS11.Mechanism(self.algorithm, gcm)
-        encrypted = self.session.encrypt(key, encrypt_dto.unencrypted, mech)
-        cyphertext = b''.join(chr(i) for i in encrypted)
-        kek_meta_extended = json.dumps({
-            'iv': base64.b64encode(iv)
-        })
-
-        return plugin.ResponseDTO(cyphertext, kek_meta_extended)
+        return self._run(self._encrypt, encrypt_dto.unencrypted, kek_meta_dto)
+
+    def encrypt_batch(self, encrypt_dtos, kek_meta_dto, keystone_id):
+        return self._run(self._encrypt_batch,
+                         [encrypt_dto.unencrypted
+                          for encrypt_dto in encrypt_dtos],
+                         kek_meta_dto)
+
+    def _encrypt(self, session, unencrypted, kek_meta_dto):
+        return self._encrypt_batch(session, [unencrypted], kek_meta_dto)[0]
+
+    def _encrypt_batch(self, session, unencrypted_list, kek_meta_dto):
+        response_dtos = []
+        with self._project_kek(session, kek_meta_dto.plugin_meta) as key:
+            for unencrypted in unencrypted_list:
+                iv = self._generate_iv(session)
+                gcm = self._build_gcm_params(iv)
+                mech = PyKCS11.Mechanism(self.algorithm, gcm)
+                encrypted = session.encrypt(key, unencrypted, mech)
+                cyphertext = b''.join(chr(i) for i in encrypted)
+                kek_meta_extended = json.dumps({
+                    'iv': base64.b64encode(iv)
+                })
+                response_dtos.append(
+                    plugin.ResponseDTO(cyphertext, kek_meta_extended))
+
+        return response_dtos
 
     def decrypt(self, decrypt_dto, kek_meta_dto, kek_meta_extended,
                 keystone_id):
-        key = self._unwrap_key(kek_meta_dto.plugin_meta)
-        meta_extended = json.loads(kek_meta_extended)
-        iv = base64.b64decode(meta_extended['iv'])
-        gcm = self._build_gcm_params(iv)
-        mech = PyKCS11.Mechanism(self.algorithm, gcm)
-        decrypted = self.session.decrypt(key, decrypt_dto.encrypted, mech)
-        secret = b''.join(chr(i) for i in decrypted)
-        return secret
+        return self._run(self._decrypt_batch, [decrypt_dto.encrypted],
+                         kek_meta_dto, [kek_meta_extended])[0]
+
+    def decrypt_batch(self, decrypt_dtos, kek_meta_dto, kek_meta_extendeds,
+                      keystone_id):
+        return self._run(self._decrypt_batch,
+                         [decrypt_dto.encrypted
+                          for decrypt_dto in decrypt_dtos],
+                         kek_meta_dto, kek_meta_extendeds)
+
+    def _decrypt_batch(self, session, encrypted_list, kek_meta_dto,
+                       kek_meta_extendeds):
+        secrets = []
+        with self._project_kek(session, kek_meta_dto.plugin_meta) as key:
+            for encrypted, kek_meta_extended in zip(encrypted_list,
+                                                    kek_meta_extendeds):
+                meta_extended = json.loads(kek_meta_extended)
+                iv = base64.b64decode(meta_extended['iv'])
+                gcm = self._build_gcm_params(iv)
+                mech = PyKCS11.Mechanism(self.algorithm, gcm)
+                decrypted = session.decrypt(key, encrypted, mech)
+                secrets.append(b''.join(chr(i) for i in decrypted))
+        return secrets
 
     def bind_kek_metadata(self, kek_meta_dto):
         # Enforce idempotency: If we've already generated a key leave now.
         if not kek_meta_dto.plugin_meta:
             kek_meta_dto.plugin_meta = json.dumps(
-                self._generate_wrapped_kek(
-                    kek_meta_dto.kek_label, 32
+                self._run(
+                    self._generate_wrapped_kek, kek_meta_dto.kek_label, 32
                 )
             )
             # To be persisted by Barbican:
@@ -371,10 +907,13 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
 
     def generate_symmetric(self, generate_dto, kek_meta_dto, keystone_id):
         byte_length = generate_dto.bit_length / 8
-        rand = self.session.generateRandom(byte_length)
+        return self._run(self._generate_symmetric, byte_length, kek_meta_dto)
+
+    def _generate_symmetric(self, session, byte_length, kek_meta_dto):
+        rand = self._generate_random(session, byte_length)
         if len(rand) != byte_length:
             raise P11CryptoPluginException()
-        return self.encrypt(plugin.EncryptDTO(rand), kek_meta_dto, keystone_id)
+        return self._encrypt(session, rand, kek_meta_dto)
 
     def generate_asymmetric(self, generate_dto, kek_meta_dto, keystone_id):
         raise NotImplementedError("Feature not implemented for PKCS11")
@@ -10,6 +10,7 @@
 # implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import hashlib
 import os
 
 from Crypto.PublicKey import DSA
@@ -19,6 +20,7 @@ from cryptography import fernet
 from oslo.config import cfg
 import six
 
+from barbican.common import utils
 from barbican.openstack.common import gettextutils as u
 from barbican.plugin.crypto import crypto as c
 
@@ -31,7 +33,13 @@ simple_crypto_plugin_opts = [
     cfg.StrOpt('kek',
                default=b'dGhpcnR5X3R3b19ieXRlX2tleWJsYWhibGFoYmxhaGg=',
                help=u._('Key encryption key to be used by Simple Crypto '
-                        'Plugin'))
+                        'Plugin')),
+    cfg.IntOpt('kek_cache_size', default=100,
+               help=u._('Maximum number of unwrapped project KEKs kept in '
+                        'memory. 0 disables the cache.')),
+    cfg.IntOpt('kek_cache_ttl_seconds', default=300,
+               help=u._('Seconds an unwrapped project KEK is kept in '
+                        'memory.'))
 ]
 CONF.register_group(simple_crypto_plugin_group)
 CONF.register_opts(simple_crypto_plugin_opts, group=simple_crypto_plugin_group)
@@ -42,34 +50,59 @@ class SimpleCryptoPlugin(c.CryptoPluginBase):
 
     def __init__(self, conf=CONF):
         self.master_kek = conf.simple_crypto_plugin.kek
-
-    def _get_kek(self, kek_meta_dto):
+        self._master_cipher = fernet.Fernet(self.master_kek)
+        # Project KEK ciphers, keyed by a digest of the wrapped KEK so that
+        # the wrapped KEK itself is not kept.
+        self._kek_ciphers = utils.ExpiringLRUCache(
+            lambda: conf.simple_crypto_plugin.kek_cache_size,
+            lambda: conf.simple_crypto_plugin.kek_cache_ttl_seconds)
+
+    def _get_kek_cipher(self, kek_meta_dto):
+        """Returns a Fernet cipher for the project KEK in kek_meta_dto.
+
+        Unwrapping the KEK dominates the cost of small encrypts and
+        decrypts, so ciphers are cached by a digest of the wrapped KEK.
+        """
         if not kek_meta_dto.plugin_meta:
             raise ValueError('KEK not yet created.')
-        # the kek is stored encrypted. Need to decrypt.
-        encryptor = fernet.Fernet(self.master_kek)
         # Note : If plugin_meta type is unicode, encode to byte.
         if isinstance(kek_meta_dto.plugin_meta, six.text_type):
             kek_meta_dto.plugin_meta = kek_meta_dto.plugin_meta.encode('utf-8')
 
-        return encryptor.decrypt(kek_meta_dto.plugin_meta)
+        key = hashlib.sha256(kek_meta_dto.plugin_meta).digest()
+        cipher = self._kek_ciphers.get(key)
+        if cipher is None:
+            # the kek is stored encrypted. Need to decrypt.
+            cipher = fernet.Fernet(
+                self._master_cipher.decrypt(kek_meta_dto.plugin_meta))
+            self._kek_ciphers.put(key, cipher)
+        return cipher
 
     def encrypt(self, encrypt_dto, kek_meta_dto, keystone_id):
-        kek = self._get_kek(kek_meta_dto)
-        unencrypted = encrypt_dto.unencrypted
-        if not isinstance(unencrypted, str):
-            raise ValueError('Unencrypted data must be a byte type, '
-                             'but was {0}'.format(type(unencrypted)))
-        encryptor = fernet.Fernet(kek)
-        cyphertext = encryptor.encrypt(unencrypted)
-        return c.ResponseDTO(cyphertext, None)
+        return self.encrypt_batch([encrypt_dto], kek_meta_dto, keystone_id)[0]
+
+    def encrypt_batch(self, encrypt_dtos, kek_meta_dto, keystone_id):
+        encryptor = self._get_kek_cipher(kek_meta_dto)
+        response_dtos = []
+        for encrypt_dto in encrypt_dtos:
+            unencrypted = encrypt_dto.unencrypted
+            if not isinstance(unencrypted, str):
+                raise ValueError('Unencrypted data must be a byte type, '
+                                 'but was {0}'.format(type(unencrypted)))
+            cyphertext = encryptor.encrypt(unencrypted)
+            response_dtos.append(c.ResponseDTO(cyphertext, None))
+        return response_dtos
 
     def decrypt(self, encrypted_dto, kek_meta_dto, kek_meta_extended,
                 keystone_id):
-        kek = self._get_kek(kek_meta_dto)
-        encrypted = encrypted_dto.encrypted
-        decryptor = fernet.Fernet(kek)
-        return decryptor.decrypt(encrypted)
+        return self.decrypt_batch([encrypted_dto], kek_meta_dto,
+                                  [kek_meta_extended], keystone_id)[0]
+
+    def decrypt_batch(self, encrypted_dtos, kek_meta_dto, kek_meta_extendeds,
+                      keystone_id):
+        decryptor = self._get_kek_cipher(kek_meta_dto)
+        return [decryptor.decrypt(encrypted_dto.encrypted)
+                for encrypted_dto in encrypted_dtos]
 
     def bind_kek_metadata(self, kek_meta_dto):
         kek_meta_dto.algorithm = 'aes'
@@ -77,7 +110,7 @@ class SimpleCryptoPlugin(c.CryptoPluginBase):
         kek_meta_dto.mode = 'cbc'
         if not kek_meta_dto.plugin_meta:
             # the kek is stored encrypted in the plugin_meta field
-            encryptor = fernet.Fernet(self.master_kek)
+            encryptor = self._master_cipher
             key = fernet.Fernet.generate_key()
             kek_meta_dto.plugin_meta = encryptor.encrypt(key)
         return kek_meta_dto
@@ -126,24 +159,18 @@ class SimpleCryptoPlugin(c.CryptoPluginBase):
                 raise ValueError('Passphrase not supported for DSA key')
             public_key, private_key = self._serialize_dsa_key(public_key,
                                                               private_key)
-        private_dto = self.encrypt(c.EncryptDTO(private_key),
-                                   kek_meta_dto,
-                                   keystone_id)
-
-        public_dto = self.encrypt(c.EncryptDTO(public_key),
-                                  kek_meta_dto,
-                                  keystone_id)
-
-        passphrase_dto = None
+        encrypt_dtos = [c.EncryptDTO(private_key), c.EncryptDTO(public_key)]
         if generate_dto.passphrase:
             if isinstance(generate_dto.passphrase, six.text_type):
                 generate_dto.passphrase = generate_dto.passphrase.encode(
                     'utf-8')
 
-            passphrase_dto = self.encrypt(c.EncryptDTO(generate_dto.
-                                                       passphrase),
-                                          kek_meta_dto,
-                                          keystone_id)
+            encrypt_dtos.append(c.EncryptDTO(generate_dto.passphrase))
+
+        response_dtos = self.encrypt_batch(encrypt_dtos, kek_meta_dto,
+                                           keystone_id)
+        private_dto, public_dto = response_dtos[:2]
+        passphrase_dto = response_dtos[2] if generate_dto.passphrase else None
 
         return private_dto, public_dto, passphrase_dto
 
@@ -43,6 +43,8 @@ store_opts = [
 CONF.register_group(store_opt_group)
 CONF.register_opts(store_opts, group=store_opt_group)
 
+_SECRET_STORE = None
+
 
 class SecretStorePluginNotFound(exception.BarbicanException):
     """Raised when no plugins are installed."""
@@ -426,6 +428,12 @@ def _enforce_extensions_configured(plugin_related_function):
 class SecretStorePluginManager(named.NamedExtensionManager):
     def __init__(self, conf=CONF, invoke_on_load=True,
                  invoke_args=(), invoke_kwargs={}):
+        """Secret Store Plugin Manager
+
+        Each time this class is initialized it will load a new instance
+        of each enabled secret store plugin. This is undesirable, so rather
+        than initializing a new instance of this class use get_manager().
+        """
         super(SecretStorePluginManager, self).__init__(
             conf.secretstore.namespace,
             conf.secretstore.enabled_secretstore_plugins,
@@ -433,6 +441,25 @@ class SecretStorePluginManager(named.NamedExtensionManager):
             invoke_args=invoke_args,
             invoke_kwds=invoke_kwargs
         )
+        self._indexed_extensions = None
+        self._plugins_by_name = {}
+
+    def _get_plugin_by_name(self, plugin_name):
+        """Gets a plugin via its full name, as per generate_fullname_for().
+
+        The name-to-plugin index is (re)built whenever the extensions list
+        is replaced, so lookups are a dict access on the request path.
+        """
+        if self._indexed_extensions is not self.extensions:
+            self._plugins_by_name = dict(
+                (utils.generate_fullname_for(ext.obj), ext.obj)
+                for ext in self.extensions)
+            self._indexed_extensions = self.extensions
+
+        plugin = self._plugins_by_name.get(plugin_name)
+        if plugin is None:
+            raise SecretStorePluginNotFound(plugin_name)
+        return plugin
 
     @_enforce_extensions_configured
     def get_plugin_store(self, key_spec, plugin_name=None,
@@ -447,10 +474,7 @@ class SecretStorePluginManager(named.NamedExtensionManager):
         """
 
         if plugin_name is not None:
-            for ext in self.extensions:
-                if utils.generate_fullname_for(ext.obj) == plugin_name:
-                    return ext.obj
-            raise SecretStorePluginNotFound(plugin_name)
+            return self._get_plugin_by_name(plugin_name)
 
         if not transport_key_needed:
             for ext in self.extensions:
@@ -472,10 +496,7 @@ class SecretStorePluginManager(named.NamedExtensionManager):
         :returns: SecretStoreBase plugin implementation
         """
 
-        for ext in self.extensions:
-            if utils.generate_fullname_for(ext.obj) == plugin_name:
-                return ext.obj
-        raise SecretStorePluginNotFound(plugin_name)
+        return self._get_plugin_by_name(plugin_name)
 
     @_enforce_extensions_configured
     def get_plugin_generate(self, key_spec):
@@ -490,3 +511,26 @@ class SecretStorePluginManager(named.NamedExtensionManager):
             if ext.obj.generate_supports(key_spec):
                 return ext.obj
         raise SecretStoreSupportedPluginNotFound()
+
+
+def get_manager():
+    """Returns the process-wide secret store plugin manager.
+
+    Plugins are loaded on first use and then reused for the life of the
+    process, avoiding a stevedore scan and plugin re-instantiation (which for
+    Dogtag and KMIP means rebuilding clients) on every request.
+    """
+    global _SECRET_STORE
+    if _SECRET_STORE is None:
+        _SECRET_STORE = SecretStorePluginManager()
+    return _SECRET_STORE
+
+
+def reload_manager():
+    """Discards the cached plugin manager and loads plugins anew.
+
+    Call this after the [secretstore] configuration has changed.
+    """
+    global _SECRET_STORE
+    _SECRET_STORE = None
+    return get_manager()
@@ -11,8 +11,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+
 from barbican.common import utils
 from barbican.model import models
+from barbican.model import repositories
 from barbican.plugin.interface import secret_store
 from barbican.plugin import store_crypto
 from barbican.plugin.util import translations as tr
@@ -23,7 +26,7 @@ def get_transport_key_model(key_spec, repos, transport_key_needed):
     if transport_key_needed:
         # get_plugin_store() will throw an exception if no suitable
         # plugin with transport key is found
-        plugin_manager = secret_store.SecretStorePluginManager()
+        plugin_manager = secret_store.get_manager()
         store_plugin = plugin_manager.get_plugin_store(
             key_spec=key_spec, transport_key_needed=True)
         plugin_name = utils.generate_fullname_for(store_plugin)
@@ -89,44 +92,92 @@ def store_secret(unencrypted_raw, content_type_raw, content_encoding,
                                             repos,
                                             transport_key_needed)
 
-        _save_secret(secret_model, tenant_model, repos)
+        with repositories.unit_of_work():
+            _save_secret(secret_model, tenant_model, repos)
         return secret_model, key_model
 
-    plugin_name, transport_key = get_plugin_name_and_transport_key(
-        repos, transport_key_id)
+    store_request = _prepare_store(
+        unencrypted_raw, content_type_raw, content_encoding, key_spec,
+        secret_model, repos, transport_key_id)
 
-    # Locate a suitable plugin to store the secret.
-    plugin_manager = secret_store.SecretStorePluginManager()
-    store_plugin = plugin_manager.get_plugin_store(
-        key_spec=key_spec, plugin_name=plugin_name)
-
-    # Normalize inputs prior to storage.
-    # TODO(john-wood-w) Normalize all secrets to base64, so we don't have to
-    #  pass in 'content' type to the store_secret() call below.
-    unencrypted, content_type = tr.normalize_before_encryption(
-        unencrypted_raw, content_type_raw, content_encoding,
-        enforce_text_only=True)
+    # The secret, its datum and metadata are written with a single flush.
+    with repositories.unit_of_work():
+        secret_metadata = _store_secret(
+            store_request.store_plugin, store_request.secret_dto,
+            secret_model, tenant_model)
+        _save_stored_secret(store_request, secret_metadata, tenant_model,
+                            repos)
 
-    # Store the secret securely.
-    # TODO(john-wood-w) Remove the SecretStoreContext once repository factory
-    #  and unit test patch work is completed.
-    secret_type = None
-    if key_spec is not None:
-        secret_store.KeyAlgorithm().get_secret_type(key_spec.alg)
-    secret_dto = secret_store.SecretDTO(type=secret_type,
-                                        secret=unencrypted,
-                                        key_spec=key_spec,
-                                        content_type=content_type,
-                                        transport_key=transport_key)
-    secret_metadata = _store_secret(
-        store_plugin, secret_dto, secret_model, tenant_model)
+    return secret_model, None
 
-    # Save secret and metadata.
-    _save_secret(secret_model, tenant_model, repos)
-    _save_secret_metadata(secret_model, secret_metadata, store_plugin,
-                          content_type, repos)
 
-    return secret_model, None
+def store_secrets(specs, tenant_model, repos):
+    """Store several provided secrets into secure backend.
+
+    The secrets are written by a single flush, and secrets with the same key
+    spec share their plugin lookup and KEK resolution. Secrets stored by a
+    crypto adapter plugin are passed to it together, so that it encrypts
+    them in one batch.
+
+    :param specs: List of validated new secret requests, each a dict as
+                  accepted by the secrets resource.
+    :returns: List of (secret_model, transport_key_model) tuples in the
+              order of specs, as returned by store_secret().
+    """
+    store_cache = dict()
+    results = [None] * len(specs)
+    adapter_batches = collections.OrderedDict()
+    with repositories.unit_of_work():
+        for index, spec in enumerate(specs):
+            content_type = spec.get('payload_content_type',
+                                    'application/octet-stream')
+            if not spec.get('payload'):
+                results[index] = store_secret(
+                    None, content_type, spec.get('payload_content_encoding'),
+                    spec, None, tenant_model, repos,
+                    transport_key_needed=spec.get(
+                        'transport_key_needed', 'false').lower() == 'true',
+                    transport_key_id=spec.get('transport_key_id'))
+                continue
+
+            secret_model = models.Secret(spec)
+            store_request = _prepare_store(
+                spec.get('payload'), content_type,
+                spec.get('payload_content_encoding'),
+                secret_store.KeySpec(alg=spec.get('algorithm'),
+                                     bit_length=spec.get('bit_length'),
+                                     mode=spec.get('mode')),
+                secret_model, repos, spec.get('transport_key_id'),
+                store_cache)
+            results[index] = (secret_model, None)
+
+            store_plugin = store_request.store_plugin
+            if isinstance(store_plugin, store_crypto.StoreCryptoAdapterPlugin):
+                adapter_batches.setdefault(
+                    id(store_plugin), (store_plugin, [])
+                )[1].append(store_request)
+                continue
+            secret_metadata = _store_secret(
+                store_plugin, store_request.secret_dto, secret_model,
+                tenant_model)
+            _save_stored_secret(store_request, secret_metadata, tenant_model,
+                                repos)
+
+        for store_plugin, store_requests in adapter_batches.values():
+            contexts = [
+                store_crypto.StoreCryptoContext(
+                    tenant_model,
+                    secret_model=store_request.secret_model,
+                    store_cache=store_cache)
+                for store_request in store_requests]
+            secrets_metadata = store_plugin.store_secrets(
+                [store_request.secret_dto for store_request in store_requests],
+                contexts)
+            for store_request, secret_metadata in zip(store_requests,
+                                                      secrets_metadata):
+                _save_stored_secret(store_request, secret_metadata,
+                                    tenant_model, repos)
+    return results
 
 
 def get_secret(requesting_content_type, secret_model, tenant_model, repos,
@@ -142,7 +193,7 @@ def get_secret(requesting_content_type, secret_model, tenant_model, repos,
         secret_metadata['transport_key'] = transport_key
 
     # Locate a suitable plugin to store the secret.
-    plugin_manager = secret_store.SecretStorePluginManager()
+    plugin_manager = secret_store.get_manager()
     retrieve_plugin = plugin_manager.get_plugin_retrieve_delete(
         secret_metadata.get('plugin_name'))
 
@@ -159,12 +210,71 @@ def get_secret(requesting_content_type, secret_model, tenant_model, repos,
                                            requesting_content_type)
 
 
+def get_secrets(secret_models, tenant_model):
+    """Retrieves the payloads of several secrets of a tenant.
+
+    The secret models are expected to have their encrypted data and secret
+    store metadata loaded already, such as by SecretRepo.get_by_ids().
+    Secrets encrypted with the same KEK are retrieved together, and are
+    decrypted in one batch by crypto adapter plugins.
+    A failure to retrieve one secret does not prevent retrieving the others.
+
+    :returns: A list of (secret_model, secret_dto, secret_metadata, error)
+              tuples in the order of secret_models, where error is the
+              exception raised retrieving that secret, if any.
+    """
+    def kek_id(secret_model):
+        if secret_model.encrypted_data:
+            return secret_model.encrypted_data[0].kek_id
+        return None
+
+    plugin_manager = secret_store.get_manager()
+    results = [None] * len(secret_models)
+    # Secrets held by a crypto adapter plugin are retrieved together, so that
+    # the plugin can decrypt the secrets sharing a KEK in one batch.
+    adapter_batches = collections.OrderedDict()
+    for index in sorted(range(len(secret_models)),
+                        key=lambda i: kek_id(secret_models[i])):
+        secret_model = secret_models[index]
+        secret_metadata = dict(
+            (key, datum.value)
+            for key, datum in secret_model.secret_store_metadata.items()
+            if not datum.deleted)
+        try:
+            retrieve_plugin = plugin_manager.get_plugin_retrieve_delete(
+                secret_metadata.get('plugin_name'))
+            if isinstance(retrieve_plugin,
+                          store_crypto.StoreCryptoAdapterPlugin):
+                adapter_batches.setdefault(
+                    id(retrieve_plugin), (retrieve_plugin, [])
+                )[1].append((index, secret_metadata))
+                continue
+            secret_dto = _get_secret(
+                retrieve_plugin, secret_metadata, secret_model, tenant_model)
+            results[index] = (secret_model, secret_dto, secret_metadata, None)
+        except Exception as e:
+            results[index] = (secret_model, None, secret_metadata, e)
+
+    for retrieve_plugin, items in adapter_batches.values():
+        contexts = [
+            store_crypto.StoreCryptoContext(
+                tenant_model, secret_model=secret_models[index])
+            for index, secret_metadata in items]
+        retrieved = retrieve_plugin.get_secrets(
+            [secret_metadata for index, secret_metadata in items], contexts)
+        for (index, secret_metadata), (secret_dto, error) in zip(items,
+                                                                 retrieved):
+            results[index] = (secret_models[index], secret_dto,
+                              secret_metadata, error)
+    return results
+
+
 def get_transport_key_id_for_retrieval(secret_model, repos):
     """Return a transport key ID for retrieval if the plugin supports it."""
 
     secret_metadata = _get_secret_meta(secret_model, repos)
 
-    plugin_manager = secret_store.SecretStorePluginManager()
+    plugin_manager = secret_store.get_manager()
     retrieve_plugin = plugin_manager.get_plugin_retrieve_delete(
         secret_metadata.get('plugin_name'))
 
@@ -181,20 +291,22 @@ def generate_secret(spec, content_type,
                                     bit_length=spec.get('bit_length'),
                                     mode=spec.get('mode'))
 
-    plugin_manager = secret_store.SecretStorePluginManager()
+    plugin_manager = secret_store.get_manager()
     generate_plugin = plugin_manager.get_plugin_generate(key_spec)
 
     # Create secret model to eventually save metadata to.
     secret_model = models.Secret(spec)
 
-    # Generate the secret.
-    secret_metadata = _generate_symmetric_key(
-        generate_plugin, key_spec, secret_model, tenant_model, content_type)
+    with repositories.unit_of_work():
+        # Generate the secret.
+        secret_metadata = _generate_symmetric_key(
+            generate_plugin, key_spec, secret_model, tenant_model,
+            content_type)
 
-    # Save secret and metadata.
-    _save_secret(secret_model, tenant_model, repos)
-    _save_secret_metadata(secret_model, secret_metadata, generate_plugin,
-                          content_type, repos)
+        # Save secret and metadata.
+        _save_secret(secret_model, tenant_model, repos)
+        _save_secret_metadata(secret_model, secret_metadata, generate_plugin,
+                              content_type, repos)
 
     return secret_model
 
@@ -207,7 +319,7 @@ def generate_asymmetric_secret(spec, content_type,
                                     bit_length=spec.get('bit_length'),
                                     passphrase=spec.get('passphrase'))
 
-    plugin_manager = secret_store.SecretStorePluginManager()
+    plugin_manager = secret_store.get_manager()
     generate_plugin = plugin_manager.get_plugin_generate(key_spec)
 
     # Create secret models to eventually save metadata to.
@@ -216,41 +328,42 @@ def generate_asymmetric_secret(spec, content_type,
     passphrase_secret_model = models.Secret(spec)\
         if spec.get('passphrase') else None
 
-    # Generate the secret.
-    asymmetric_meta_dto = _generate_asymmetric_key(
-        generate_plugin,
-        key_spec,
-        private_secret_model,
-        public_secret_model,
-        passphrase_secret_model,
-        tenant_model
-    )
-
-    # Save secret and metadata.
-    _save_secret(private_secret_model, tenant_model, repos)
-    _save_secret_metadata(private_secret_model,
-                          asymmetric_meta_dto.private_key_meta,
-                          generate_plugin,
-                          content_type, repos)
-
-    _save_secret(public_secret_model, tenant_model, repos)
-    _save_secret_metadata(public_secret_model,
-                          asymmetric_meta_dto.public_key_meta,
-                          generate_plugin,
-                          content_type, repos)
+    with repositories.unit_of_work():
+        # Generate the secret.
+        asymmetric_meta_dto = _generate_asymmetric_key(
+            generate_plugin,
+            key_spec,
+            private_secret_model,
+            public_secret_model,
+            passphrase_secret_model,
+            tenant_model
+        )
+
+        # Save secret and metadata.
+        _save_secret(private_secret_model, tenant_model, repos)
+        _save_secret_metadata(private_secret_model,
+                              asymmetric_meta_dto.private_key_meta,
+                              generate_plugin,
+                              content_type, repos)
 
-    if spec.get('passphrase'):
-        _save_secret(passphrase_secret_model, tenant_model, repos)
-        _save_secret_metadata(passphrase_secret_model,
-                              asymmetric_meta_dto.passphrase_meta,
+        _save_secret(public_secret_model, tenant_model, repos)
+        _save_secret_metadata(public_secret_model,
+                              asymmetric_meta_dto.public_key_meta,
                               generate_plugin,
                               content_type, repos)
 
-    # Now create container
-    container_model = _save_container(spec, tenant_model, repos,
-                                      private_secret_model,
-                                      public_secret_model,
-                                      passphrase_secret_model)
+        if spec.get('passphrase'):
+            _save_secret(passphrase_secret_model, tenant_model, repos)
+            _save_secret_metadata(passphrase_secret_model,
+                                  asymmetric_meta_dto.passphrase_meta,
+                                  generate_plugin,
+                                  content_type, repos)
+
+        # Now create container
+        container_model = _save_container(spec, tenant_model, repos,
+                                          private_secret_model,
+                                          public_secret_model,
+                                          passphrase_secret_model)
 
     return container_model
 
@@ -263,7 +376,7 @@ def delete_secret(secret_model, project_id, repos):
     secret_metadata = _get_secret_meta(secret_model, repos)
 
     # Locate a suitable plugin to delete the secret from.
-    plugin_manager = secret_store.SecretStorePluginManager()
+    plugin_manager = secret_store.get_manager()
     delete_plugin = plugin_manager.get_plugin_retrieve_delete(
         secret_metadata.get('plugin_name'))
 
@@ -275,6 +388,60 @@ def delete_secret(secret_model, project_id, repos):
                                           keystone_id=project_id)
 
 
+# A secret ready to be stored by its plugin, see _prepare_store().
+_StoreRequest = collections.namedtuple(
+    '_StoreRequest', ['secret_model', 'store_plugin', 'secret_dto',
+                      'content_type'])
+
+
+def _prepare_store(unencrypted_raw, content_type_raw, content_encoding,
+                   key_spec, secret_model, repos, transport_key_id,
+                   store_cache=None):
+    """Locates the plugin to store a secret, and normalizes the secret."""
+    plugin_name, transport_key = get_plugin_name_and_transport_key(
+        repos, transport_key_id)
+
+    # Locate a suitable plugin to store the secret.
+    plugin_key = ('store_plugin', plugin_name, key_spec.alg, key_spec.mode,
+                  key_spec.bit_length) if key_spec else None
+    if store_cache is not None and plugin_key in store_cache:
+        store_plugin = store_cache[plugin_key]
+    else:
+        plugin_manager = secret_store.get_manager()
+        store_plugin = plugin_manager.get_plugin_store(
+            key_spec=key_spec, plugin_name=plugin_name)
+        if store_cache is not None:
+            store_cache[plugin_key] = store_plugin
+
+    # Normalize inputs prior to storage.
+    # TODO(john-wood-w) Normalize all secrets to base64, so we don't have to
+    #  pass in 'content' type to the store_secret() call below.
+    unencrypted, content_type = tr.normalize_before_encryption(
+        unencrypted_raw, content_type_raw, content_encoding,
+        enforce_text_only=True)
+
+    # Store the secret securely.
+    # TODO(john-wood-w) Remove the SecretStoreContext once repository factory
+    #  and unit test patch work is completed.
+    secret_type = None
+    if key_spec is not None:
+        secret_store.KeyAlgorithm().get_secret_type(key_spec.alg)
+    secret_dto = secret_store.SecretDTO(type=secret_type,
+                                        secret=unencrypted,
+                                        key_spec=key_spec,
+                                        content_type=content_type,
+                                        transport_key=transport_key)
+    return _StoreRequest(secret_model, store_plugin, secret_dto, content_type)
+
+
+def _save_stored_secret(store_request, secret_metadata, tenant_model, repos):
+    """Saves a secret just stored by its plugin, and its metadata."""
+    _save_secret(store_request.secret_model, tenant_model, repos)
+    _save_secret_metadata(store_request.secret_model, secret_metadata,
+                          store_request.store_plugin,
+                          store_request.content_type, repos)
+
+
 def _store_secret(store_plugin, secret_dto, secret_model, tenant_model):
     if isinstance(store_plugin, store_crypto.StoreCryptoAdapterPlugin):
         context = store_crypto.StoreCryptoContext(
@@ -359,6 +526,7 @@ def _save_secret(secret_model, tenant_model, repos):
 
     # Create Secret entities in data store.
     if not secret_model.id:
+        secret_model.tenant_id = tenant_model.id
         repos.secret_repo.create_from(secret_model)
         new_assoc = models.TenantSecret()
         new_assoc.tenant_id = tenant_model.id
@@ -12,17 +12,95 @@
 # limitations under the License.
 
 import base64
+import collections
 
 from oslo.config import cfg
 
 from barbican.common import utils
 from barbican.model import models
 from barbican.model import repositories
+from barbican.openstack.common import gettextutils as u
 from barbican.plugin.crypto import crypto
 from barbican.plugin.crypto import manager
 from barbican.plugin.interface import secret_store as sstore
 
+kek_cache_opts = [
+    cfg.IntOpt('kek_cache_size', default=1000,
+               help=u._('Maximum number of bound project KEKs cached by '
+                        'each process. 0 disables the cache.')),
+    cfg.IntOpt('kek_cache_ttl_seconds', default=300,
+               help=u._('Seconds a cached project KEK is used before it is '
+                        'looked up again. Bounds how long another process '
+                        'may use a rotated KEK.')),
+]
+
 CONF = cfg.CONF
+CONF.register_opts(kek_cache_opts)
+
+LOG = utils.getLogger(__name__)
+
+# The bound metadata of a KEKDatum row, as served from the cache. Like
+# resources.CachedTenant, it is not a model that could end up in a session.
+CachedKEKDatum = collections.namedtuple(
+    'CachedKEKDatum', ['id', 'kek_label', 'plugin_name', 'algorithm',
+                       'bit_length', 'mode', 'plugin_meta'])
+
+
+class KEKCache(object):
+    """Bounded LRU cache of the active, bound KEK of each project and plugin.
+
+    Entries are keyed by (tenant_id, plugin_name) and expire. The size and
+    expiry are read from configuration on each call.
+    """
+
+    def __init__(self):
+        self._cache = utils.ExpiringLRUCache(
+            lambda: CONF.kek_cache_size,
+            lambda: CONF.kek_cache_ttl_seconds)
+
+    def get(self, tenant_id, plugin_name):
+        """Returns the cached KEK for the project and plugin, or None."""
+        return self._cache.get((tenant_id, plugin_name))
+
+    def put(self, kek_datum):
+        """Caches the id and bound metadata of a KEKDatum."""
+        cached = CachedKEKDatum(id=kek_datum.id,
+                                kek_label=kek_datum.kek_label,
+                                plugin_name=kek_datum.plugin_name,
+                                algorithm=kek_datum.algorithm,
+                                bit_length=kek_datum.bit_length,
+                                mode=kek_datum.mode,
+                                plugin_meta=kek_datum.plugin_meta)
+        self._cache.put((kek_datum.tenant_id, kek_datum.plugin_name), cached)
+
+    def invalidate(self, tenant_id, plugin_name=None):
+        """Drops the cached KEKs of a project.
+
+        Must be called when a project's KEK is rotated or the project is
+        deleted.
+
+        :param tenant_id: The Barbican ID of the project.
+        :param plugin_name: Only drop the KEK of this plugin, if given.
+        """
+        self._cache.invalidate_matching(
+            lambda key, kek_datum: (key[0] == tenant_id and
+                                    plugin_name in (None, key[1])))
+
+    def clear(self):
+        """Drops all cached KEKs and resets the statistics."""
+        self._cache.clear()
+
+    def get_stats(self):
+        """Returns the statistics of the cache, see ExpiringLRUCache."""
+        return self._cache.get_stats()
+
+
+_KEK_CACHE = KEKCache()
+
+
+def get_kek_cache():
+    """Returns the process wide project KEK cache."""
+    return _KEK_CACHE
 
 
 class StoreCryptoContext(object):
@@ -38,13 +116,17 @@ class StoreCryptoContext(object):
             private_secret_model=None,
             public_secret_model=None,
             passphrase_secret_model=None,
-            content_type=None):
+            content_type=None,
+            store_cache=None):
         self.secret_model = secret_model
         self.private_secret_model = private_secret_model
         self.public_secret_model = public_secret_model
         self.passphrase_secret_model = passphrase_secret_model
         self.tenant_model = tenant_model
         self.content_type = content_type
+        # Optional dict shared by the contexts of a bulk store request, so
+        # that the tenant's KEK is resolved once for all of its secrets.
+        self.store_cache = store_cache
 
 
 class StoreCryptoAdapterPlugin(object):
@@ -79,7 +161,7 @@ class StoreCryptoAdapterPlugin(object):
 
         # Find or create a key encryption key metadata.
         kek_datum_model, kek_meta_dto = _find_or_create_kek_objects(
-            encrypting_plugin, context.tenant_model)
+            encrypting_plugin, context.tenant_model, context.store_cache)
 
         encrypt_dto = crypto.EncryptDTO(secret_dto.secret)
 
@@ -99,6 +181,46 @@ class StoreCryptoAdapterPlugin(object):
 
         return None
 
+    def store_secrets(self, secret_dtos, contexts):
+        """Store several secrets.
+
+        The secrets of each project are encrypted with a single
+        encrypt_batch() call to the crypto plugin.
+
+        :param secret_dtos: list of SecretDTO
+        :param contexts: list of StoreCryptoContext, one per secret
+        :returns: list of the optional metadata dictionaries of the secrets,
+                  in the order of secret_dtos
+        """
+        encrypting_plugin = manager.PLUGIN_MANAGER.get_plugin_store_generate(
+            crypto.PluginSupportTypes.ENCRYPT_DECRYPT
+        )
+
+        batches = collections.OrderedDict()
+        for secret_dto, context in zip(secret_dtos, contexts):
+            batches.setdefault(context.tenant_model.id, []).append(
+                (secret_dto, context))
+
+        for batch in batches.values():
+            tenant_model = batch[0][1].tenant_model
+            kek_datum_model, kek_meta_dto = _find_or_create_kek_objects(
+                encrypting_plugin, tenant_model, batch[0][1].store_cache)
+
+            response_dtos = encrypting_plugin.encrypt_batch(
+                [crypto.EncryptDTO(secret_dto.secret)
+                 for secret_dto, context in batch],
+                kek_meta_dto, tenant_model.keystone_id)
+
+            for (secret_dto, context), response_dto in zip(batch,
+                                                           response_dtos):
+                if not context.content_type:
+                    context.content_type = secret_dto.content_type
+                _store_secret_and_datum(
+                    context, context.secret_model, kek_datum_model,
+                    response_dto)
+
+        return [None] * len(secret_dtos)
+
     def get_secret(self, secret_metadata, context):
         """Retrieve a secret.
 
@@ -120,22 +242,76 @@ class StoreCryptoAdapterPlugin(object):
         # wrap the KEKDatum instance in our DTO
         kek_meta_dto = crypto.KEKMetaDTO(datum_model.kek_meta_tenant)
 
-        # Convert from text-based storage format to binary.
-        encrypted = base64.b64decode(datum_model.cypher_text)
-        decrypt_dto = crypto.DecryptDTO(encrypted)
+        decrypt_dto = crypto.DecryptDTO(_get_cypher_data(datum_model))
 
         # Decrypt the secret.
         secret = decrypting_plugin.decrypt(decrypt_dto,
                                            kek_meta_dto,
                                            datum_model.kek_meta_extended,
                                            context.tenant_model.keystone_id)
-        key_spec = sstore.KeySpec(alg=context.secret_model.algorithm,
-                                  bit_length=context.secret_model.bit_length,
-                                  mode=context.secret_model.mode)
+        return _build_secret_dto(context.secret_model, datum_model, secret)
+
+    def get_secrets(self, secrets_metadata, contexts):
+        """Retrieve several secrets.
+
+        Secrets encrypted with the same KEK are decrypted with a single
+        decrypt_batch() call to their crypto plugin. Should a batch fail, its
+        secrets are retrieved one at a time so that each one gets its own
+        result.
 
-        return sstore.SecretDTO(sstore.SecretType.SYMMETRIC,
-                                secret, key_spec,
-                                datum_model.content_type)
+        :param secrets_metadata: list of secret metadata
+        :param contexts: list of StoreCryptoContext, one per secret
+        :returns: list of (SecretDTO, exception) tuples in the order of
+                  contexts, where exception is the error raised retrieving
+                  that secret, if any
+        """
+        results = [None] * len(contexts)
+        batches = collections.OrderedDict()
+        for index, context in enumerate(contexts):
+            if (not context.secret_model or
+                    not context.secret_model.encrypted_data):
+                results[index] = (None, sstore.SecretNotFoundException())
+                continue
+            datum_model = context.secret_model.encrypted_data[0]
+            batches.setdefault(datum_model.kek_id, []).append(index)
+
+        for indexes in batches.values():
+            try:
+                secret_dtos = self._get_secrets_batch(
+                    [contexts[index] for index in indexes])
+            except Exception:
+                LOG.exception(u._('Problem decrypting a batch of secrets, '
+                                  'retrieving them one at a time'))
+                for index in indexes:
+                    try:
+                        results[index] = (self.get_secret(
+                            secrets_metadata[index], contexts[index]), None)
+                    except Exception as e:
+                        results[index] = (None, e)
+            else:
+                for index, secret_dto in zip(indexes, secret_dtos):
+                    results[index] = (secret_dto, None)
+        return results
+
+    def _get_secrets_batch(self, contexts):
+        """Decrypts secrets that share a KEK, returning their SecretDTOs."""
+        datum_models = [context.secret_model.encrypted_data[0]
+                        for context in contexts]
+        kek_datum_model = datum_models[0].kek_meta_tenant
+
+        decrypting_plugin = manager.PLUGIN_MANAGER.get_plugin_retrieve(
+            kek_datum_model.plugin_name)
+        kek_meta_dto = crypto.KEKMetaDTO(kek_datum_model)
+
+        secrets = decrypting_plugin.decrypt_batch(
+            [crypto.DecryptDTO(_get_cypher_data(datum_model))
+             for datum_model in datum_models],
+            kek_meta_dto,
+            [datum_model.kek_meta_extended for datum_model in datum_models],
+            contexts[0].tenant_model.keystone_id)
+        return [_build_secret_dto(context.secret_model, datum_model, secret)
+                for context, datum_model, secret
+                in zip(contexts, datum_models, secrets)]
 
     def delete_secret(self, secret_metadata):
         """Delete a secret."""
@@ -268,13 +444,32 @@ def _determine_generation_type(algorithm):
         raise sstore.SecretAlgorithmNotSupportedException(algorithm)
 
 
-def _find_or_create_kek_objects(plugin_inst, tenant_model):
-    kek_repo = repositories.get_kek_datum_repository()
+def _find_or_create_kek_objects(plugin_inst, tenant_model, store_cache=None):
+    """Returns the project's active KEK for the plugin, and its KEKMetaDTO.
 
-    # Find or create a key encryption key.
+    The KEK is returned as a KEKDatum model, or as a CachedKEKDatum if it
+    was served from the process wide KEK cache. KEKs are only cached once
+    they are found already bound, as a KEK created or bound by this
+    transaction may yet roll back.
+    """
     full_plugin_name = utils.generate_fullname_for(plugin_inst)
+    cache_key = ('kek', tenant_model.id, full_plugin_name)
+    if store_cache is not None and cache_key in store_cache:
+        return store_cache[cache_key]
+
+    cached = _KEK_CACHE.get(tenant_model.id, full_plugin_name)
+    if cached:
+        kek_objects = (cached, crypto.KEKMetaDTO(cached))
+        if store_cache is not None:
+            store_cache[cache_key] = kek_objects
+        return kek_objects
+
+    # Find or create a key encryption key.
+    kek_repo = repositories.get_kek_datum_repository()
     kek_datum_model = kek_repo.find_or_create_kek_datum(tenant_model,
                                                         full_plugin_name)
+    if kek_datum_model.bind_completed:
+        _KEK_CACHE.put(kek_datum_model)
 
     # Bind to the plugin's key management.
     # TODO(jwood): Does this need to be in a critical section? Should the
@@ -291,6 +486,8 @@ def _find_or_create_kek_objects(plugin_inst, tenant_model):
         _indicate_bind_completed(kek_meta_dto, kek_datum_model)
         kek_repo.save(kek_datum_model)
 
+    if store_cache is not None:
+        store_cache[cache_key] = (kek_datum_model, kek_meta_dto)
     return kek_datum_model, kek_meta_dto
 
 
@@ -299,6 +496,7 @@ def _store_secret_and_datum(
 
     # Create Secret entities in data store.
     if not secret_model.id:
+        secret_model.tenant_id = context.tenant_model.id
         repositories.get_secret_repository().create_from(secret_model)
         new_assoc = models.TenantSecret()
         new_assoc.tenant_id = context.tenant_model.id
@@ -308,15 +506,39 @@ def _store_secret_and_datum(
         repositories.get_tenant_secret_repository().create_from(new_assoc)
 
     # setup and store encrypted datum
-    datum_model = models.EncryptedDatum(secret_model, kek_datum_model)
+    if isinstance(kek_datum_model, CachedKEKDatum):
+        datum_model = models.EncryptedDatum(secret_model)
+        datum_model.kek_id = kek_datum_model.id
+    else:
+        datum_model = models.EncryptedDatum(secret_model, kek_datum_model)
     datum_model.content_type = context.content_type
-    datum_model.cypher_text = base64.b64encode(generated_dto.cypher_text)
+    datum_model.cypher_data = generated_dto.cypher_text
     datum_model.kek_meta_extended = generated_dto.kek_meta_extended
     datum_model.secret_id = secret_model.id
     repositories.get_encrypted_datum_repository().create_from(
         datum_model)
 
 
+def _build_secret_dto(secret_model, datum_model, secret):
+    key_spec = sstore.KeySpec(alg=secret_model.algorithm,
+                              bit_length=secret_model.bit_length,
+                              mode=secret_model.mode)
+    return sstore.SecretDTO(sstore.SecretType.SYMMETRIC,
+                            secret, key_spec,
+                            datum_model.content_type)
+
+
+def _get_cypher_data(datum_model):
+    """Returns the ciphertext of an encrypted datum as bytes.
+
+    Data stored by older releases is held base64 encoded in the cypher_text
+    column rather than as is in cypher_data.
+    """
+    if datum_model.cypher_data is not None:
+        return bytes(datum_model.cypher_data)
+    return base64.b64decode(datum_model.cypher_text)
+
+
 def _indicate_bind_completed(kek_meta_dto, kek_datum):
     """Updates the supplied kek_datum instance
 
@@ -22,6 +22,7 @@ from oslo.config import cfg
 
 from barbican.common import utils
 from barbican.model import repositories
+from barbican.openstack.common import gettextutils as u
 from barbican.openstack.common import service
 from barbican import queue
 from barbican.tasks import resources
@@ -29,7 +30,16 @@ from barbican.tasks import resources
 
 LOG = utils.getLogger(__name__)
 
+purge_opts = [
+    cfg.IntOpt('purge_deleted_interval', default=0,
+               help=u._('Seconds between purges of old soft deleted '
+                        'entities by the worker, see '
+                        'purge_deleted_age_days. 0 disables the purge. It '
+                        'only needs enabling on one worker.')),
+]
+
 CONF = cfg.CONF
+CONF.register_opts(purge_opts)
 
 
 def transactional(fn):
@@ -41,6 +51,7 @@ def transactional(fn):
             fn(*args, **kwargs)  # Non-server mode directly invokes tasks.
         else:
             # Start the database session.
+            repositories.reset_query_stats()
             repositories.start()
 
             # Manage session/transaction.
@@ -57,6 +68,8 @@ def transactional(fn):
                 repositories.rollback()
             finally:
                 repositories.clear()
+                repositories.log_query_stats('task ' + fn.__name__)
+                repositories.clear_query_stats()
 
     return wrapper
 
@@ -121,6 +134,22 @@ class TaskServer(Tasks, service.Service):
         self._server.start()
         super(TaskServer, self).start()
 
+        interval = CONF.purge_deleted_interval
+        if interval > 0:
+            self.tg.add_timer(interval, self._purge_deleted_entities,
+                              initial_delay=interval)
+
+    def _purge_deleted_entities(self):
+        """Purges old soft deleted entities, called on a timer."""
+        repositories.start()
+        try:
+            repositories.purge_deleted_entities()
+        except Exception:
+            LOG.exception('Problem purging soft deleted entities')
+            repositories.rollback()
+        finally:
+            repositories.clear()
+
     def stop(self):
         super(TaskServer, self).stop()
         self._server.stop()
@@ -17,9 +17,11 @@
 Server-side Keystone notification payload processing logic.
 """
 
+from barbican.common import resources as c_resources
 from barbican.common import utils
 from barbican.model import repositories as rep
 from barbican.openstack.common import gettextutils as u
+from barbican.plugin import store_crypto
 from barbican.tasks import resources
 
 
@@ -113,6 +115,8 @@ class KeystoneEventConsumer(resources.BaseTask):
         tenant_id = project.id
 
         rep.delete_all_project_resources(tenant_id, self.repos)
+        c_resources.get_tenant_cache().invalidate(project.keystone_id)
+        store_crypto.get_kek_cache().invalidate(tenant_id)
 
         # reached here means there is no error so log the successful
         # cleanup log entry.
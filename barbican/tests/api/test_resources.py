@@ -19,6 +19,7 @@ resource classes. For RBAC tests of these classes, see the
 'resources_policy_test.py' module.
 """
 import base64
+import datetime
 import logging
 import mimetypes
 import urllib
@@ -32,10 +33,15 @@ from barbican.api import app
 from barbican.api import controllers
 from barbican.common import exception as excep
 from barbican.common import hrefs
+from barbican.common import resources as res
 from barbican.common import validators
 import barbican.context
 from barbican.model import models
+from barbican.model import repositories
+from barbican.openstack.common import policy
 from barbican.openstack.common import timeutils
+from barbican.plugin.interface import secret_store
+from barbican.plugin import store_crypto
 from barbican.tests import utils
 
 
@@ -149,6 +155,10 @@ class FunctionalTest(utils.BaseTestCase):
 
     def setUp(self):
         super(FunctionalTest, self).setUp()
+        # Tenants and KEKs looked up through mocked repositories must not be
+        # served from the caches to later tests.
+        self.addCleanup(res.get_tenant_cache().clear)
+        self.addCleanup(store_crypto.get_kek_cache().clear)
         root = self.root
         config = {'app': {'root': root}}
         pecan.set_config(config, overwrite=True)
@@ -176,6 +186,44 @@ class WhenTestingVersionResource(FunctionalTest):
         self.assertEqual('current', resp.json['v1'])
 
 
+class WhenCollectingSQLStatsForRequests(FunctionalTest):
+
+    def setUp(self):
+        super(WhenCollectingSQLStatsForRequests, self).setUp()
+        self.addCleanup(repositories.CONF.clear_override, 'debug')
+        self.app = webtest.TestApp(app.PecanAPI(self.root))
+        self.env = get_barbican_env(self.keystone_id)
+        self.app.extra_environ = self.env
+
+    def test_should_attach_stats_to_context(self):
+        self.app.get('/')
+
+        self.assertIsNotNone(self.env['barbican.context'].sql_stats)
+        self.assertEqual(0, self.env['barbican.context'].sql_stats.count)
+
+    def test_should_stop_collecting_stats_after_request(self):
+        self.app.get('/')
+        self.assertIsNone(repositories.get_query_stats())
+
+        self.app.get('/not-a-resource', expect_errors=True)
+        self.assertIsNone(repositories.get_query_stats())
+
+    def test_should_return_stats_headers_in_debug_mode(self):
+        repositories.CONF.set_override('debug', True)
+
+        resp = self.app.get('/')
+
+        self.assertEqual('0', resp.headers['X-Barbican-SQL-Queries'])
+        self.assertIn('X-Barbican-SQL-Time', resp.headers)
+
+    def test_should_not_return_stats_headers_by_default(self):
+        repositories.CONF.set_override('debug', False)
+
+        resp = self.app.get('/')
+
+        self.assertNotIn('X-Barbican-SQL-Queries', resp.headers)
+
+
 class BaseSecretsResource(FunctionalTest):
     """Base test class for the Secrets resource."""
 
@@ -788,7 +836,8 @@ class WhenGettingSecretsListUsingSecretsResource(FunctionalTest):
             name=self.name,
             alg=None,
             mode=None,
-            bits=0
+            bits=0,
+            marker_arg=None
         )
 
         self.assertIn('secrets', resp.namespace)
@@ -810,7 +859,8 @@ class WhenGettingSecretsListUsingSecretsResource(FunctionalTest):
             name='',
             alg=None,
             mode=None,
-            bits=0
+            bits=0,
+            marker_arg=None
         )
 
         self.assertTrue('previous' in resp.namespace)
@@ -828,6 +878,70 @@ class WhenGettingSecretsListUsingSecretsResource(FunctionalTest):
         self.assertTrue(resp.body.count(url_hrefs) ==
                         (self.num_secrets + 2))
 
+    def test_should_get_list_secrets_by_marker(self):
+        for secret in self.secrets:
+            secret.created_at = datetime.datetime(2014, 1, 1)
+        page = self.secrets[:self.limit]
+        self.secret_repo.get_by_create_date.return_value = (page, 0,
+                                                            self.limit, None)
+        marker = repositories.encode_marker(datetime.datetime(2013, 1, 1),
+                                            'id')
+
+        resp = self.app.get(
+            '/secrets/',
+            {'limit': self.limit, 'marker': marker}
+        )
+
+        self.secret_repo.get_by_create_date.assert_called_once_with(
+            self.keystone_id,
+            offset_arg=0,
+            limit_arg=u'{0}'.format(self.limit),
+            suppress_exception=True,
+            name='',
+            alg=None,
+            mode=None,
+            bits=0,
+            marker_arg=marker
+        )
+
+        self.assertNotIn('total', resp.namespace)
+
+        next_marker = repositories.encode_marker(page[-1].created_at,
+                                                 page[-1].id)
+        self.assertTrue(resp.namespace['next'].endswith(
+            self._create_marker_url(self.limit, next_marker)))
+
+        previous_marker = repositories.encode_marker(page[0].created_at,
+                                                     page[0].id,
+                                                     reverse=True)
+        self.assertTrue(resp.namespace['previous'].endswith(
+            self._create_marker_url(self.limit, previous_marker)))
+
+    def test_should_get_list_secrets_without_total(self):
+        self.secret_repo.get_by_create_date.return_value = (
+            self.secrets[:self.limit], self.offset, self.limit, None)
+
+        resp = self.app.get(
+            '/secrets/',
+            dict((k, v) for k, v in self.params.items() if v is not None)
+        )
+
+        self.assertNotIn('total', resp.namespace)
+        self.assertIn('previous', resp.namespace)
+        self.assertIn('next', resp.namespace)
+
+    def test_should_reject_invalid_marker(self):
+        self.secret_repo.get_by_create_date.side_effect = (
+            excep.InvalidMarker())
+
+        resp = self.app.get(
+            '/secrets/',
+            {'limit': self.limit, 'marker': 'bogus'},
+            expect_errors=True
+        )
+
+        self.assertEqual(resp.status_int, 400)
+
     def test_response_should_include_total(self):
         resp = self.app.get(
             '/secrets/',
@@ -854,7 +968,8 @@ class WhenGettingSecretsListUsingSecretsResource(FunctionalTest):
             name='',
             alg=None,
             mode=None,
-            bits=0
+            bits=0,
+            marker_arg=None
         )
 
         self.assertFalse('previous' in resp.namespace)
@@ -878,7 +993,8 @@ class WhenGettingSecretsListUsingSecretsResource(FunctionalTest):
             name='',
             alg=None,
             mode=None,
-            bits=0
+            bits=0,
+            marker_arg=None
         )
 
     def _create_url(self, keystone_id, offset_arg=None, limit_arg=None):
@@ -890,6 +1006,9 @@ class WhenGettingSecretsListUsingSecretsResource(FunctionalTest):
         else:
             return '/secrets'
 
+    def _create_marker_url(self, limit, marker):
+        return '/secrets?limit={0}&marker={1}'.format(limit, marker)
+
 
 class WhenGettingPuttingOrDeletingSecretUsingSecretResource(FunctionalTest):
     def setUp(self):
@@ -1426,6 +1545,257 @@ class WhenGettingPuttingOrDeletingSecretUsingSecretResource(FunctionalTest):
         self.assertEqual(resp.content_type, "application/json")
 
 
+class WhenBatchGettingSecretsUsingSecretsResource(FunctionalTest):
+    def setUp(self):
+        super(
+            WhenBatchGettingSecretsUsingSecretsResource, self
+        ).setUp()
+        self.app = webtest.TestApp(app.PecanAPI(self.root))
+        self.app.extra_environ = get_barbican_env(self.keystone_id)
+
+    @property
+    def root(self):
+        self._init()
+
+        class RootController(object):
+            secrets = controllers.secrets.SecretsController(
+                self.tenant_repo, self.secret_repo, mock.MagicMock(),
+                mock.MagicMock(), mock.MagicMock(), mock.MagicMock(),
+                mock.MagicMock()
+            )
+
+        return RootController()
+
+    def _init(self):
+        self.keystone_id = 'keystone1234'
+
+        self.tenant = models.Tenant()
+        self.tenant.id = 'tenantid1234'
+        self.tenant.keystone_id = self.keystone_id
+        self.tenant_repo = mock.MagicMock()
+        self.tenant_repo.find_by_keystone_id.return_value = self.tenant
+
+        self.secrets = [create_secret(id_ref='id1', name='name1'),
+                        create_secret(id_ref='id2', name='name2')]
+        self.secret_repo = mock.MagicMock()
+        self.secret_repo.get_by_ids.return_value = self.secrets
+
+        self.secret_refs = [hrefs.convert_secret_to_href(secret.id)
+                            for secret in self.secrets]
+
+    def _post(self, body, **kwargs):
+        return self.app.post_json('/secrets/batch-get/', body, **kwargs)
+
+    def test_should_get_secrets_metadata(self):
+        resp = self._post({'secret_refs': self.secret_refs})
+
+        self.assertEqual(200, resp.status_int)
+        self.secret_repo.get_by_ids.assert_called_once_with(
+            self.keystone_id, ['id1', 'id2'], load_payloads=False)
+        items = resp.namespace['secrets']
+        self.assertEqual(self.secret_refs,
+                         [item['secret_ref'] for item in items])
+        self.assertEqual(['name1', 'name2'], [item['name'] for item in items])
+        self.assertNotIn('payload', items[0])
+
+    def test_should_report_missing_secret_without_failing_batch(self):
+        self.secret_repo.get_by_ids.return_value = self.secrets[:1]
+
+        resp = self._post({'secret_refs': self.secret_refs})
+
+        self.assertEqual(200, resp.status_int)
+        items = resp.namespace['secrets']
+        self.assertEqual('name1', items[0]['name'])
+        self.assertEqual({'secret_ref': self.secret_refs[1],
+                          'error': {'code': 404, 'message': mock.ANY}},
+                         items[1])
+
+    @mock.patch('barbican.plugin.resources.get_secrets')
+    def test_should_get_secrets_payloads(self, mock_get_secrets):
+        plain_dto = mock.MagicMock(secret=b'plain text',
+                                   content_type='text/plain')
+        binary_dto = mock.MagicMock(secret=b'\x00\x01',
+                                    content_type='application/octet-stream')
+        mock_get_secrets.return_value = [
+            (self.secrets[0], plain_dto, {}, None),
+            (self.secrets[1], binary_dto, {}, None)]
+
+        resp = self._post({'secret_refs': self.secret_refs,
+                           'include_payload': True})
+
+        self.assertEqual(200, resp.status_int)
+        self.secret_repo.get_by_ids.assert_called_once_with(
+            self.keystone_id, ['id1', 'id2'], load_payloads=True)
+        mock_get_secrets.assert_called_once_with(self.secrets, self.tenant)
+        plain, binary = resp.namespace['secrets']
+        self.assertEqual('plain text', plain['payload'])
+        self.assertEqual('text/plain', plain['payload_content_type'])
+        self.assertNotIn('payload_content_encoding', plain)
+        self.assertEqual(base64.b64encode(b'\x00\x01'), binary['payload'])
+        self.assertEqual('application/octet-stream',
+                         binary['payload_content_type'])
+        self.assertEqual('base64', binary['payload_content_encoding'])
+
+    @mock.patch('barbican.plugin.resources.get_secrets')
+    def test_should_report_retrieval_error_without_failing_batch(
+            self, mock_get_secrets):
+        dto = mock.MagicMock(secret=b'plain text', content_type='text/plain')
+        mock_get_secrets.return_value = [
+            (self.secrets[0], None, {},
+             secret_store.SecretStorePluginNotFound()),
+            (self.secrets[1], dto, {}, None)]
+
+        resp = self._post({'secret_refs': self.secret_refs,
+                           'include_payload': True})
+
+        self.assertEqual(200, resp.status_int)
+        failed, retrieved = resp.namespace['secrets']
+        self.assertEqual(self.secret_refs[0], failed['secret_ref'])
+        self.assertEqual(400, failed['error']['code'])
+        self.assertEqual('plain text', retrieved['payload'])
+
+    def test_should_enforce_decrypt_policy_for_payloads(self):
+        ctx = self.app.extra_environ['barbican.context']
+        ctx.policy_enforcer = mock.MagicMock()
+
+        def enforce(action_name, target, credentials, do_raise):
+            if action_name == 'secret:decrypt':
+                raise policy.PolicyNotAuthorized(action_name)
+        ctx.policy_enforcer.enforce.side_effect = enforce
+
+        resp = self._post({'secret_refs': self.secret_refs,
+                           'include_payload': True}, expect_errors=True)
+
+        self.assertEqual(403, resp.status_int)
+        self.assertFalse(self.secret_repo.get_by_ids.called)
+
+    def test_should_accept_secret_ids_as_refs(self):
+        resp = self._post({'secret_refs': ['id1', 'id2/']})
+
+        self.assertEqual(200, resp.status_int)
+        self.secret_repo.get_by_ids.assert_called_once_with(
+            self.keystone_id, ['id1', 'id2'], load_payloads=False)
+
+    def test_should_reject_too_many_refs(self):
+        validators.CONF.set_override('max_allowed_secrets_per_batch', 1)
+        self.addCleanup(validators.CONF.clear_override,
+                        'max_allowed_secrets_per_batch')
+
+        resp = self._post({'secret_refs': self.secret_refs},
+                          expect_errors=True)
+
+        self.assertEqual(400, resp.status_int)
+        self.assertFalse(self.secret_repo.get_by_ids.called)
+
+    def test_should_reject_empty_refs(self):
+        resp = self._post({'secret_refs': []}, expect_errors=True)
+
+        self.assertEqual(400, resp.status_int)
+
+    def test_should_not_allow_get(self):
+        resp = self.app.get('/secrets/batch-get/', expect_errors=True)
+
+        self.assertEqual(405, resp.status_int)
+
+
+class WhenBulkCreatingSecretsUsingSecretsResource(FunctionalTest):
+    def setUp(self):
+        super(
+            WhenBulkCreatingSecretsUsingSecretsResource, self
+        ).setUp()
+        self.app = webtest.TestApp(app.PecanAPI(self.root))
+        self.app.extra_environ = get_barbican_env(self.keystone_id)
+        validators.CONF.set_override('max_allowed_secrets_per_batch', 2)
+        self.addCleanup(validators.CONF.clear_override,
+                        'max_allowed_secrets_per_batch')
+
+    @property
+    def root(self):
+        self._init()
+
+        class RootController(object):
+            secrets = controllers.secrets.SecretsController(
+                self.tenant_repo, mock.MagicMock(), mock.MagicMock(),
+                mock.MagicMock(), mock.MagicMock(), mock.MagicMock(),
+                mock.MagicMock()
+            )
+
+        return RootController()
+
+    def _init(self):
+        self.keystone_id = 'keystone1234'
+
+        self.tenant = models.Tenant()
+        self.tenant.id = 'tenantid1234'
+        self.tenant.keystone_id = self.keystone_id
+        self.tenant_repo = mock.MagicMock()
+        self.tenant_repo.find_by_keystone_id.return_value = self.tenant
+
+        self.secrets = [
+            {'name': 'name1', 'payload': 'secret one',
+             'payload_content_type': 'text/plain'},
+            {'name': 'name2', 'payload': base64.b64encode(b'\x00\x01'),
+             'payload_content_type': 'application/octet-stream',
+             'payload_content_encoding': 'base64'}
+        ]
+
+    def _post(self, body, **kwargs):
+        return self.app.post_json('/secrets/batch-create/', body, **kwargs)
+
+    @mock.patch('barbican.plugin.resources.store_secrets')
+    def test_should_create_secrets(self, mock_store_secrets):
+        transport_key = models.TransportKey('plugin', 'transport key')
+        transport_key.id = 'tkey1'
+        mock_store_secrets.return_value = [
+            (create_secret(id_ref='id1'), None),
+            (create_secret(id_ref='id2'), transport_key)]
+
+        resp = self._post({'secrets': self.secrets})
+
+        self.assertEqual(201, resp.status_int)
+        specs, tenant, repos = mock_store_secrets.call_args[0]
+        self.assertEqual(['name1', 'name2'], [spec['name'] for spec in specs])
+        self.assertIs(self.tenant, tenant)
+        self.assertEqual(
+            [{'secret_ref': hrefs.convert_secret_to_href('id1')},
+             {'secret_ref': hrefs.convert_secret_to_href('id2'),
+              'transport_key_ref':
+              hrefs.convert_transport_key_to_href('tkey1')}],
+            resp.namespace['secrets'])
+
+    @mock.patch('barbican.plugin.resources.store_secrets')
+    def test_should_reject_batch_with_invalid_secret(
+            self, mock_store_secrets):
+        self.secrets[1]['payload'] = ''
+
+        resp = self._post({'secrets': self.secrets}, expect_errors=True)
+
+        self.assertEqual(400, resp.status_int)
+        self.assertFalse(mock_store_secrets.called)
+
+    @mock.patch('barbican.plugin.resources.store_secrets')
+    def test_should_reject_too_many_secrets(self, mock_store_secrets):
+        resp = self._post({'secrets': self.secrets * 2}, expect_errors=True)
+
+        self.assertEqual(400, resp.status_int)
+        self.assertFalse(mock_store_secrets.called)
+
+    @mock.patch('barbican.plugin.resources.store_secrets')
+    def test_should_fail_whole_batch_on_store_error(
+            self, mock_store_secrets):
+        mock_store_secrets.side_effect = (
+            secret_store.SecretStorePluginNotFound())
+
+        resp = self._post({'secrets': self.secrets}, expect_errors=True)
+
+        self.assertEqual(400, resp.status_int)
+
+    def test_should_not_allow_get(self):
+        resp = self.app.get('/secrets/batch-create/', expect_errors=True)
+
+        self.assertEqual(405, resp.status_int)
+
+
 class WhenCreatingOrdersUsingOrdersResource(FunctionalTest):
     def setUp(self):
         super(
@@ -1606,7 +1976,8 @@ class WhenGettingOrdersListUsingOrdersResource(FunctionalTest):
             self.keystone_id,
             offset_arg=u'{0}'.format(self.offset),
             limit_arg=u'{0}'.format(self.limit),
-            suppress_exception=True
+            suppress_exception=True,
+            marker_arg=None
         )
 
         self.assertTrue('previous' in resp.namespace)
@@ -1639,7 +2010,8 @@ class WhenGettingOrdersListUsingOrdersResource(FunctionalTest):
             self.keystone_id,
             offset_arg=u'{0}'.format(self.offset),
             limit_arg=u'{0}'.format(self.limit),
-            suppress_exception=True
+            suppress_exception=True,
+            marker_arg=None
         )
 
         self.assertFalse('previous' in resp.namespace)
@@ -2023,6 +2395,7 @@ class WhenCreatingContainersUsingContainersResource(FunctionalTest):
 
         self.secret_repo = mock.MagicMock()
         self.secret_repo.create_from.return_value = None
+        self.secret_repo.get_missing_ids.return_value = set()
 
         self.consumer_repo = mock.MagicMock()
         self.consumer_repo.create_from.return_value = None
@@ -2060,14 +2433,26 @@ class WhenCreatingContainersUsingContainersResource(FunctionalTest):
         )
         self.assertEqual(resp.status_int, 415)
 
+    def test_should_validate_secret_refs_with_one_lookup(self):
+        self.app.post_json('/containers/', self.container_req)
+
+        self.secret_repo.get_missing_ids.assert_called_once_with(
+            self.tenant_keystone_id, mock.ANY)
+        args, kwargs = self.secret_repo.get_missing_ids.call_args
+        self.assertEqual(['1231', '1232', '1233'], sorted(args[1]))
+        self.assertFalse(self.secret_repo.get.called)
+
     def test_should_throw_exception_when_secret_ref_doesnt_exist(self):
-        self.secret_repo.get.return_value = None
+        self.secret_repo.get_missing_ids.return_value = set(['1231', '1233'])
         resp = self.app.post_json(
             '/containers/',
             self.container_req,
             expect_errors=True
         )
         self.assertEqual(resp.status_int, 404)
+        self.assertIn("'test secret 1', 'test secret 3'", resp.body)
+        self.assertNotIn('test secret 2', resp.body)
+        self.assertFalse(self.container_repo.create_from.called)
 
 
 class WhenGettingOrDeletingContainerUsingContainerResource(FunctionalTest):
@@ -2121,6 +2506,23 @@ class WhenGettingOrDeletingContainerUsingContainerResource(FunctionalTest):
             keystone_id=self.tenant_keystone_id,
             suppress_exception=True)
 
+    def test_should_get_container_with_active_consumers(self):
+        self.container.active_consumers = [
+            create_consumer(self.container.id, 'id1')]
+
+        resp = self.app.get('/containers/{0}/'.format(self.container.id))
+
+        self.assertEqual([{'name': 'test name', 'URL': 'http://test/url'}],
+                         resp.namespace['consumers'])
+
+    def test_should_get_container_without_consumers(self):
+        resp = self.app.get('/containers/{0}/'.format(self.container.id),
+                            {'include_consumers': 'false'})
+
+        self.assertEqual(200, resp.status_int)
+        self.assertNotIn('consumers', resp.namespace)
+        self.assertIn('secret_refs', resp.namespace)
+
     def test_should_delete_container(self):
         self.app.delete('/containers/{0}/'.format(
             self.container.id
@@ -2315,7 +2717,8 @@ class WhenGettingOrDeletingConsumersUsingConsumerResource(FunctionalTest):
             self.container.id,
             limit_arg=None,
             offset_arg=0,
-            suppress_exception=True
+            suppress_exception=True,
+            marker_arg=None
         )
 
         self.assertEqual(self.consumer.name, resp.json['consumers'][0]['name'])
@@ -2443,7 +2846,9 @@ class WhenGettingContainersListUsingResource(FunctionalTest):
             self.keystone_id,
             offset_arg=u'{0}'.format(self.offset),
             limit_arg=u'{0}'.format(self.limit),
-            suppress_exception=True
+            suppress_exception=True,
+            marker_arg=None,
+            include_consumers=True
         )
 
         self.assertTrue('previous' in resp.namespace)
@@ -2482,12 +2887,28 @@ class WhenGettingContainersListUsingResource(FunctionalTest):
             self.keystone_id,
             offset_arg=u'{0}'.format(self.offset),
             limit_arg=u'{0}'.format(self.limit),
-            suppress_exception=True
+            suppress_exception=True,
+            marker_arg=None,
+            include_consumers=True
         )
 
         self.assertFalse('previous' in resp.namespace)
         self.assertFalse('next' in resp.namespace)
 
+    def test_should_list_containers_without_consumers(self):
+        self.params['include_consumers'] = 'false'
+
+        resp = self.app.get(
+            '/containers/',
+            self.params
+        )
+
+        args, kwargs = self.container_repo.get_by_create_date.call_args
+        self.assertFalse(kwargs['include_consumers'])
+        for container in resp.namespace['containers']:
+            self.assertNotIn('consumers', container)
+            self.assertIn('secret_refs', container)
+
     def _create_url(self, keystone_id, offset_arg=None, limit_arg=None):
         if limit_arg:
             offset = int(offset_arg)
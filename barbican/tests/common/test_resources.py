@@ -0,0 +1,105 @@
+# Copyright (c) 2014 Rackspace, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import mock
+
+from barbican.common import resources
+from barbican.model import models
+from barbican.tests import utils
+
+
+class WhenGettingOrCreatingTenants(utils.BaseTestCase):
+
+    def setUp(self):
+        super(WhenGettingOrCreatingTenants, self).setUp()
+        self.CONF = resources.CONF
+        self.addCleanup(self.CONF.clear_override, 'tenant_cache_size')
+        self.addCleanup(self.CONF.clear_override, 'tenant_cache_ttl_seconds')
+        self.addCleanup(resources.get_tenant_cache().clear)
+
+        self.tenant = models.Tenant()
+        self.tenant.id = 'tenant-id'
+        self.tenant.keystone_id = self.keystone_id
+        self.tenant_repo = mock.MagicMock()
+        self.tenant_repo.find_by_keystone_id.return_value = self.tenant
+
+    def test_should_cache_found_tenant(self):
+        tenant = resources.get_or_create_tenant(self.keystone_id,
+                                                self.tenant_repo)
+        self.assertIs(self.tenant, tenant)
+
+        cached = resources.get_or_create_tenant(self.keystone_id,
+                                                self.tenant_repo)
+        self.assertEqual('tenant-id', cached.id)
+        self.assertEqual(self.keystone_id, cached.keystone_id)
+        self.assertEqual(1, self.tenant_repo.find_by_keystone_id.call_count)
+
+        stats = resources.get_tenant_cache().get_stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(1, stats['size'])
+
+    def test_should_not_cache_created_tenant(self):
+        self.tenant_repo.find_by_keystone_id.return_value = None
+
+        tenant = resources.get_or_create_tenant(self.keystone_id,
+                                                self.tenant_repo)
+        self.assertEqual(self.keystone_id, tenant.keystone_id)
+        self.tenant_repo.create_from.assert_called_once_with(tenant)
+
+        self.assertIsNone(resources.get_tenant_cache().get(self.keystone_id))
+
+    def test_should_not_cache_if_disabled(self):
+        self.CONF.set_override('tenant_cache_size', 0)
+
+        resources.get_or_create_tenant(self.keystone_id, self.tenant_repo)
+        resources.get_or_create_tenant(self.keystone_id, self.tenant_repo)
+
+        self.assertEqual(2, self.tenant_repo.find_by_keystone_id.call_count)
+
+    @mock.patch('time.time')
+    def test_should_expire_cached_tenant(self, mock_time):
+        self.CONF.set_override('tenant_cache_ttl_seconds', 60)
+        cache = resources.get_tenant_cache()
+        mock_time.return_value = 1000.0
+        cache.put(self.tenant)
+
+        mock_time.return_value = 1059.0
+        self.assertIsNotNone(cache.get(self.keystone_id))
+        mock_time.return_value = 1060.0
+        self.assertIsNone(cache.get(self.keystone_id))
+        self.assertEqual(1, cache.get_stats()['expirations'])
+
+    def test_should_evict_least_recently_used_tenant(self):
+        self.CONF.set_override('tenant_cache_size', 2)
+        cache = resources.get_tenant_cache()
+        for keystone_id in ('a', 'b'):
+            cache.put(models.Tenant(keystone_id=keystone_id))
+
+        cache.get('a')
+        cache.put(models.Tenant(keystone_id='c'))
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertEqual(1, cache.get_stats()['evictions'])
+
+    def test_should_invalidate_cached_tenant(self):
+        cache = resources.get_tenant_cache()
+        cache.put(self.tenant)
+
+        cache.invalidate(self.keystone_id)
+
+        self.assertIsNone(cache.get(self.keystone_id))
+        self.assertEqual(1, cache.get_stats()['invalidations'])
@@ -133,3 +133,61 @@ class WhenTestingGenerateFullClassnameForInstance(test_utils.BaseTestCase):
     def test_returns_qualified_name(self):
         name = utils.generate_fullname_for(self.instance)
         self.assertEqual('mock.Mock', name)
+
+
+class WhenTestingExpiringLRUCache(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(WhenTestingExpiringLRUCache, self).setUp()
+        self.size = 2
+        self.evicted = []
+        self.cache = utils.ExpiringLRUCache(lambda: self.size, lambda: 60,
+                                            on_evict=self.evicted.append)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        self.cache.get('a')
+        self.cache.put('c', 3)
+
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(1, self.cache.get('a'))
+        self.assertEqual([2], self.evicted)
+        self.assertEqual(1, self.cache.get_stats()['evictions'])
+
+    @mock.patch('time.time')
+    def test_expired_value_is_dropped(self, mock_time):
+        mock_time.return_value = 1000.0
+        self.cache.put('a', 1)
+
+        mock_time.return_value = 1060.0
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual([1], self.evicted)
+        self.assertEqual(1, self.cache.get_stats()['expirations'])
+
+    def test_disabled_cache_drops_values_right_away(self):
+        self.size = 0
+        self.cache.put('a', 1)
+
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual([1], self.evicted)
+
+    def test_invalidate_matching(self):
+        self.cache.put(('p1', 'x'), 1)
+        self.cache.put(('p2', 'x'), 2)
+
+        self.cache.invalidate_matching(lambda key, value: key[0] == 'p1')
+
+        self.assertIsNone(self.cache.get(('p1', 'x')))
+        self.assertEqual(2, self.cache.get(('p2', 'x')))
+        self.assertEqual([1], self.evicted)
+        self.assertEqual(1, self.cache.get_stats()['invalidations'])
+
+    def test_clear_drops_all_values(self):
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+
+        self.cache.clear()
+
+        self.assertEqual([1, 2], sorted(self.evicted))
+        self.assertEqual({'size': 0}, self.cache.get_stats())
@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import os
 
 from Crypto.PublicKey import DSA
@@ -68,6 +69,33 @@ class TestCryptoPlugin(plugin.CryptoPluginBase):
             return False
 
 
+class WhenTestingCryptoPluginBase(utils.BaseTestCase):
+
+    def setUp(self):
+        super(WhenTestingCryptoPluginBase, self).setUp()
+        self.plugin = TestCryptoPlugin()
+
+    def test_encrypt_batch_falls_back_to_encrypt(self):
+        response_dtos = self.plugin.encrypt_batch(
+            [plugin.EncryptDTO('one'), plugin.EncryptDTO('two')],
+            mock.MagicMock(), mock.MagicMock())
+
+        self.assertEqual([b'cypher_text'] * 2,
+                         [response_dto.cypher_text
+                          for response_dto in response_dtos])
+
+    def test_decrypt_batch_falls_back_to_decrypt(self):
+        with mock.patch.object(self.plugin, 'decrypt',
+                               return_value='secret') as mock_decrypt:
+            secrets = self.plugin.decrypt_batch(['dto1', 'dto2'], 'kek_meta',
+                                                ['ext1', 'ext2'], 'project')
+
+        self.assertEqual(['secret', 'secret'], secrets)
+        self.assertEqual([mock.call('dto1', 'kek_meta', 'ext1', 'project'),
+                          mock.call('dto2', 'kek_meta', 'ext2', 'project')],
+                         mock_decrypt.call_args_list)
+
+
 class WhenTestingSimpleCryptoPlugin(utils.BaseTestCase):
 
     def setUp(self):
@@ -123,6 +151,78 @@ class WhenTestingSimpleCryptoPlugin(utils.BaseTestCase):
         decrypted = tenant_encryptor.decrypt(response_dto.cypher_text)
         self.assertEqual(unencrypted, decrypted)
 
+    def test_kek_unwrapped_once_for_repeated_use(self):
+        kek_meta_dto = self._get_mocked_kek_meta_dto()
+        master_cipher = self.plugin._master_cipher
+
+        with mock.patch.object(master_cipher, 'decrypt',
+                               wraps=master_cipher.decrypt) as mock_decrypt:
+            response_dto = self.plugin.encrypt(plugin.EncryptDTO('secret'),
+                                               kek_meta_dto,
+                                               mock.MagicMock())
+            decrypted = self.plugin.decrypt(
+                plugin.DecryptDTO(response_dto.cypher_text), kek_meta_dto,
+                None, mock.MagicMock())
+
+        self.assertEqual('secret', decrypted)
+        self.assertEqual(1, mock_decrypt.call_count)
+
+    def test_kek_unwrapped_each_time_if_cache_disabled(self):
+        self.addCleanup(simple.CONF.clear_override, 'kek_cache_size',
+                        group='simple_crypto_plugin')
+        simple.CONF.set_override('kek_cache_size', 0,
+                                 group='simple_crypto_plugin')
+        kek_meta_dto = self._get_mocked_kek_meta_dto()
+        master_cipher = self.plugin._master_cipher
+
+        with mock.patch.object(master_cipher, 'decrypt',
+                               wraps=master_cipher.decrypt) as mock_decrypt:
+            for _ in range(2):
+                self.plugin.encrypt(plugin.EncryptDTO('secret'),
+                                    kek_meta_dto, mock.MagicMock())
+
+        self.assertEqual(2, mock_decrypt.call_count)
+
+    def test_batch_unwraps_kek_once(self):
+        simple.CONF.set_override('kek_cache_size', 0,
+                                 group='simple_crypto_plugin')
+        self.addCleanup(simple.CONF.clear_override, 'kek_cache_size',
+                        group='simple_crypto_plugin')
+        kek_meta_dto = self._get_mocked_kek_meta_dto()
+        master_cipher = self.plugin._master_cipher
+
+        with mock.patch.object(master_cipher, 'decrypt',
+                               wraps=master_cipher.decrypt) as mock_decrypt:
+            response_dtos = self.plugin.encrypt_batch(
+                [plugin.EncryptDTO('one'), plugin.EncryptDTO('two')],
+                kek_meta_dto, mock.MagicMock())
+            self.assertEqual(1, mock_decrypt.call_count)
+
+            decrypted = self.plugin.decrypt_batch(
+                [plugin.DecryptDTO(response_dto.cypher_text)
+                 for response_dto in response_dtos],
+                kek_meta_dto, [None, None], mock.MagicMock())
+            self.assertEqual(2, mock_decrypt.call_count)
+
+        self.assertEqual(['one', 'two'], decrypted)
+
+    @mock.patch('time.time')
+    def test_cached_kek_expires(self, mock_time):
+        self.addCleanup(simple.CONF.clear_override, 'kek_cache_ttl_seconds',
+                        group='simple_crypto_plugin')
+        simple.CONF.set_override('kek_cache_ttl_seconds', 60,
+                                 group='simple_crypto_plugin')
+        kek_meta_dto = self._get_mocked_kek_meta_dto()
+        key = hashlib.sha256(kek_meta_dto.plugin_meta).digest()
+        mock_time.return_value = 1000.0
+        self.plugin.encrypt(plugin.EncryptDTO('secret'), kek_meta_dto,
+                            mock.MagicMock())
+
+        mock_time.return_value = 1059.0
+        self.assertIsNotNone(self.plugin._kek_ciphers.get(key))
+        mock_time.return_value = 1060.0
+        self.assertIsNone(self.plugin._kek_ciphers.get(key))
+
     def test_decrypt_kek_not_created(self):
         kek_meta_dto = mock.MagicMock()
         kek_meta_dto.plugin_meta = None
@@ -13,6 +13,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
+import threading
+import time
+
 import mock
 
 from barbican.model import models
@@ -21,6 +25,12 @@ from barbican.plugin.crypto import p11_crypto
 from barbican.tests import utils
 
 
+class FakePyKCS11Error(Exception):
+    def __init__(self, value):
+        super(FakePyKCS11Error, self).__init__(value)
+        self.value = value
+
+
 class WhenTestingP11CryptoPlugin(utils.BaseTestCase):
 
     def setUp(self):
@@ -36,15 +46,22 @@ class WhenTestingP11CryptoPlugin(utils.BaseTestCase):
         self.pkcs11.lib.C_Initialize.return_value = self.p11_mock.CKR_OK
         self.pkcs11.lib.C_GenerateKey.return_value = self.p11_mock.CKR_OK
         self.cfg_mock = mock.MagicMock(name='config mock')
+        self.cfg_mock.p11_crypto_plugin.session_pool_size = 2
+        self.cfg_mock.p11_crypto_plugin.session_pool_timeout = 1
+        self.cfg_mock.p11_crypto_plugin.session_check_interval = 60
+        self.cfg_mock.p11_crypto_plugin.kek_cache_size = 2
+        self.cfg_mock.p11_crypto_plugin.kek_cache_ttl_seconds = 300
+        self.cfg_mock.p11_crypto_plugin.strict_random = True
         self.plugin = p11_crypto.P11CryptoPlugin(self.cfg_mock)
         self.session = self.pkcs11.openSession()
+        self.kek_meta_dto = mock.MagicMock(plugin_meta='{"wrapped_key": 1}')
 
     def tearDown(self):
         super(WhenTestingP11CryptoPlugin, self).tearDown()
         self.patcher.stop()
 
     def test_generate_calls_generate_random(self):
-        with mock.patch.object(self.plugin, 'encrypt') as encrypt_mock:
+        with mock.patch.object(self.plugin, '_encrypt') as encrypt_mock:
             # patch out the encrypt call since it is irrelevant in this test
             encrypt_mock.return_value = None
             self.session.generateRandom.return_value = [1, 2, 3, 4, 5, 6, 7,
@@ -107,34 +124,75 @@ class WhenTestingP11CryptoPlugin(utils.BaseTestCase):
         self.assertRaises(
             p11_crypto.P11CryptoPluginKeyException,
             self.plugin._get_key_handle,
+            self.session,
             'mylabel',
         )
 
     def test_get_key_handle_with_one_key(self):
         key = 'key1'
         self.session.findObjects.return_value = [key]
-        key_label = self.plugin._get_key_handle('mylabel')
+        key_label = self.plugin._get_key_handle(self.session, 'mylabel')
         self.assertEqual(key, key_label)
 
+    def test_get_key_handle_caches_found_key(self):
+        self.session.findObjects.return_value = ['key1']
+        self.session.findObjects.reset_mock()
+
+        self.plugin._get_key_handle(self.session, 'mylabel')
+        key = self.plugin._get_key_handle(self.session, 'mylabel')
+
+        self.assertEqual('key1', key)
+        self.assertEqual(1, self.session.findObjects.call_count)
+        self.assertEqual('key1', self.plugin.get_key_handles()['mylabel'])
+
+    def test_refresh_key_handles_resolves_current_keys_again(self):
+        self.plugin.key_handles['old_label'] = 'old_key'
+        self.session.findObjects.return_value = ['new_key']
+
+        self.plugin.refresh_key_handles()
+
+        self.assertEqual(
+            {self.plugin.current_mkek_label: 'new_key',
+             self.plugin.current_hmac_label: 'new_key'},
+            self.plugin.get_key_handles())
+
+    def test_refresh_key_handles_fails_if_key_missing(self):
+        self.session.findObjects.return_value = []
+
+        self.assertRaises(p11_crypto.P11CryptoPluginException,
+                          self.plugin.refresh_key_handles)
+
     def test_get_key_handle_with_no_keys(self):
         self.session.findObjects.return_value = []
-        result = self.plugin._get_key_handle('mylabel')
+        result = self.plugin._get_key_handle(self.session, 'mylabel')
         self.assertIsNone(result)
 
     def test_generate_iv_calls_generate_random(self):
         self.session.generateRandom.return_value = [1, 2, 3, 4, 5, 6, 7,
                                                     8, 9, 10, 11, 12, 13,
                                                     14, 15, 16]
-        iv = self.plugin._generate_iv()
+        iv = self.plugin._generate_iv(self.session)
         self.assertEqual(len(iv), self.plugin.block_size)
         self.session.generateRandom.assert_called_once_with(
             self.plugin.block_size)
 
+    def test_generate_iv_uses_random_pool_unless_strict(self):
+        self.plugin.random_pool = mock.MagicMock()
+        self.plugin.random_pool.get.return_value = range(16)
+
+        iv = self.plugin._generate_iv(self.session)
+
+        self.assertEqual(self.plugin.block_size, len(iv))
+        self.plugin.random_pool.get.assert_called_once_with(
+            self.session, self.plugin.block_size)
+        self.assertFalse(self.session.generateRandom.called)
+
     def test_generate_iv_with_invalid_response_size(self):
         self.session.generateRandom.return_value = [1, 2, 3, 4, 5, 6, 7]
         self.assertRaises(
             p11_crypto.P11CryptoPluginException,
             self.plugin._generate_iv,
+            self.session,
         )
 
     def test_build_gcm_params(self):
@@ -165,7 +223,7 @@ class WhenTestingP11CryptoPlugin(utils.BaseTestCase):
         with mock.patch.object(self.plugin, '_unwrap_key') as unwrap_key_mock:
             unwrap_key_mock.return_value = 'unwrapped_key'
             response_dto = self.plugin.encrypt(encrypt_dto,
-                                               mock.MagicMock(),
+                                               self.kek_meta_dto,
                                                mock.MagicMock())
 
             self.session.encrypt.assert_called_once_with('unwrapped_key',
@@ -185,7 +243,7 @@ class WhenTestingP11CryptoPlugin(utils.BaseTestCase):
         with mock.patch.object(self.plugin, '_unwrap_key') as unwrap_key_mock:
             unwrap_key_mock.return_value = 'unwrapped_key'
             payload = self.plugin.decrypt(decrypt_dto,
-                                          mock.MagicMock(),
+                                          self.kek_meta_dto,
                                           kek_meta_extended,
                                           mock.MagicMock())
             self.assertTrue(self.p11_mock.Mechanism.called)
@@ -194,6 +252,163 @@ class WhenTestingP11CryptoPlugin(utils.BaseTestCase):
                                                          mech)
             self.assertEqual(b'defg', payload)
 
+    def test_encrypt_batch_unwraps_kek_once(self):
+        self.session.generateRandom.return_value = list(range(16))
+        self.session.encrypt.side_effect = [[1], [2]]
+        encrypt_dtos = [plugin_import.EncryptDTO('one'),
+                        plugin_import.EncryptDTO('two')]
+        with mock.patch.object(self.plugin, '_unwrap_key') as unwrap_key_mock:
+            unwrap_key_mock.return_value = 'unwrapped_key'
+            response_dtos = self.plugin.encrypt_batch(
+                encrypt_dtos, self.kek_meta_dto, mock.MagicMock())
+
+            self.assertEqual(1, unwrap_key_mock.call_count)
+        self.assertEqual([b'\x01', b'\x02'],
+                         [response_dto.cypher_text
+                          for response_dto in response_dtos])
+        self.assertEqual(2, self.session.generateRandom.call_count)
+
+    def test_decrypt_batch_unwraps_kek_once(self):
+        self.session.decrypt.side_effect = [[100], [101]]
+        kek_meta_extended = '{"iv": "AQIDBAUGBwgJCgsMDQ4PEA=="}'
+        decrypt_dtos = [plugin_import.DecryptDTO('ct1'),
+                        plugin_import.DecryptDTO('ct2')]
+        with mock.patch.object(self.plugin, '_unwrap_key') as unwrap_key_mock:
+            unwrap_key_mock.return_value = 'unwrapped_key'
+            secrets = self.plugin.decrypt_batch(
+                decrypt_dtos, self.kek_meta_dto, [kek_meta_extended] * 2,
+                mock.MagicMock())
+
+            self.assertEqual(1, unwrap_key_mock.call_count)
+        self.assertEqual([b'd', b'e'], secrets)
+
+    def test_key_handles_resolved_again_after_handle_error(self):
+        self.p11_mock.PyKCS11Error = FakePyKCS11Error
+        self.p11_mock.CKR_KEY_HANDLE_INVALID = 0x60
+        self.session.findObjects.return_value = ['new_key']
+        operation = mock.MagicMock(side_effect=[FakePyKCS11Error(0x60),
+                                                'result'])
+
+        self.assertEqual('result', self.plugin._run(operation, 'arg'))
+
+        self.assertEqual(2, operation.call_count)
+        self.assertEqual('new_key', self.plugin.get_key_handles()[
+            self.plugin.current_mkek_label])
+
+    def test_key_handles_not_resolved_again_if_already_refreshed(self):
+        self.p11_mock.PyKCS11Error = FakePyKCS11Error
+        self.p11_mock.CKR_KEY_HANDLE_INVALID = 0x60
+        self.session.findObjects.return_value = ['new_key']
+        self.session.findObjects.reset_mock()
+
+        def operation(session):
+            if operation.calls == 0:
+                # Another thread refreshes the handles after this call
+                # failed with the old ones.
+                self.plugin.refresh_key_handles()
+            operation.calls += 1
+            if operation.calls == 1:
+                raise FakePyKCS11Error(0x60)
+            return 'result'
+        operation.calls = 0
+
+        self.assertEqual('result', self.plugin._run(operation))
+
+        # Only the refresh of the other thread looked up the two keys.
+        self.assertEqual(2, self.session.findObjects.call_count)
+
+    def test_unwrapped_kek_is_reused(self):
+        with mock.patch.object(self.plugin, '_unwrap_key') as unwrap_key_mock:
+            unwrap_key_mock.return_value = 'unwrapped_key'
+            for _ in range(2):
+                self.plugin.decrypt(plugin_import.DecryptDTO('ct'),
+                                    self.kek_meta_dto,
+                                    '{"iv": "AQIDBAUGBwgJCgsMDQ4PEA=="}',
+                                    mock.MagicMock())
+
+        unwrap_key_mock.assert_called_once_with(
+            self.session, self.kek_meta_dto.plugin_meta)
+        self.assertEqual(
+            [mock.call('unwrapped_key', 'ct', mock.ANY)] * 2,
+            self.session.decrypt.call_args_list)
+        self.assertFalse(self.session.destroyObject.called)
+
+    def test_evicted_kek_is_destroyed(self):
+        self.session.generateRandom.return_value = range(16)
+        with mock.patch.object(self.plugin, '_unwrap_key') as unwrap_key_mock:
+            unwrap_key_mock.side_effect = ['key1', 'key2', 'key3']
+            for plugin_meta in ('meta1', 'meta2', 'meta3'):
+                self.plugin.encrypt(plugin_import.EncryptDTO('secret'),
+                                    mock.MagicMock(plugin_meta=plugin_meta),
+                                    mock.MagicMock())
+
+        self.session.destroyObject.assert_called_once_with('key1')
+
+    def test_kek_not_cached_if_cache_disabled(self):
+        self.plugin.key_cache.size = 0
+        with mock.patch.object(self.plugin, '_unwrap_key') as unwrap_key_mock:
+            unwrap_key_mock.return_value = 'unwrapped_key'
+            self.plugin.decrypt(plugin_import.DecryptDTO('ct'),
+                                self.kek_meta_dto,
+                                '{"iv": "AQIDBAUGBwgJCgsMDQ4PEA=="}',
+                                mock.MagicMock())
+
+        self.session.destroyObject.assert_called_once_with('unwrapped_key')
+
+    def test_kek_lost_with_its_session_is_unwrapped_again(self):
+        self.p11_mock.PyKCS11Error = FakePyKCS11Error
+        self.p11_mock.CKR_KEY_HANDLE_INVALID = 0x60
+        self.session.generateRandom.return_value = range(16)
+        results = [FakePyKCS11Error(0x60), [1]]
+
+        def encrypt(key, unencrypted, mech):
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                # The session that unwrapped the key closes while it is in
+                # use.
+                self.plugin.key_cache.forget_session(self.session)
+                raise result
+            return result
+
+        self.session.encrypt.side_effect = encrypt
+        self.session.findObjects.reset_mock()
+        with mock.patch.object(self.plugin, '_unwrap_key') as unwrap_key_mock:
+            unwrap_key_mock.side_effect = ['key1', 'key2']
+            response_dto = self.plugin.encrypt(
+                plugin_import.EncryptDTO('secret'), self.kek_meta_dto,
+                mock.MagicMock())
+
+        self.assertEqual(b'\x01', response_dto.cypher_text)
+        self.assertEqual(2, unwrap_key_mock.call_count)
+        self.assertFalse(self.session.findObjects.called)
+
+    def test_kek_lost_with_another_session_is_not_used(self):
+        self.session.generateRandom.return_value = range(16)
+        creating_session = mock.MagicMock()
+        digest = hashlib.sha256(self.kek_meta_dto.plugin_meta).digest()
+        self.plugin.key_cache.release(
+            self.plugin.key_cache.add(digest, 'key1', creating_session))
+        results = [[1], [2]]
+
+        def encrypt(key, unencrypted, mech):
+            # The session that unwrapped the key is discarded while another
+            # session uses it, and the HSM reuses its handle without error.
+            self.plugin.key_cache.forget_session(creating_session)
+            return results.pop(0)
+
+        self.session.encrypt.side_effect = encrypt
+        with mock.patch.object(self.plugin, '_unwrap_key') as unwrap_key_mock:
+            unwrap_key_mock.return_value = 'key2'
+            response_dto = self.plugin.encrypt(
+                plugin_import.EncryptDTO('secret'), self.kek_meta_dto,
+                mock.MagicMock())
+
+        self.assertEqual(b'\x02', response_dto.cypher_text)
+        self.assertEqual(1, unwrap_key_mock.call_count)
+        self.assertEqual(['key1', 'key2'],
+                         [call_args[0][0] for call_args in
+                          self.session.encrypt.call_args_list])
+
     def test_bind_kek_metadata_without_existing_key(self):
         self.session.findObjects.return_value = []  # no existing key
         self.pkcs11.lib.C_GenerateKey.return_value = self.p11_mock.CKR_OK
@@ -241,3 +456,252 @@ class WhenTestingP11CryptoPlugin(utils.BaseTestCase):
         self.assertFalse(
             self.plugin.supports("SOMETHING_RANDOM")
         )
+
+
+class WhenTestingP11SessionPool(utils.BaseTestCase):
+
+    def setUp(self):
+        super(WhenTestingP11SessionPool, self).setUp()
+
+        self.p11_mock = mock.MagicMock(CKR_OK=0, CKF_RW_SESSION='RW',
+                                       CKR_SESSION_HANDLE_INVALID=0xB3,
+                                       CKR_USER_ALREADY_LOGGED_IN=0x100,
+                                       PyKCS11Error=FakePyKCS11Error,
+                                       name='PyKCS11 mock')
+        patcher = mock.patch('barbican.plugin.crypto.p11_crypto.PyKCS11',
+                             new=self.p11_mock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.pkcs11 = mock.MagicMock()
+        self.pkcs11.openSession.side_effect = lambda *args: mock.MagicMock()
+        self.pool = p11_crypto.P11SessionPool(self.pkcs11, 1, 'pin', size=2,
+                                              timeout=0.01, check_interval=60)
+
+    def test_should_open_logged_in_sessions_on_demand(self):
+        session = self.pool.run(lambda session: session)
+
+        self.pkcs11.openSession.assert_called_once_with(1, 'RW')
+        session.login.assert_called_once_with('pin')
+        self.assertIs(session, self.pool.run(lambda session: session))
+        self.assertEqual(1, self.pkcs11.openSession.call_count)
+
+    def test_should_use_separate_sessions_for_concurrent_operations(self):
+        outer = []
+
+        def nested(session):
+            outer.append(session)
+            return self.pool.run(lambda inner: inner)
+
+        inner = self.pool.run(nested)
+
+        self.assertIsNot(outer[0], inner)
+        self.assertEqual(2, self.pkcs11.openSession.call_count)
+
+    def test_should_time_out_when_all_sessions_are_in_use(self):
+        def nested(session):
+            return self.pool.run(nested)
+
+        self.assertRaises(p11_crypto.P11SessionPoolTimeout,
+                          self.pool.run, nested)
+
+    def test_should_ignore_already_logged_in_error(self):
+        session = mock.MagicMock()
+        session.login.side_effect = FakePyKCS11Error(0x100)
+        self.pkcs11.openSession.side_effect = None
+        self.pkcs11.openSession.return_value = session
+
+        self.assertIs(session, self.pool.run(lambda session: session))
+
+    def test_should_retry_on_new_session_after_session_error(self):
+        sessions = []
+
+        def operation(session):
+            sessions.append(session)
+            if len(sessions) == 1:
+                raise FakePyKCS11Error(0xB3)
+            return 'result'
+
+        self.assertEqual('result', self.pool.run(operation))
+
+        self.assertIsNot(sessions[0], sessions[1])
+        sessions[0].closeSession.assert_called_once_with()
+        sessions[1].login.assert_called_once_with('pin')
+        self.assertIs(sessions[1], self.pool.run(lambda session: session))
+
+    def test_should_keep_session_after_other_errors(self):
+        first = self.pool.run(lambda session: session)
+
+        def operation(session):
+            raise FakePyKCS11Error(0x5)
+
+        self.assertRaises(FakePyKCS11Error, self.pool.run, operation)
+
+        self.assertFalse(first.closeSession.called)
+        self.assertIs(first, self.pool.run(lambda session: session))
+
+    def test_waiting_checkout_opens_session_freed_by_discard(self):
+        pool = p11_crypto.P11SessionPool(self.pkcs11, 1, 'pin', size=1,
+                                         timeout=5, check_interval=60)
+        failed = pool._checkout()
+        sessions = []
+        waiter = threading.Thread(
+            target=lambda: sessions.append(pool.run(lambda s: s)))
+        waiter.start()
+        # Let the waiter block on the only, checked out, session.
+        time.sleep(0.05)
+
+        started = time.time()
+        pool._discard(failed)
+        waiter.join(5)
+
+        self.assertLess(time.time() - started, 1)
+        self.assertEqual(1, len(sessions))
+        self.assertIsNot(failed, sessions[0])
+        self.assertEqual(2, self.pkcs11.openSession.call_count)
+
+    @mock.patch('time.time')
+    def test_should_replace_idle_session_failing_its_check(self, mock_time):
+        mock_time.return_value = 1000.0
+        first = self.pool.run(lambda session: session)
+        first.getSessionInfo.side_effect = FakePyKCS11Error(0xB3)
+
+        mock_time.return_value = 1060.0
+        second = self.pool.run(lambda session: session)
+
+        self.assertIsNot(first, second)
+        first.closeSession.assert_called_once_with()
+
+
+class WhenTestingP11KeyCache(utils.BaseTestCase):
+
+    def setUp(self):
+        super(WhenTestingP11KeyCache, self).setUp()
+        self.cache = p11_crypto.P11KeyCache(size=2, ttl_seconds=60)
+        self.session = mock.MagicMock()
+
+    def _add(self, digest, handle):
+        self.cache.release(self.cache.add(digest, handle, self.session))
+
+    def test_should_not_retire_evicted_key_still_in_use(self):
+        entry = self.cache.add('d1', 'key1', self.session)
+        self._add('d2', 'key2')
+        self._add('d3', 'key3')
+
+        self.assertEqual([], self.cache.pop_retired())
+        self.cache.release(entry)
+        self.assertEqual(['key1'], self.cache.pop_retired())
+
+    @mock.patch('time.time')
+    def test_should_retire_expired_key(self, mock_time):
+        mock_time.return_value = 1000.0
+        self._add('d1', 'key1')
+
+        mock_time.return_value = 1060.0
+        self.assertIsNone(self.cache.acquire('d1'))
+        self.assertEqual(['key1'], self.cache.pop_retired())
+
+    def test_should_forget_keys_of_closed_session(self):
+        self._add('d1', 'key1')
+        other_session = mock.MagicMock()
+        self.cache.release(self.cache.add('d2', 'key2', other_session))
+
+        self.cache.forget_session(self.session)
+
+        self.assertIsNone(self.cache.acquire('d1'))
+        self.assertIsNotNone(self.cache.acquire('d2'))
+        self.assertEqual([], self.cache.pop_retired())
+
+    def test_should_mark_keys_in_use_lost_with_their_session(self):
+        entry = self.cache.add('d1', 'key1', self.session)
+
+        self.cache.forget_session(self.session)
+        self.cache.release(entry)
+
+        self.assertTrue(entry.lost)
+        self.assertEqual([], self.cache.pop_retired())
+
+    def test_should_forget_keys_when_session_pool_discards_session(self):
+        pool = p11_crypto.P11SessionPool(
+            mock.MagicMock(), 1, 'pin', size=1, timeout=0.01,
+            check_interval=60, on_discard=self.cache.forget_session)
+        self._add('d1', 'key1')
+
+        pool._discard(self.session)
+
+        self.assertIsNone(self.cache.acquire('d1'))
+
+
+class WhenTestingP11RandomPool(utils.BaseTestCase):
+
+    def setUp(self):
+        super(WhenTestingP11RandomPool, self).setUp()
+        self.session = mock.MagicMock()
+        self.session.generateRandom.side_effect = lambda length: range(length)
+        self.session_pool = mock.MagicMock()
+        self.session_pool.run.side_effect = lambda fn: fn(self.session)
+
+        patcher = mock.patch.object(p11_crypto.P11RandomPool,
+                                    '_start_refill')
+        self.start_refill = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = p11_crypto.P11RandomPool(self.session_pool, size=64,
+                                             low_water=16)
+
+    def test_should_not_refill_before_first_use(self):
+        self.assertFalse(self.start_refill.called)
+        self.assertFalse(self.session_pool.run.called)
+
+    def test_should_refill_up_to_size(self):
+        self.pool._refill()
+
+        self.session.generateRandom.assert_called_once_with(64)
+        self.assertEqual(64, self.pool._available)
+        self.assertEqual(bytearray(range(64)), self.pool._buffer)
+
+    def test_should_hand_out_and_remove_buffered_bytes(self):
+        self.pool._refill()
+        self.session.generateRandom.reset_mock()
+
+        first = self.pool.get(self.session, 16)
+        second = self.pool.get(self.session, 16)
+
+        self.assertEqual(range(48, 64), first)
+        self.assertEqual(range(32, 48), second)
+        self.assertEqual(32, self.pool._available)
+        self.assertEqual(bytearray(range(32)) + bytearray(32),
+                         self.pool._buffer)
+        self.assertFalse(self.session.generateRandom.called)
+
+    def test_should_fill_buffer_in_place_and_wipe_fetched_bytes(self):
+        fetched = []
+        self.session.generateRandom.side_effect = (
+            lambda length: fetched.append(range(1, length + 1)) or
+            fetched[-1])
+        buffer = self.pool._buffer
+
+        self.pool._refill()
+        self.pool.get(self.session, 48)
+        self.pool._refill()
+
+        self.assertIs(buffer, self.pool._buffer)
+        self.assertEqual(64, len(buffer))
+        self.assertEqual([[0] * 64, [0] * 48], fetched)
+        self.assertEqual(bytearray(range(1, 17)) + bytearray(range(1, 49)),
+                         buffer)
+
+    def test_should_fetch_directly_when_buffer_is_short(self):
+        random_bytes = self.pool.get(self.session, 16)
+
+        self.assertEqual(range(16), random_bytes)
+        self.session.generateRandom.assert_called_once_with(16)
+        self.assertTrue(self.start_refill.called)
+
+    def test_should_refill_below_low_water(self):
+        self.pool._refill()
+        self.start_refill.reset_mock()
+
+        self.pool.get(self.session, 48)
+        self.assertFalse(self.start_refill.called)
+        self.pool.get(self.session, 1)
+        self.assertTrue(self.start_refill.called)
@@ -15,6 +15,7 @@
 
 import mock
 
+from barbican.common import utils as common_utils
 from barbican.plugin.interface import secret_store as str
 from barbican.tests import utils
 
@@ -197,3 +198,72 @@ class WhenTestingSecretStorePluginManager(utils.BaseTestCase):
                          self.manager.get_plugin_store(
                              key_spec=keySpec,
                              transport_key_needed=True))
+
+    def test_get_store_plugin_by_name(self):
+        plugin1 = TestSecretStore([str.KeyAlgorithm.AES])
+        plugin2 = TestSecretStoreWithTransportKey([str.KeyAlgorithm.AES])
+        self.manager.extensions = [mock.MagicMock(obj=plugin1),
+                                   mock.MagicMock(obj=plugin2)]
+        plugin_name = common_utils.generate_fullname_for(plugin2)
+
+        self.assertEqual(plugin2,
+                         self.manager.get_plugin_store(
+                             key_spec=None, plugin_name=plugin_name))
+
+    def test_get_store_plugin_by_name_not_found(self):
+        plugin = TestSecretStore([str.KeyAlgorithm.AES])
+        self.manager.extensions = [mock.MagicMock(obj=plugin)]
+        self.assertRaises(
+            str.SecretStorePluginNotFound,
+            self.manager.get_plugin_store,
+            key_spec=None,
+            plugin_name='no.such.Plugin',
+        )
+
+    def test_get_retrieve_plugin_reindexes_new_extensions(self):
+        plugin1 = TestSecretStore([str.KeyAlgorithm.AES])
+        self.manager.extensions = [mock.MagicMock(obj=plugin1)]
+        plugin_name = common_utils.generate_fullname_for(plugin1)
+        self.assertEqual(plugin1,
+                         self.manager.get_plugin_retrieve_delete(plugin_name))
+
+        plugin2 = TestSecretStoreWithTransportKey([str.KeyAlgorithm.AES])
+        self.manager.extensions = [mock.MagicMock(obj=plugin2)]
+        self.assertRaises(
+            str.SecretStorePluginNotFound,
+            self.manager.get_plugin_retrieve_delete,
+            plugin_name,
+        )
+        self.assertEqual(plugin2,
+                         self.manager.get_plugin_retrieve_delete(
+                             common_utils.generate_fullname_for(plugin2)))
+
+
+class WhenTestingSecretStorePluginManagerCache(utils.BaseTestCase):
+
+    def setUp(self):
+        super(WhenTestingSecretStorePluginManagerCache, self).setUp()
+        patcher = mock.patch(
+            'barbican.plugin.interface.secret_store.SecretStorePluginManager',
+            side_effect=lambda: mock.MagicMock()
+        )
+        self.manager_class = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.original_manager = str._SECRET_STORE
+        str._SECRET_STORE = None
+        self.addCleanup(setattr, str, '_SECRET_STORE', self.original_manager)
+
+    def test_get_manager_is_cached(self):
+        manager = str.get_manager()
+
+        self.assertIs(manager, str.get_manager())
+        self.assertEqual(1, self.manager_class.call_count)
+
+    def test_reload_manager_loads_new_instance(self):
+        manager = str.get_manager()
+        reloaded = str.reload_manager()
+
+        self.assertIsNot(manager, reloaded)
+        self.assertIs(reloaded, str.get_manager())
+        self.assertEqual(2, self.manager_class.call_count)
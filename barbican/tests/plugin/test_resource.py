@@ -13,9 +13,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from barbican.model import models
 import barbican.model.repositories as repo
 from barbican.plugin.interface import secret_store
 from barbican.plugin import resources
+from barbican.plugin import store_crypto
 import mock
 import testtools
 
@@ -43,8 +45,7 @@ class WhenTestingPluginResource(testtools.TestCase):
         }
 
         self.gen_plugin_patcher = mock.patch(
-            'barbican.plugin.interface.secret_store'
-            '.SecretStorePluginManager',
+            'barbican.plugin.interface.secret_store.get_manager',
             **gen_plugin_config
         )
         self.gen_plugin_patcher.start()
@@ -108,3 +109,168 @@ class WhenTestingPluginResource(testtools.TestCase):
                          call_count, 1)
         self.assertEqual(self.repos.container_secret_repo.create_from.
                          call_count, 2)
+
+
+class WhenGettingSecretsInBatch(testtools.TestCase):
+
+    def setUp(self):
+        super(WhenGettingSecretsInBatch, self).setUp()
+        self.tenant_model = mock.MagicMock()
+        self.retrieve_plugin = mock.MagicMock()
+        self.retrieve_plugin.get_secret.side_effect = (
+            lambda metadata: metadata['value'])
+
+        manager_patcher = mock.patch(
+            'barbican.plugin.interface.secret_store.get_manager',
+            **{'return_value.get_plugin_retrieve_delete.return_value':
+               self.retrieve_plugin}
+        )
+        manager_patcher.start()
+        self.addCleanup(manager_patcher.stop)
+
+    def _create_secret(self, secret_id, kek_id):
+        secret = models.Secret()
+        secret.id = secret_id
+        datum = models.EncryptedDatum()
+        datum.kek_id = kek_id
+        secret.encrypted_data = [datum]
+        for key, value in (('plugin_name', 'plugin'), ('value', secret_id)):
+            secret.secret_store_metadata[key] = models.SecretStoreMetadatum(
+                key, value)
+        return secret
+
+    def test_should_retrieve_secrets_grouped_by_kek(self):
+        secrets = [self._create_secret('s1', 'kek2'),
+                   self._create_secret('s2', 'kek1'),
+                   self._create_secret('s3', 'kek2')]
+
+        results = resources.get_secrets(secrets, self.tenant_model)
+
+        self.assertEqual(['s1', 's2', 's3'],
+                         [secret_dto for _, secret_dto, _, _ in results])
+        self.assertEqual(
+            ['s2', 's1', 's3'],
+            [args[0]['value'] for args, _ in
+             self.retrieve_plugin.get_secret.call_args_list])
+
+    def test_should_report_error_per_secret(self):
+        secrets = [self._create_secret('s1', 'kek1'),
+                   self._create_secret('s2', 'kek1')]
+        error = secret_store.SecretNotFoundException()
+        self.retrieve_plugin.get_secret.side_effect = [error, 'secret']
+
+        results = resources.get_secrets(secrets, self.tenant_model)
+
+        self.assertEqual((secrets[0], None), results[0][:2])
+        self.assertIs(error, results[0][3])
+        self.assertEqual('secret', results[1][1])
+        self.assertIsNone(results[1][3])
+        self.assertEqual({'plugin_name': 'plugin', 'value': 's1'},
+                         results[0][2])
+
+    def test_should_skip_deleted_secret_metadata(self):
+        secret = self._create_secret('s1', 'kek1')
+        secret.secret_store_metadata['plugin_name'].deleted = True
+
+        results = resources.get_secrets([secret], self.tenant_model)
+
+        self.assertEqual({'value': 's1'}, results[0][2])
+        self.retrieve_plugin.get_secret.assert_called_once_with(
+            {'value': 's1'})
+
+    def test_should_retrieve_crypto_adapter_secrets_together(self):
+        self.retrieve_plugin = mock.MagicMock(
+            spec=store_crypto.StoreCryptoAdapterPlugin)
+        self.retrieve_plugin.get_secrets.return_value = [('dto1', None),
+                                                         (None, 'error')]
+        secret_store.get_manager().get_plugin_retrieve_delete.return_value = (
+            self.retrieve_plugin)
+        secrets = [self._create_secret('s1', 'kek1'),
+                   self._create_secret('s2', 'kek1')]
+
+        results = resources.get_secrets(secrets, self.tenant_model)
+
+        self.assertEqual([(secrets[0], 'dto1', None),
+                          (secrets[1], None, 'error')],
+                         [(secret, secret_dto, error)
+                          for secret, secret_dto, _, error in results])
+        self.assertFalse(self.retrieve_plugin.get_secret.called)
+        args, kwargs = self.retrieve_plugin.get_secrets.call_args
+        self.assertEqual(['s1', 's2'],
+                         [metadata['value'] for metadata in args[0]])
+        self.assertEqual(secrets,
+                         [context.secret_model for context in args[1]])
+        self.assertIs(self.tenant_model, args[1][0].tenant_model)
+
+
+class WhenStoringSecretsInBulk(testtools.TestCase):
+
+    def setUp(self):
+        super(WhenStoringSecretsInBulk, self).setUp()
+        self.tenant_model = mock.MagicMock()
+        self.store_plugin = mock.MagicMock()
+        self.store_plugin.store_secret.return_value = {}
+
+        manager_patcher = mock.patch(
+            'barbican.plugin.interface.secret_store.get_manager')
+        self.plugin_manager = manager_patcher.start().return_value
+        self.plugin_manager.get_plugin_store.return_value = self.store_plugin
+        self.addCleanup(manager_patcher.stop)
+
+        self.repos = repo.Repositories(tenant_repo=mock.MagicMock(),
+                                       secret_repo=mock.MagicMock(),
+                                       tenant_secret_repo=mock.MagicMock(),
+                                       secret_meta_repo=mock.MagicMock())
+
+        self.specs = [
+            {'name': 'name{0}'.format(i), 'algorithm': 'AES',
+             'bit_length': 256, 'mode': 'CBC',
+             'payload': 'secret {0}'.format(i),
+             'payload_content_type': 'text/plain'}
+            for i in range(3)]
+
+    def test_should_store_secrets_in_order(self):
+        results = resources.store_secrets(self.specs, self.tenant_model,
+                                          self.repos)
+
+        self.assertEqual(['name0', 'name1', 'name2'],
+                         [secret.name for secret, _ in results])
+        self.assertEqual(3, self.store_plugin.store_secret.call_count)
+        self.assertEqual(3, self.repos.secret_repo.create_from.call_count)
+
+    def test_should_look_up_plugin_once_per_key_spec(self):
+        self.specs[2]['bit_length'] = 128
+
+        resources.store_secrets(self.specs, self.tenant_model, self.repos)
+
+        self.assertEqual(2, self.plugin_manager.get_plugin_store.call_count)
+
+    def test_should_write_secrets_in_one_unit_of_work(self):
+        units_of_work = []
+        self.repos.secret_repo.create_from.side_effect = (
+            lambda secret: units_of_work.append(
+                repo._REQUEST_STATE.deferred_sessions))
+
+        resources.store_secrets(self.specs, self.tenant_model, self.repos)
+
+        self.assertEqual(3, len(units_of_work))
+        self.assertIsNotNone(units_of_work[0])
+        self.assertTrue(all(unit is units_of_work[0]
+                            for unit in units_of_work))
+
+    def test_should_store_crypto_adapter_secrets_together(self):
+        self.store_plugin = mock.MagicMock(
+            spec=store_crypto.StoreCryptoAdapterPlugin)
+        self.store_plugin.store_secrets.return_value = [None] * 3
+        self.plugin_manager.get_plugin_store.return_value = self.store_plugin
+
+        results = resources.store_secrets(self.specs, self.tenant_model,
+                                          self.repos)
+
+        self.assertFalse(self.store_plugin.store_secret.called)
+        args, kwargs = self.store_plugin.store_secrets.call_args
+        self.assertEqual(['secret 0', 'secret 1', 'secret 2'],
+                         [secret_dto.secret for secret_dto in args[0]])
+        self.assertEqual([secret for secret, _ in results],
+                         [context.secret_model for context in args[1]])
+        self.assertEqual(3, self.repos.secret_repo.create_from.call_count)
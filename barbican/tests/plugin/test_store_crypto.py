@@ -15,6 +15,7 @@
 import base64
 import mock
 import testtools
+import time
 
 from barbican.common import utils
 from barbican.model import models
@@ -29,6 +30,7 @@ class TestSecretStoreBase(testtools.TestCase):
         super(TestSecretStoreBase, self).setUp()
 
         self.patchers = []  # List of patchers utilized in this test class.
+        self.addCleanup(store_crypto.get_kek_cache().clear)
 
         self.project_id = '12345'
         self.content_type = 'application/octet-stream'
@@ -65,8 +67,7 @@ class TestSecretStoreBase(testtools.TestCase):
 
         self.encrypted_datum_model = models.EncryptedDatum()
         self.encrypted_datum_model.kek_meta_tenant = self.kek_meta_tenant_model
-        self.encrypted_datum_model.cypher_text = base64.b64encode(
-            'cypher_text')
+        self.encrypted_datum_model.cypher_data = 'cypher_text'
         self.encrypted_datum_model.content_type = 'content_type'
         self.encrypted_datum_model.kek_meta_extended = 'extended_meta'
 
@@ -199,6 +200,37 @@ class WhenTestingStoreCrypto(TestSecretStoreBase):
 
         self.assertEqual(self.content_type, self.context.content_type)
 
+    def test_store_secrets_encrypts_in_one_batch(self):
+        contexts = [store_crypto.StoreCryptoContext(
+            self.tenant_model, secret_model=models.Secret())
+            for _ in range(2)]
+        secret_dtos = [
+            secret_store.SecretDTO(secret_store.SecretType.SYMMETRIC,
+                                   secret, secret_store.KeySpec(),
+                                   self.content_type)
+            for secret in ('secret1', 'secret2')]
+        self.encrypting_plugin.encrypt_batch.return_value = [
+            crypto.ResponseDTO('cypher1'), crypto.ResponseDTO('cypher2')]
+
+        response = self.plugin_to_test.store_secrets(secret_dtos, contexts)
+
+        self.assertEqual([None, None], response)
+        self.assertFalse(self.encrypting_plugin.encrypt.called)
+        args, kwargs = self.encrypting_plugin.encrypt_batch.call_args
+        self.assertEqual(['secret1', 'secret2'],
+                         [encrypt_dto.unencrypted for encrypt_dto in args[0]])
+        self.assertEqual((self.kek_meta_dto, self.project_id), args[1:])
+        self.assertEqual(
+            [(context, context.secret_model, self.kek_meta_tenant_model,
+              response_dto)
+             for context, response_dto in zip(
+                 contexts,
+                 self.encrypting_plugin.encrypt_batch.return_value)],
+            [call_args for call_args, _ in
+             self.store_secret_and_datum_mock.call_args_list])
+        self.assertEqual([self.content_type] * 2,
+                         [context.content_type for context in contexts])
+
     def test_get_secret(self):
         """Test getting a secret."""
 
@@ -233,8 +265,7 @@ class WhenTestingStoreCrypto(TestSecretStoreBase):
 
         self.assertIsInstance(test_decrypt, crypto.DecryptDTO)
         self.assertEqual(
-            base64.b64decode(self.encrypted_datum_model.cypher_text),
-            test_decrypt.encrypted)
+            self.encrypted_datum_model.cypher_data, test_decrypt.encrypted)
 
         self.assertIsInstance(test_kek_meta, crypto.KEKMetaDTO)
         self.assertEqual(
@@ -246,6 +277,76 @@ class WhenTestingStoreCrypto(TestSecretStoreBase):
 
         self.assertEqual(self.project_id, test_project_id)
 
+    def test_get_secret_stored_as_base64_text(self):
+        self.encrypted_datum_model.cypher_data = None
+        self.encrypted_datum_model.cypher_text = base64.b64encode(
+            'cypher_text')
+
+        self.plugin_to_test.get_secret(None, self.context)
+
+        args, kwargs = self.retrieving_plugin.decrypt.call_args
+        self.assertEqual('cypher_text', args[0].encrypted)
+
+    def _create_context(self, kek_id, cypher_data):
+        datum_model = models.EncryptedDatum()
+        datum_model.kek_id = kek_id
+        datum_model.kek_meta_tenant = self.kek_meta_tenant_model
+        datum_model.cypher_data = cypher_data
+        datum_model.content_type = 'content_type'
+        datum_model.kek_meta_extended = cypher_data + '-meta'
+        secret_model = models.Secret({'algorithm': 'myalg'})
+        secret_model.encrypted_data = [datum_model]
+        return store_crypto.StoreCryptoContext(
+            self.tenant_model, secret_model=secret_model)
+
+    def test_get_secrets_decrypts_each_kek_in_one_batch(self):
+        contexts = [self._create_context('kek1', 'c1'),
+                    self._create_context('kek2', 'c2'),
+                    self._create_context('kek1', 'c3')]
+        self.retrieving_plugin.decrypt_batch.side_effect = (
+            lambda dtos, kek_meta_dto, kek_meta_extendeds, keystone_id:
+            [dto.encrypted.upper() for dto in dtos])
+
+        results = self.plugin_to_test.get_secrets([None] * 3, contexts)
+
+        self.assertEqual(['C1', 'C2', 'C3'],
+                         [secret_dto.secret for secret_dto, _ in results])
+        self.assertEqual([None] * 3, [error for _, error in results])
+        self.assertEqual('myalg', results[0][0].key_spec.alg)
+        self.assertFalse(self.retrieving_plugin.decrypt.called)
+
+        calls = self.retrieving_plugin.decrypt_batch.call_args_list
+        self.assertEqual(2, len(calls))
+        args, kwargs = calls[0]
+        self.assertEqual(['c1', 'c3'], [dto.encrypted for dto in args[0]])
+        self.assertIsInstance(args[1], crypto.KEKMetaDTO)
+        self.assertEqual(['c1-meta', 'c3-meta'], args[2])
+        self.assertEqual(self.project_id, args[3])
+
+    def test_get_secrets_retrieves_one_at_a_time_if_batch_fails(self):
+        contexts = [self._create_context('kek1', 'c1'),
+                    self._create_context('kek1', 'c2')]
+        error = ValueError()
+        self.retrieving_plugin.decrypt_batch.side_effect = ValueError()
+        self.retrieving_plugin.decrypt.side_effect = [error, 'secret']
+
+        results = self.plugin_to_test.get_secrets([None] * 2, contexts)
+
+        self.assertEqual((None, error), results[0])
+        self.assertEqual('secret', results[1][0].secret)
+        self.assertIsNone(results[1][1])
+
+    def test_get_secrets_reports_secret_without_encrypted_data(self):
+        context = self._create_context('kek1', 'c1')
+        context.secret_model.encrypted_data = []
+
+        results = self.plugin_to_test.get_secrets([None], [context])
+
+        self.assertIsNone(results[0][0])
+        self.assertIsInstance(results[0][1],
+                              secret_store.SecretNotFoundException)
+        self.assertFalse(self.retrieving_plugin.decrypt_batch.called)
+
     def test_generate_symmetric_key(self):
         """test symmetric secret generation."""
         generation_type = crypto.PluginSupportTypes.SYMMETRIC_KEY_GENERATION
@@ -452,7 +553,8 @@ class WhenTestingStoreCrypto(TestSecretStoreBase):
         self.store_secret_and_datum_patcher = mock.patch(
             'barbican.plugin.store_crypto._store_secret_and_datum'
         )
-        self._start_patcher(self.store_secret_and_datum_patcher)
+        self.store_secret_and_datum_mock = self._start_patcher(
+            self.store_secret_and_datum_patcher)
 
     def _config_determine_generation_type_private_method(self, type_to_return):
         """Mock _determine_generation_type()."""
@@ -556,6 +658,49 @@ class WhenTestingStoreCryptoFindOrCreateKekObjects(TestSecretStoreBase):
         kek_model = args[0]
         self.assertEqual(self.kek_meta_tenant_model, kek_model)
 
+    def test_kek_resolved_once_per_store_cache(self):
+        self.kek_meta_tenant_model.bind_completed = True
+        plugin_inst = self
+        store_cache = {}
+
+        first = store_crypto._find_or_create_kek_objects(
+            plugin_inst, self.tenant_model, store_cache)
+        second = store_crypto._find_or_create_kek_objects(
+            plugin_inst, self.tenant_model, store_cache)
+
+        self.assertEqual(first, second)
+        self.assertEqual(
+            1, self.kek_repo.find_or_create_kek_datum.call_count)
+
+    def test_bound_kek_served_from_kek_cache(self):
+        self.kek_meta_tenant_model.id = 'kek-id'
+        self.kek_meta_tenant_model.tenant_id = self.tenant_model.id
+        self.kek_meta_tenant_model.bind_completed = True
+        plugin_inst = self
+        self.kek_meta_tenant_model.plugin_name = utils.generate_fullname_for(
+            plugin_inst)
+
+        store_crypto._find_or_create_kek_objects(plugin_inst,
+                                                 self.tenant_model)
+        kek_model, kek_meta_dto = store_crypto._find_or_create_kek_objects(
+            plugin_inst, self.tenant_model)
+
+        self.assertIsInstance(kek_model, store_crypto.CachedKEKDatum)
+        self.assertEqual('kek-id', kek_model.id)
+        self.assertEqual(
+            self.kek_meta_tenant_model.plugin_meta, kek_meta_dto.plugin_meta)
+        self._verify_kek_repository_interactions(plugin_inst)
+
+    def test_unbound_kek_not_cached(self):
+        self.kek_meta_tenant_model.tenant_id = self.tenant_model.id
+        self.kek_meta_tenant_model.bind_completed = False
+        plugin_inst = mock.MagicMock()
+
+        store_crypto._find_or_create_kek_objects(plugin_inst,
+                                                 self.tenant_model)
+
+        self.assertEqual(0, store_crypto.get_kek_cache().get_stats()['size'])
+
     def test_kek_raise_no_kek_bind_not_completed(self):
         self.kek_meta_tenant_model.bind_completed = False
         plugin_inst = mock.MagicMock()
@@ -631,6 +776,20 @@ class WhenTestingStoreCryptoStoreSecretAndDatum(TestSecretStoreBase):
         self.assertEqual(
             self.tenant_secret_repo.create_from.call_count, 0)
 
+    def test_with_cached_kek(self):
+        cached_kek = store_crypto.CachedKEKDatum(
+            'kek-id', 'label', 'plugin', None, None, None, None)
+
+        store_crypto._store_secret_and_datum(
+            self.context,
+            self.secret_model,
+            cached_kek,
+            self.response_dto)
+
+        self._verify_encrypted_datum_repository_interactions()
+        args, kwargs = self.datum_repo.create_from.call_args
+        self.assertEqual('kek-id', args[0].kek_id)
+
     def _verify_secret_repository_interactions(self):
         """Verify the secret repository interactions."""
         self.assertEqual(
@@ -660,8 +819,8 @@ class WhenTestingStoreCryptoStoreSecretAndDatum(TestSecretStoreBase):
         self.assertIsInstance(test_datum_model, models.EncryptedDatum)
         self.assertEqual(
             self.content_type, test_datum_model.content_type)
-        self.assertEqual(
-            base64.b64encode(self.cypher_text), test_datum_model.cypher_text)
+        self.assertEqual(self.cypher_text, test_datum_model.cypher_data)
+        self.assertIsNone(test_datum_model.cypher_text)
         self.assertEqual(
             self.response_dto.kek_meta_extended,
             test_datum_model.kek_meta_extended)
@@ -686,3 +845,65 @@ class WhenTestingStoreCryptoIndicateBindCompleted(TestSecretStoreBase):
             kek_meta_dto.mode, self.kek_meta_tenant_model.mode)
         self.assertEqual(
             kek_meta_dto.plugin_meta, self.kek_meta_tenant_model.plugin_meta)
+
+
+class WhenTestingKEKCache(testtools.TestCase):
+
+    def setUp(self):
+        super(WhenTestingKEKCache, self).setUp()
+        self.cache = store_crypto.KEKCache()
+        for name in ('kek_cache_size', 'kek_cache_ttl_seconds'):
+            self.addCleanup(store_crypto.CONF.clear_override, name)
+
+    def _kek(self, tenant_id, plugin_name='plugin'):
+        kek = models.KEKDatum()
+        kek.id = '{0}-{1}-kek'.format(tenant_id, plugin_name)
+        kek.tenant_id = tenant_id
+        kek.plugin_name = plugin_name
+        return kek
+
+    def test_should_cache_kek_per_tenant_and_plugin(self):
+        self.cache.put(self._kek('t1'))
+
+        cached = self.cache.get('t1', 'plugin')
+        self.assertEqual('t1-plugin-kek', cached.id)
+        self.assertIsNone(self.cache.get('t1', 'other-plugin'))
+        self.assertIsNone(self.cache.get('t2', 'plugin'))
+
+    def test_should_not_cache_if_disabled(self):
+        store_crypto.CONF.set_override('kek_cache_size', 0)
+
+        self.cache.put(self._kek('t1'))
+
+        self.assertEqual(0, self.cache.get_stats()['size'])
+
+    @mock.patch.object(time, 'time')
+    def test_should_expire_cached_kek(self, mock_time):
+        store_crypto.CONF.set_override('kek_cache_ttl_seconds', 60)
+        mock_time.return_value = 1000.0
+        self.cache.put(self._kek('t1'))
+
+        mock_time.return_value = 1060.0
+        self.assertIsNone(self.cache.get('t1', 'plugin'))
+        self.assertEqual(1, self.cache.get_stats()['expirations'])
+
+    def test_should_invalidate_all_plugins_of_tenant(self):
+        self.cache.put(self._kek('t1'))
+        self.cache.put(self._kek('t1', 'other-plugin'))
+        self.cache.put(self._kek('t2'))
+
+        self.cache.invalidate('t1')
+
+        self.assertIsNone(self.cache.get('t1', 'plugin'))
+        self.assertIsNone(self.cache.get('t1', 'other-plugin'))
+        self.assertIsNotNone(self.cache.get('t2', 'plugin'))
+        self.assertEqual(2, self.cache.get_stats()['invalidations'])
+
+    def test_should_invalidate_single_plugin(self):
+        self.cache.put(self._kek('t1'))
+        self.cache.put(self._kek('t1', 'other-plugin'))
+
+        self.cache.invalidate('t1', 'plugin')
+
+        self.assertIsNone(self.cache.get('t1', 'plugin'))
+        self.assertIsNotNone(self.cache.get('t1', 'other-plugin'))
@@ -196,3 +196,31 @@ class WhenUsingTaskServer(utils.BaseTestCase):
         queue.get_server.assert_called_with(target=self.target,
                                             endpoints=[self.server])
         self.server_mock.stop.assert_called_with()
+
+    def test_should_not_schedule_purge_by_default(self):
+        self.server.tg = mock.MagicMock()
+        self.server.start()
+        self.assertFalse(self.server.tg.add_timer.called)
+
+    def test_should_schedule_purge_if_configured(self):
+        server.CONF.set_override('purge_deleted_interval', 3600)
+        self.addCleanup(server.CONF.clear_override, 'purge_deleted_interval')
+        self.server.tg = mock.MagicMock()
+
+        self.server.start()
+
+        self.server.tg.add_timer.assert_called_once_with(
+            3600, self.server._purge_deleted_entities, initial_delay=3600)
+
+    @mock.patch('barbican.model.repositories.clear')
+    @mock.patch('barbican.model.repositories.rollback')
+    @mock.patch('barbican.model.repositories.purge_deleted_entities')
+    @mock.patch('barbican.model.repositories.start')
+    def test_purge_should_rollback_on_error(self, mock_start, mock_purge,
+                                            mock_rollback, mock_clear):
+        mock_purge.side_effect = ValueError()
+
+        self.server._purge_deleted_entities()
+
+        mock_rollback.assert_called_once_with()
+        mock_clear.assert_called_once_with()
@@ -20,9 +20,9 @@ from oslo.config import cfg
 
 from barbican.common import exception
 from barbican.common import resources as c_resources
-from barbican.model import models
 from barbican.model import repositories as rep
 from barbican.plugin import resources as plugin
+from barbican.plugin import store_crypto
 from barbican.tasks import keystone_consumer as consumer
 from barbican.tests.queue import test_keystone_listener as listener_test
 from barbican.tests import utils
@@ -187,6 +187,72 @@ class WhenUsingKeystoneEventConsumer(listener_test.UtilMixin,
                                self.repos.secret_meta_repo.get,
                                entity_id=secret_metadata_id)
 
+    def test_project_entities_cleanup_in_batches(self):
+        self._init_memory_db_setup()
+        self.opt_in_group(None, project_cleanup_batch_size=2,
+                          project_cleanup_commit_batches=True)
+        secrets = [self._create_secret_for_project(self.project1_data)
+                   for _ in range(3)]
+        other_secret_id = self._create_secret_for_project(
+            self.project2_data).id
+        project1_id = self.project1_data.id
+        project2_id = self.project2_data.id
+        meta_ids = [meta.id for secret in secrets
+                    for meta in secret.secret_store_metadata.values()]
+        self.assertTrue(meta_ids)
+        rep.commit()
+
+        task = consumer.KeystoneEventConsumer()
+        task.process(project_id=self.project_id1,
+                     resource_type='project',
+                     operation_type='deleted')
+
+        self.assertEqual(
+            [], self.repos.secret_repo.get_project_entities(project1_id))
+        self.assertEqual(
+            [], self.repos.tenant_repo.get_project_entities(project1_id))
+        for meta_id in meta_ids:
+            self.assertRaises(exception.NotFound,
+                              self.repos.secret_meta_repo.get,
+                              entity_id=meta_id)
+
+        db_secrets = self.repos.secret_repo.get_project_entities(project2_id)
+        self.assertEqual([other_secret_id], [s.id for s in db_secrets])
+
+    def test_project_cleanup_invalidates_cached_tenant(self):
+        self._init_memory_db_setup()
+        cache = c_resources.get_tenant_cache()
+        self.addCleanup(cache.clear)
+
+        # The second lookup finds the committed tenant and caches it.
+        rep.commit()
+        c_resources.get_or_create_tenant(self.project_id1,
+                                         self.repos.tenant_repo)
+        self.assertIsNotNone(cache.get(self.project_id1))
+
+        task = consumer.KeystoneEventConsumer()
+        task.process(project_id=self.project_id1,
+                     resource_type='project',
+                     operation_type='deleted')
+
+        self.assertIsNone(cache.get(self.project_id1))
+
+    def test_project_cleanup_invalidates_cached_kek(self):
+        self._init_memory_db_setup()
+        cache = store_crypto.get_kek_cache()
+        self.addCleanup(cache.clear)
+        tenant_id = self.repos.tenant_repo.find_by_keystone_id(
+            self.project_id1).id
+        cache.put(mock.MagicMock(tenant_id=tenant_id, plugin_name='plugin'))
+        rep.commit()
+
+        task = consumer.KeystoneEventConsumer()
+        task.process(project_id=self.project_id1,
+                     resource_type='project',
+                     operation_type='deleted')
+
+        self.assertIsNone(cache.get(tenant_id, 'plugin'))
+
     def test_project_entities_cleanup_for_no_matching_barbican_project(self):
         self._init_memory_db_setup()
 
@@ -205,7 +271,7 @@ class WhenUsingKeystoneEventConsumer(listener_test.UtilMixin,
                               operation_type='deleted')
         self.assertIsNone(result, 'No return is expected as result')
 
-    @mock.patch.object(models.Tenant, 'delete',
+    @mock.patch.object(rep.TenantRepo, '_do_delete_project_children',
                        side_effect=sqlalchemy.exc.SQLAlchemyError)
     def test_delete_project_entities_alchemy_error_suppress_exception_true(
             self, mock_entity_delete):
@@ -220,7 +286,7 @@ class WhenUsingKeystoneEventConsumer(listener_test.UtilMixin,
             project1_id, suppress_exception=True)
         self.assertIsNone(no_error)
 
-    @mock.patch.object(models.Tenant, 'delete',
+    @mock.patch.object(rep.TenantRepo, '_do_delete_project_children',
                        side_effect=sqlalchemy.exc.SQLAlchemyError)
     def test_delete_project_entities_alchemy_error_suppress_exception_false(
             self, mock_entity_delete):
@@ -7,6 +7,7 @@ import argparse
 sys.path.insert(0, os.getcwd())
 
 from barbican.model.migration import commands
+from barbican.model import repositories
 from barbican.openstack.common import log
 
 
@@ -24,6 +25,8 @@ class DatabaseManager:
         self.add_revision_args()
         self.add_downgrade_args()
         self.add_upgrade_args()
+        self.add_purge_args()
+        self.add_migrate_data_args()
 
     def get_main_parser(self):
         """Create top-level parser and arguments."""
@@ -65,6 +68,50 @@ class DatabaseManager:
                                    help='the version to downgrade back to.')
         create_parser.set_defaults(func=self.downgrade)
 
+    def add_purge_args(self):
+        """Create 'purge' command parser and arguments."""
+        create_parser = self.subparsers.add_parser('purge',
+                                                   help='Hard delete '
+                                                   'entities soft deleted '
+                                                   'a while ago.')
+        create_parser.add_argument('--age-in-days', '-a', type=int,
+                                   default=None,
+                                   help='purge entities deleted more than '
+                                        'this many days ago, or else '
+                                        'purge_deleted_age_days if not '
+                                        'specified.')
+        create_parser.add_argument('--batch-size', '-b', type=int,
+                                   default=None,
+                                   help='the number of rows deleted per '
+                                        'statement.')
+        create_parser.add_argument('--batch-interval', '-i', type=float,
+                                   default=None,
+                                   help='seconds to pause after each '
+                                        'batch.')
+        create_parser.set_defaults(func=self.purge)
+
+    def add_migrate_data_args(self):
+        """Create 'migrate_data' command parser and arguments."""
+        create_parser = self.subparsers.add_parser('migrate_data',
+                                                   help='Convert existing '
+                                                   'rows to the latest '
+                                                   'schema, online, after '
+                                                   'an upgrade.')
+        create_parser.add_argument('--batch-size', '-b', type=int,
+                                   default=1000,
+                                   help='the number of rows updated per '
+                                        'transaction.')
+        create_parser.add_argument('--batch-interval', '-i', type=float,
+                                   default=0,
+                                   help='seconds to pause after each '
+                                        'batch.')
+        create_parser.add_argument('--ciphertext-as-text',
+                                   action='store_true',
+                                   help='move ciphertext back to the base64 '
+                                        'text column, before downgrading '
+                                        'below revision 1c0f328bfce0.')
+        create_parser.set_defaults(func=self.migrate_data)
+
     def revision(self, args):
         """Process the 'revision' Alembic command."""
         commands.generate(autogenerate=args.autogenerate,
@@ -81,6 +128,36 @@ class DatabaseManager:
         commands.downgrade(to_version=args.version,
                            sql_url=args.dburl)
 
+    def purge(self, args):
+        """Process the 'purge' command."""
+        if args.dburl:
+            repositories.CONF.set_override('sql_connection', args.dburl)
+        # Purge the schema as it is, never create or upgrade it.
+        repositories.CONF.set_override('db_auto_create', False)
+        repositories.configure_db()
+        try:
+            repositories.purge_deleted_entities(
+                age_in_days=args.age_in_days,
+                batch_size=args.batch_size,
+                batch_interval=args.batch_interval)
+        finally:
+            repositories.clear()
+
+    def migrate_data(self, args):
+        """Process the 'migrate_data' command."""
+        if args.dburl:
+            repositories.CONF.set_override('sql_connection', args.dburl)
+        # Convert the schema as it is, never create or upgrade it.
+        repositories.CONF.set_override('db_auto_create', False)
+        repositories.configure_db()
+        try:
+            repositories.migrate_data(
+                batch_size=args.batch_size,
+                batch_interval=args.batch_interval,
+                ciphertext_as_text=args.ciphertext_as_text)
+        finally:
+            repositories.clear()
+
     def execute(self):
         """Parse the command line arguments."""
         args = self.parser.parse_args()
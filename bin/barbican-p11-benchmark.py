@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures the throughput of the PKCS11 crypto plugin at several levels of
+concurrency, to size the [p11_crypto_plugin] session_pool_size option.
+
+The HSM is configured from the [p11_crypto_plugin] section of the given
+configuration file. To try it against SoftHSM v2, initialize a token and point
+library_path at the SoftHSM library:
+
+    softhsm2-util --init-token --free --label barbican --pin 1234 --so-pin 1234
+    softhsm2-util --show-slots  # Use the token's slot id as slot_id.
+
+The 'random' and 'hmac' operations only need standard mechanisms, so they run
+against SoftHSM. The 'encrypt' operation uses the plugin's vendor specific
+AES-GCM mechanism.
+
+Example:
+
+    bin/barbican-p11-benchmark.py --config-file my-p11.conf --operation hmac
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'barbican', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+
+from barbican.plugin.crypto import crypto
+from barbican.plugin.crypto import p11_crypto
+from oslo.config import cfg
+
+
+def _random(p11_plugin, kek_meta_dto):
+    p11_plugin.session_pool.run(p11_plugin._generate_iv)
+
+
+def _hmac(p11_plugin, kek_meta_dto):
+    data = p11_crypto.PyKCS11.ckbytelist()
+    for x in range(48):
+        data.append(x)
+    p11_plugin.session_pool.run(p11_plugin._compute_hmac, data)
+
+
+def _encrypt(p11_plugin, kek_meta_dto):
+    response = p11_plugin.encrypt(crypto.EncryptDTO('0' * 32),
+                                  kek_meta_dto, None)
+    p11_plugin.decrypt(crypto.DecryptDTO(response.cypher_text), kek_meta_dto,
+                       response.kek_meta_extended, None)
+
+
+OPERATIONS = {
+    'random': _random,
+    'hmac': _hmac,
+    'encrypt': _encrypt,
+}
+
+
+def benchmark(p11_plugin, operation, kek_meta_dto, concurrency, seconds):
+    """Returns the number of operations completed per second."""
+    counts = [0] * concurrency
+    deadline = time.time() + seconds
+
+    def worker(index):
+        while time.time() < deadline:
+            operation(p11_plugin, kek_meta_dto)
+            counts[index] += 1
+
+    threads = [threading.Thread(target=worker, args=(index,))
+               for index in range(concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--config-file', required=True,
+                        help='Configuration file with a [p11_crypto_plugin] '
+                             'section.')
+    parser.add_argument('--operation', choices=sorted(OPERATIONS),
+                        default='encrypt')
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=[1, 4, 16])
+    parser.add_argument('--seconds', type=float, default=10.0,
+                        help='Duration of each run.')
+    args = parser.parse_args()
+
+    cfg.CONF(args=[], default_config_files=[args.config_file])
+    p11_plugin = p11_crypto.P11CryptoPlugin(cfg.CONF)
+    kek_meta_dto = crypto.KEKMetaDTO(argparse.Namespace(
+        kek_label='benchmark', plugin_name=None, algorithm=None,
+        bit_length=None, mode=None, plugin_meta=None))
+    if args.operation == 'encrypt':
+        p11_plugin.bind_kek_metadata(kek_meta_dto)
+
+    print('operation={0} session_pool_size={1}'.format(
+        args.operation, cfg.CONF.p11_crypto_plugin.session_pool_size))
+    for concurrency in args.concurrency:
+        rate = benchmark(p11_plugin, OPERATIONS[args.operation],
+                         kek_meta_dto, concurrency, args.seconds)
+        print('concurrency={0:<4d} ops/sec={1:.1f}'.format(
+            concurrency, rate))
+
+
+if __name__ == '__main__':
+    main()